@@ -0,0 +1,3 @@
+"""
+Benchmarks of bill calculation, see benchmarks.run.
+"""
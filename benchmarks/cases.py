@@ -0,0 +1,124 @@
+"""
+Benchmark tariffs and meter data.
+
+The tariffs mirror the fixture tariffs of tests/test_calculations.py and the meter data is either the fixture load
+data of tests/fixtures or synthetic load of a given duration, resolution and number of meters.
+"""
+import datetime
+import os
+
+import numpy
+import pandas
+from odin.codecs import dict_codec
+
+from tariffs.fleet import fleet_frame
+from tariffs.loaders import read_meter_data
+from tariffs.tariff import Tariff
+
+
+FIXTURE_LOAD_DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tests', 'fixtures',
+                                 'test_load_data.csv')
+
+PEAK = {"name": "peak", "periods": [{"from_weekday": 0, "to_weekday": 4, "from_hour": 14, "to_hour": 19}]}
+SUMMER = {"name": "summer", "from_month": 1, "from_day": 1, "to_month": 3, "to_day": 31}
+WINTER = {"name": "winter", "from_month": 4, "from_day": 1, "to_month": 12, "to_day": 31}
+
+TARIFFS = {
+    'block': {
+        "charges": [{"rate_bands": [{"limit": 10, "rate": 1.0}, {"rate": 1.0}]}],
+        "service": "electricity",
+        "billing_period": "monthly"
+    },
+    'seasonal': {
+        "charges": [{"rate": 1.0, "season": SUMMER}, {"rate": 1.0, "season": WINTER}],
+        "service": "electricity",
+        "billing_period": "monthly"
+    },
+    'tou': {
+        "charges": [
+            {"rate": 1.0, "time": PEAK},
+            {"rate": 1.0, "time": {"name": "shoulder", "periods": [
+                {"from_weekday": 0, "to_weekday": 4, "from_hour": 10, "to_hour": 13},
+                {"from_weekday": 0, "to_weekday": 4, "from_hour": 20, "to_hour": 21}]}},
+            {"rate": 1.0, "time": {"name": "off-peak", "periods": [
+                {"from_weekday": 0, "to_weekday": 4, "from_hour": 0, "from_minute": 0, "to_hour": 9, "to_minute": 59},
+                {"from_weekday": 0, "to_weekday": 4, "from_hour": 22, "from_minute": 0, "to_hour": 23,
+                 "to_minute": 59},
+                {"from_weekday": 5, "to_weekday": 6}]}}
+        ],
+        "service": "electricity",
+        "billing_period": "monthly"
+    },
+    'seasonal-tou': {
+        "charges": [
+            {"rate": 2.0, "season": SUMMER, "time": PEAK},
+            {"rate_bands": [{"limit": 100, "rate": 1.5}, {"rate": 0.5}], "season": WINTER, "time": PEAK}
+        ],
+        "service": "electricity",
+        "billing_period": "monthly"
+    },
+    'demand': {
+        "charges": [{"rate": 1.0, "type": "demand"}],
+        "service": "electricity",
+        "demand_window": "15min",
+        "billing_period": "monthly"
+    },
+    'scheduled': {
+        "charges": [{"rate_schedule": [{"datetime": "2018-01-01T00:00:00Z", "rate": 1.0},
+                                       {"datetime": "2018-06-01T00:30:00Z", "rate": 1.0},
+                                       {"datetime": "2018-12-31T01:00:00Z", "rate": 1.0}]}],
+        "service": "electricity"
+    },
+}
+
+DURATIONS = (
+    ('1d', 1),
+    ('30d', 30),
+    ('1y', 365),
+    ('10y', 3652),
+)
+
+RESOLUTIONS = ('5min', '15min', '30min')
+
+METERS = (1, 100, 1000, 10000)
+
+
+def load_tariff(name):
+    """Loads a benchmark tariff by name, see TARIFFS"""
+    return dict_codec.load(TARIFFS[name], Tariff)
+
+
+def fixture_meter_data():
+    """The fixture load data of the test suite, a year of flat 15 minute load"""
+    return read_meter_data(FIXTURE_LOAD_DATA)
+
+
+def synthetic_meter_data(days, resolution='15min', meters=1, start=datetime.datetime(2018, 1, 1), seed=0):
+    """
+        Generates meter data with a daily load shape, rooftop solar exports and random noise.
+
+        :param days: the number of days of meter data
+        :param resolution: the interval of the meter data, e.g. 5min
+        :param meters: the number of meters, a single meter giving meter data in the layout of Tariff.apply and more
+            giving fleet meter data (see fleet_frame)
+        :return: a DataFrame indexed by datetime
+    """
+    index = pandas.date_range(start, start + datetime.timedelta(days=days), freq=resolution, inclusive='left',
+                              name='datetime')
+    hours = ((index.hour + index.minute / 60.0).to_numpy())[:, numpy.newaxis]
+    interval_hours = pandas.Timedelta(resolution) / pandas.Timedelta('1h')
+    random = numpy.random.default_rng(seed)
+
+    # A morning and evening peak scaled per meter, and solar generation from 7am to 5pm
+    shape = 0.3 + 0.6 * numpy.exp(-(hours - 8.0) ** 2 / 2.0) + 1.2 * numpy.exp(-(hours - 18.5) ** 2 / 4.0)
+    solar = numpy.clip(numpy.sin((hours - 7.0) / 10.0 * numpy.pi), 0.0, None) * 2.0
+    scale = random.uniform(0.5, 2.0, meters)
+    imported = shape * scale * random.lognormal(0.0, 0.25, (len(index), meters)) * interval_hours
+    exported = solar * random.uniform(0.0, 1.0, meters) * interval_hours
+    net = imported - exported
+    values = numpy.stack([numpy.clip(net, 0.0, None), numpy.clip(-net, 0.0, None)], axis=-1)
+
+    registers = ('electricity_imported', 'electricity_exported')
+    if meters == 1:
+        return pandas.DataFrame(values[:, 0, :], index=index, columns=list(registers))
+    return fleet_frame(values, index, ['%05d' % meter for meter in range(meters)], registers)
@@ -0,0 +1,201 @@
+"""
+Benchmarks of Tariff.apply.
+
+Measures the wall time, peak memory and intervals per second of each benchmark tariff by engine and output format,
+over the fixture load data and synthetic meter data, and compares them against stored baselines:
+
+    python -m benchmarks.run                       # the quick suite, compared against benchmarks/baseline.json
+    python -m benchmarks.run --suite full          # every duration, resolution and number of meters
+    python -m benchmarks.run --save                # store the results as the new baseline
+
+A run fails if a case is slower or uses more memory than its baseline by more than the threshold. Baselines are
+machine-specific, so they should be saved and compared on the same machine.
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import pandas
+
+from benchmarks.cases import DURATIONS, METERS, RESOLUTIONS, TARIFFS, fixture_meter_data, load_tariff, \
+    synthetic_meter_data
+from tariffs.fleet import apply_fleet
+
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+OUTPUT_FORMATS = ('total', 'total-components', 'input-timestep')
+
+FLEET_OUTPUT_FORMATS = ('total', 'total-components')
+
+# The row-by-row engine is only benchmarked on single meters up to this many intervals
+LOOP_MAX_INTERVALS = 35040
+
+# Synthetic cases larger than this many meter intervals are skipped
+MAX_METER_INTERVALS = 5 * 10 ** 7
+
+
+def measure(function, repeat=3):
+    """
+        Measures a function call.
+
+        :return: the best wall time in seconds of repeat calls and the peak memory in bytes traced during an
+            additional call
+    """
+    wall = None
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - started
+        wall = elapsed if wall is None else min(wall, elapsed)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        function()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return wall, peak_memory
+
+
+def cases(suite='quick'):
+    """
+        Yields the benchmark cases of a suite as (data name, meter data loader, number of meters) tuples.
+
+        :param suite: 'quick' for the fixture load data and a month of 5 minute data for a single meter and 100
+            meters, or 'full' for every duration, resolution and number of meters
+    """
+    yield 'fixture', fixture_meter_data, 1
+    if suite == 'quick':
+        grid = [('30d', 30, '5min', 1), ('30d', 30, '5min', 100)]
+    elif suite == 'full':
+        grid = [(duration, days, resolution, meters) for duration, days in DURATIONS for resolution in RESOLUTIONS
+                for meters in METERS]
+    else:
+        raise UserWarning('Unsupported benchmark suite: %s' % suite)
+
+    for duration, days, resolution, meters in grid:
+        intervals = days * pandas.Timedelta('1d') // pandas.Timedelta(resolution)
+        if intervals * meters > MAX_METER_INTERVALS:
+            continue
+        yield '%s-%s-%dm' % (duration, resolution, meters), \
+            lambda days=days, resolution=resolution, meters=meters: synthetic_meter_data(days, resolution, meters), \
+            meters
+
+
+def run(suite='quick', tariffs=None, repeat=3):
+    """
+        Runs a benchmark suite.
+
+        :param tariffs: the names of the benchmark tariffs to run, by default all of them
+        :return: a DataFrame with the wall time, peak memory and intervals per second of each case
+    """
+    records = []
+    for data, loader, meters in cases(suite):
+        meter_data = loader()
+        intervals = len(meter_data)
+        for name in tariffs or sorted(TARIFFS):
+            tariff = load_tariff(name)
+            # Each call bills a shallow copy, so that resampling memoized by an earlier call isn't reused
+            if meters > 1:
+                calls = [('vectorized', output_format,
+                          lambda output_format=output_format: apply_fleet(tariff, meter_data.copy(deep=False),
+                                                                          output_format=output_format))
+                         for output_format in FLEET_OUTPUT_FORMATS]
+            else:
+                engines = ['vectorized'] + (['loop'] if intervals <= LOOP_MAX_INTERVALS else [])
+                calls = [(engine, output_format,
+                          lambda engine=engine, output_format=output_format: tariff.apply(
+                              meter_data.copy(deep=False), output_format=output_format, engine=engine))
+                         for engine in engines for output_format in OUTPUT_FORMATS
+                         if not (output_format == 'input-timestep' and 'demand' in tariff.charge_types)]
+
+            for engine, output_format, call in calls:
+                wall, peak_memory = measure(call, repeat=1 if engine == 'loop' else repeat)
+                records.append({
+                    'case': '/'.join((data, name, engine, output_format)),
+                    'data': data,
+                    'tariff': name,
+                    'engine': engine,
+                    'output_format': output_format,
+                    'meters': meters,
+                    'intervals': intervals,
+                    'wall': wall,
+                    'peak_memory': peak_memory,
+                    'intervals_per_second': intervals * meters / wall,
+                })
+    return pandas.DataFrame.from_records(records, index='case')
+
+
+def read_baseline(path=DEFAULT_BASELINE):
+    """Reads stored baselines keyed by case, or None if there are none"""
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_baseline(results, path=DEFAULT_BASELINE):
+    """Stores the wall time and peak memory of each case of benchmark results as baselines"""
+    baseline = dict((case, {'wall': row['wall'], 'peak_memory': int(row['peak_memory'])})
+                    for case, row in results.iterrows())
+    with open(path, 'w') as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+
+
+def regressions(results, baseline, threshold=0.25):
+    """
+        Compares benchmark results against baselines.
+
+        :param threshold: the relative increase in wall time or peak memory over the baseline treated as a regression
+        :return: a DataFrame of the cases with a regression, their baselines and measurements
+    """
+    rows = []
+    for case, row in results.iterrows():
+        if case not in baseline:
+            continue
+        for measurement in ('wall', 'peak_memory'):
+            expected = baseline[case][measurement]
+            if row[measurement] > expected * (1.0 + threshold):
+                rows.append({'case': case, 'measurement': measurement, 'baseline': expected,
+                             'result': row[measurement], 'ratio': row[measurement] / expected})
+    return pandas.DataFrame(rows, columns=['case', 'measurement', 'baseline', 'result', 'ratio'])
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Benchmark Tariff.apply across tariffs, engines and data sizes')
+    parser.add_argument('--suite', choices=('quick', 'full'), default='quick')
+    parser.add_argument('--tariff', action='append', choices=sorted(TARIFFS), help='benchmark only these tariffs')
+    parser.add_argument('--repeat', type=int, default=3, help='calls per case, the best wall time being kept')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='the baseline file')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='the relative increase over the baseline that fails the run')
+    parser.add_argument('--save', action='store_true', help='store the results as the baseline')
+    options = parser.parse_args(args)
+
+    results = run(options.suite, options.tariff, options.repeat)
+    print(results[['wall', 'peak_memory', 'intervals_per_second']].to_string())
+
+    if options.save:
+        write_baseline(results, options.baseline)
+        return 0
+    baseline = read_baseline(options.baseline)
+    if baseline is None:
+        print('No baseline at %s, run with --save to store one' % options.baseline)
+        return 0
+    found = regressions(results, baseline, options.threshold)
+    if len(found):
+        print('Regressions beyond %d%% of the baseline:' % (options.threshold * 100))
+        print(found.to_string(index=False))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
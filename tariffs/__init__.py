@@ -3,4 +3,16 @@ __author_email__ = "john.mckibbin@gmail.com"
 __copyright__ = "Copyright (C) 2018 John McKibbin"
 __version__ = "0.1"
 
-from tariff import Tariff  # noqa
+from tariffs.tariff import Tariff  # noqa
+from tariffs.bill import Bill  # noqa
+from tariffs.portfolio import apply_many  # noqa
+from tariffs.fleet import apply_fleet, fleet_frame  # noqa
+from tariffs.scenarios import apply_scenarios, offset_scenarios  # noqa
+from tariffs.parallel import ParallelRunner  # noqa
+from tariffs.streaming import BillAccumulator  # noqa
+from tariffs.instrumentation import Profiler  # noqa
+from tariffs.library import TariffLibrary  # noqa
+from tariffs.prices import marginal_prices  # noqa
+from tariffs.ranking import rank_tariffs  # noqa
+from tariffs.results import ResultCache  # noqa
+from tariffs.compact import CompactMeterData, apply_compact  # noqa
@@ -0,0 +1,124 @@
+"""
+Bills, the cost of each charge component of a tariff held in one preallocated array.
+
+The costs of a bill have a row per charge component and a column per row of the meter data as billed (each interval,
+day or billing period, as resampled for the tariff's consumption charges), with a further axis per meter for fleet
+meter data. Demand charges, costed per billing period, are costed against the first row of each billing period. The
+output formats of Tariff.apply are views, or reductions along an axis, of the one array.
+"""
+from collections import OrderedDict, namedtuple
+
+import numpy
+import pandas
+
+from tariffs.demand import billing_periods
+from tariffs.plan import component_name
+
+
+BILL_OUTPUT_FORMAT_CHOICES = (
+    ('total', 'total'),
+    ('total-components', 'total-components'),
+    ('billing-period', 'billing-period'),
+    ('billing-period-components', 'billing-period-components'),
+    ('input-timestep', 'input-timestep'),
+    ('input-timestep-components', 'input-timestep-components'),
+)
+
+
+Component = namedtuple('Component', ('name', 'code', 'type', 'season', 'time', 'meter'))
+
+
+def bill_components(tariff):
+    """The Component of each charge component of a tariff, in the order of its billing plan"""
+    components = OrderedDict((name, None) for name in tariff.compile().components)
+    for charge in tariff.charges or ():
+        name = component_name(charge, tariff.service)
+        if name is not None and components.get(name) is None:
+            components[name] = Component(name, charge.code, charge.type, charge.season.name if charge.season else None,
+                                         charge.time.name if charge.time else None, charge.meter)
+    return tuple(components.values())
+
+
+class Bill(object):
+    """
+        The cost of each charge component of a tariff given a load, created by Tariff.bill().
+
+        :param components: the Component of each charge component
+        :param features: the CalendarFeatures of the meter data as billed
+        :param billing_period: the billing period of the tariff
+        :param meters: the meter ids of fleet meter data, otherwise None
+    """
+
+    def __init__(self, components, features, billing_period, meters=None):
+        self.components = tuple(components)
+        self.index = features.index
+        self.meters = meters
+        if len(features):
+            self.starts, self.periods, _ = billing_periods(features, billing_period)
+        else:
+            self.starts, self.periods = numpy.zeros(0, dtype=int), features.index
+        shape = (len(self.components), len(self.index)) + ((len(meters),) if meters is not None else ())
+        self.costs = numpy.zeros(shape)
+        self._positions = dict((component.name, position) for position, component in enumerate(self.components))
+
+    @property
+    def names(self):
+        return [component.name for component in self.components]
+
+    def add(self, name, costs, periods=None):
+        """
+            Accumulates costs into a charge component, either the cost of each row or, given the start of each billing
+            period, the cost of each billing period.
+        """
+        row = self.costs[self._positions[name]]
+        if periods is None:
+            row += numpy.asarray(costs, dtype=float).reshape(row.shape)
+        elif len(periods):
+            positions = numpy.minimum(self.index.searchsorted(periods), len(self.index) - 1)
+            numpy.add.at(row, positions, costs)
+
+    def component(self, name):
+        """A view of the costs of a charge component"""
+        return self.costs[self._positions[name]]
+
+    def total(self):
+        """The total cost, of every meter for fleet meter data"""
+        return float(self.costs.sum())
+
+    def component_totals(self):
+        """The total cost of each charge component, with a column per meter for fleet meter data"""
+        return self.costs.sum(axis=1)
+
+    def period_costs(self):
+        """The cost of each charge component and billing period, with a further axis per meter for fleet meter data"""
+        if not len(self.starts):
+            return self.costs[:, :0]
+        return numpy.add.reduceat(self.costs, self.starts, axis=1)
+
+    def output(self, output_format='total'):
+        """
+            The bill in one of the output formats of Tariff.apply.
+
+            :param output_format: 'total', 'total-components', or 'billing-period', 'input-timestep' and their
+                components, which require the meter data of a single meter
+            :return: the total, a dictionary of the total of each charge component, or a Series or DataFrame with a
+                row per billing period or billed row
+        """
+        if output_format not in dict(BILL_OUTPUT_FORMAT_CHOICES):
+            raise UserWarning('Unsupported output format: %s' % output_format)
+        if output_format == 'total':
+            return self.total()
+        if output_format == 'total-components':
+            return OrderedDict((name, float(total)) for name, total in zip(self.names, self.component_totals().reshape(
+                len(self.components), -1).sum(axis=1)))
+        if self.meters is not None:
+            raise UserWarning("The output_format '%s' requires the meter data of a single meter" % output_format)
+
+        if output_format.startswith('billing-period'):
+            index, costs = self.periods, self.period_costs()
+        else:
+            index, costs = self.index, self.costs
+        if output_format.endswith('components'):
+            # The transpose is a view, each component being a column
+            return pandas.DataFrame(costs.T, index=index, columns=self.names, copy=False)
+        return pandas.Series(costs.sum(axis=0), index=index)
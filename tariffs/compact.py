@@ -0,0 +1,142 @@
+"""
+Memory-lean bill calculation of long meter data.
+
+CompactMeterData holds meter data as a datetime64 index and a float32 array per register, laid out in one block so
+that a DataFrame of any range of its rows is a view rather than a copy. apply_compact bills it a number of billing
+periods at a time, so the calendar fields, resampled meter data and cost arrays of the calculation are only allocated
+for one chunk at a time rather than for years of meter data at once. The peak memory of each call is reported to the
+active Profiler, e.g. to size workers.
+"""
+from collections import OrderedDict
+
+import numpy
+import pandas
+
+from tariffs.bill import BILL_OUTPUT_FORMAT_CHOICES
+from tariffs.instrumentation import count, phase, trace_memory
+from tariffs.meter import MeterData
+
+
+# The datetime64 units truncating timestamps to the billing cycles of block charges (see billing_cycles), quarters
+# being counted in months
+PERIOD_UNITS = {
+    'daily': 'D',
+    'monthly': 'M',
+    'quarterly': 'M',
+    'annually': 'Y',
+}
+
+
+class CompactMeterData(object):
+    """
+        Meter data held as a datetime64 index and a register array per column.
+
+        :param index: a DatetimeIndex or datetime64 array in chronological order
+        :param values: an array with a row per column and a value per timestamp, e.g. of float32
+        :param columns: the register of each row of values, or (meter, register) tuples for fleet meter data
+    """
+
+    def __init__(self, index, values, columns):
+        self.index = pandas.DatetimeIndex(index)
+        self.values = numpy.asarray(values)
+        self.columns = pandas.Index(columns)
+        if self.values.shape != (len(self.columns), len(self.index)):
+            raise UserWarning('Meter data values of shape %s do not match %d columns and %d timestamps' % (
+                self.values.shape, len(self.columns), len(self.index)))
+
+    @classmethod
+    def from_frame(cls, frame, dtype=numpy.float32):
+        """Copies a meter data DataFrame, casting each column in place into a single array"""
+        values = numpy.empty((frame.shape[1], len(frame)), dtype=dtype)
+        for position, (_, column) in enumerate(frame.items()):
+            values[position] = column.to_numpy()
+        return cls(frame.index, values, frame.columns)
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def nbytes(self):
+        """The memory held by the index and values in bytes"""
+        return self.index.nbytes + self.values.nbytes
+
+    def frame(self, start=None, stop=None):
+        """A DataFrame of a range of rows, viewing rather than copying the values"""
+        # The transpose is a view, each column being a row of values
+        return pandas.DataFrame(self.values[:, start:stop].T, index=self.index[start:stop], columns=self.columns,
+                                copy=False)
+
+    def truncate(self, before=None, after=None):
+        """Selects the meter data between two optional datetimes, as a view"""
+        start = self.index.searchsorted(pandas.Timestamp(before)) if before is not None else 0
+        stop = self.index.searchsorted(pandas.Timestamp(after), side='right') if after is not None else len(self)
+        return type(self)(self.index[start:stop], self.values[:, start:stop], self.columns)
+
+    def chunks(self, billing_period, periods=1):
+        """
+            Splits the rows into consecutive runs of billing periods.
+
+            :param billing_period: the billing period of a tariff, meter data being split wherever its block charges
+                would restart their accumulation. Other billing periods are not split
+            :param periods: the number of billing periods in each chunk
+            :return: the start and stop position of each chunk
+        """
+        unit = PERIOD_UNITS.get(billing_period)
+        if unit is None or not len(self):
+            return [(0, len(self))]
+        # Billing periods are of local times
+        index = self.index.tz_localize(None) if self.index.tz is not None else self.index
+        labels = index.values.astype('datetime64[%s]' % unit).view('int64')
+        if billing_period == 'quarterly':
+            labels = labels // 3
+        starts = numpy.concatenate(([0], numpy.flatnonzero(labels[1:] != labels[:-1]) + 1))[::periods]
+        return list(zip(starts.tolist(), starts[1:].tolist() + [len(self)]))
+
+
+def _combine(results, output_format):
+    if output_format == 'total':
+        return sum(results[1:], results[0])
+    if output_format == 'total-components':
+        return OrderedDict((name, sum(result[name] for result in results)) for name in results[0])
+    return pandas.concat(results)
+
+
+def apply_compact(tariff, meter_data, start=None, end=None, output_format='total', chunk_periods=1):
+    """
+        Calculates the cost of energy given a tariff and load, as Tariff.apply, billing a number of billing periods of
+        compact meter data at a time with the vectorized engine.
+
+        Rolling demand windows and ratchets carry demand between billing periods, so require chunk_periods of None.
+
+        :param tariff: a Tariff resource
+        :param meter_data: a CompactMeterData, or a meter data DataFrame to copy into one
+        :param start: an optional datetime to select the commencement of the bill calculation
+        :param end: an optional datetime to select the termination of the bill calculation
+        :param output_format: one of BILL_OUTPUT_FORMAT_CHOICES
+        :param chunk_periods: the number of billing periods billed at a time, or None to bill all at once
+        :return: the bill in the output format, as Tariff.apply
+    """
+    if output_format not in dict(BILL_OUTPUT_FORMAT_CHOICES):
+        raise UserWarning('Unsupported output format: %s' % output_format)
+    plan = tariff.compile()
+    if chunk_periods is not None and 'demand' in plan.charge_types and (
+            plan.demand_window_type == 'rolling' or any(charge.ratchet is not None for charge in plan.charges)):
+        raise UserWarning('Rolling demand windows and ratchets span billing periods, bill them with chunk_periods of '
+                          'None')
+    if not isinstance(meter_data, CompactMeterData):
+        meter_data = CompactMeterData.from_frame(meter_data)
+    meter_data = meter_data.truncate(before=start, after=end)
+
+    with phase('compact', rows=len(meter_data), nbytes=meter_data.nbytes, output_format=output_format) as record:
+        with trace_memory(record):
+            if chunk_periods is None:
+                chunks = [(0, len(meter_data))]
+            else:
+                chunks = meter_data.chunks(plan.billing_period, chunk_periods)
+            results = []
+            for chunk_start, chunk_stop in chunks:
+                count('chunk', rows=chunk_stop - chunk_start)
+                # A MeterData of its own, as the chunk's resampled meter data isn't used again
+                results.append(tariff.apply(MeterData(meter_data.frame(chunk_start, chunk_stop)),
+                                            output_format=output_format))
+            return _combine(results, output_format)
@@ -0,0 +1,297 @@
+"""
+Demand charges.
+
+Demand charges are billed against the peak demand of each billing period. Demand is the mean load over a demand
+window, either fixed windows (e.g. each half hour) or rolling windows starting at every interval of the meter data,
+and the peak of each charge is taken over the windows starting within its seasons and time-of-use periods. Ratcheted
+charges bill at least a percentage of the highest peak of a number of preceding billing periods. Every step is
+evaluated over whole arrays, with a column per meter for fleet meter data, and the timestamp of each billed peak is
+kept so that it can be reported.
+"""
+import numpy
+import pandas
+from numpy.lib.stride_tricks import sliding_window_view
+from pandas.tseries.frequencies import to_offset
+
+from tariffs.instrumentation import active, count
+from tariffs.plan import CalendarFeatures, band_rates, billing_cycles, block_costs, by_interval, register_values
+
+
+PERIOD_TO_FREQUENCY = {
+    'daily': 'D',
+    'monthly': 'M',
+    'quarterly': 'Q',
+    'annually': 'Y',
+}
+
+
+def interval(index):
+    """The most common interval between the timestamps of a DatetimeIndex"""
+    steps = numpy.diff(index.asi8)
+    if not len(steps):
+        raise UserWarning('Rolling demand windows require meter data of at least two intervals')
+    values, counts = numpy.unique(steps, return_counts=True)
+    return pandas.Timedelta(values[numpy.argmax(counts)])
+
+
+def rolling_mean(values, length):
+    """The mean of each run of length consecutive rows, a row per run starting row"""
+    cumulative = numpy.concatenate((numpy.zeros_like(values[:1]), numpy.cumsum(values, axis=0)))
+    return (cumulative[length:] - cumulative[:-length]) / length
+
+
+class DemandWindows(object):
+    """
+        The demand of each demand window of meter data, along with the calendar features of the window starts.
+
+        :param meter_data: a MeterData instance
+        :param rule: the resampling rule of the demand window, e.g. 30min
+        :param rolling: whether windows start at every interval of the meter data rather than every window length
+    """
+
+    def __init__(self, meter_data, rule, rolling=False):
+        if rolling:
+            frame = meter_data.frame
+            length = pandas.Timedelta(to_offset(rule)) / interval(frame.index)
+            if length < 1 or length != int(length):
+                raise UserWarning('A rolling %s demand window is not a whole number of meter data intervals' % rule)
+            self.length = int(length)
+            self.index = frame.index[:max(len(frame) - self.length + 1, 0)]
+            self.features = CalendarFeatures(self.index)
+        else:
+            steps = ((rule, 'mean'),)
+            frame = meter_data.resample(*steps)
+            # Resampling fills gaps in the meter data with empty windows, which belong to no billing period
+            empty = frame.isna().all(axis=1).to_numpy()
+            if empty.any():
+                frame = frame[~empty]
+                self.features = CalendarFeatures(frame.index)
+            else:
+                self.features = meter_data.features(*steps)
+            self.index = frame.index
+        self.frame = frame
+        self.rolling = rolling
+        self._values = dict()
+
+    def __len__(self):
+        return len(self.index)
+
+    def values(self, register):
+        """The demand of each window for a register, with a column per meter for fleet meter data"""
+        values = self._values.get(register)
+        if values is None:
+            values = register_values(self.frame, register)
+            if self.rolling:
+                values = rolling_mean(values, self.length) if len(self.index) else values[:0]
+            self._values[register] = values
+        return values
+
+
+def billing_periods(features, billing_period):
+    """
+        Groups timestamps, e.g. the starts of demand windows, by the billing period they fall within.
+
+        :param features: the CalendarFeatures of the timestamps
+        :return: the position of the first timestamp of each billing period, the start of each billing period and the
+            consecutive ordinal of each billing period
+    """
+    cycles = billing_cycles(features, billing_period)
+    starts = numpy.concatenate(([0], numpy.flatnonzero(cycles[1:] != cycles[:-1]) + 1))
+    frequency = PERIOD_TO_FREQUENCY.get(billing_period)
+    if frequency is None:
+        return starts, features.index[starts], numpy.arange(len(starts))
+    first = features.index[starts]
+    if first.tz is not None:
+        # Periods are of local times, their starts being localized back to the timezone of the timestamps
+        period_index = first.tz_localize(None).to_period(frequency)
+        period_starts = period_index.start_time.tz_localize(first.tz, ambiguous=numpy.ones(len(first), dtype=bool),
+                                                            nonexistent='shift_forward')
+        return starts, period_starts, period_index.asi8
+    # Truncating the timestamps gives the ordinals of pandas periods, quarters being counted in months
+    unit = 'M' if billing_period == 'quarterly' else frequency
+    ordinals = first.values.astype('datetime64[%s]' % unit).astype('int64')
+    if billing_period == 'quarterly':
+        ordinals //= 3
+        periods = (ordinals * 3).astype('datetime64[M]')
+    else:
+        periods = ordinals.astype('datetime64[%s]' % unit)
+    return starts, pandas.DatetimeIndex(periods.astype('datetime64[ns]')), ordinals
+
+
+def period_peaks(values, eligible, starts):
+    """
+        Finds the peak of each billing period over its eligible windows.
+
+        :param values: the demand of each window, with a column per meter for fleet meter data
+        :param eligible: a boolean array marking the windows eligible for the peak
+        :param starts: the position of the first window of each billing period
+        :return: the peak demand of each billing period (zero if it has no eligible windows) and the position of the
+            window of each peak (-1 if it has no eligible windows)
+    """
+    masked = numpy.where(by_interval(eligible, values) & ~numpy.isnan(values), values, -numpy.inf)
+    peaks = numpy.maximum.reduceat(masked, starts, axis=0)
+    group = numpy.repeat(numpy.arange(len(starts)), numpy.diff(numpy.append(starts, len(values))))
+    positions = by_interval(numpy.arange(len(values)), values)
+    # The first window reaching the peak of its billing period
+    candidates = numpy.where(masked == peaks[group], positions, len(values))
+    peak_positions = numpy.minimum.reduceat(candidates, starts, axis=0)
+    missing = numpy.isneginf(peaks)
+    return numpy.where(missing, 0.0, peaks), numpy.where(missing, -1, peak_positions)
+
+
+def ratchet_peaks(peaks, ordinals, periods):
+    """
+        Finds the highest peak of the preceding billing periods of each billing period.
+
+        :param peaks: the peak demand of each billing period, with a column per meter for fleet meter data
+        :param ordinals: the consecutive ordinal of each billing period, gaps being periods without meter data
+        :param periods: the number of preceding billing periods
+        :return: the highest preceding peak (zero if there is none) and the billing period it occurred in (-1 if
+            there is none)
+    """
+    offsets = ordinals - ordinals[0]
+    dense = numpy.full((offsets[-1] + 1,) + peaks.shape[1:], -numpy.inf)
+    dense[offsets] = peaks
+    padded = numpy.concatenate((numpy.full((periods,) + peaks.shape[1:], -numpy.inf), dense))
+    # The preceding periods of each dense period d are padded[d:d + periods]
+    history = sliding_window_view(padded, periods, axis=0)[:len(dense)]
+    highest = history.max(axis=-1)[offsets]
+    source = (offsets.reshape(offsets.shape + (1,) * (peaks.ndim - 1)) - periods +
+              history.argmax(axis=-1)[offsets])
+    # Map the dense source period back to its billing period
+    positions = numpy.full(len(dense), -1)
+    positions[offsets] = numpy.arange(len(offsets))
+    missing = numpy.isneginf(highest)
+    return numpy.where(missing, 0.0, highest), numpy.where(missing, -1, positions[numpy.clip(source, 0, None)])
+
+
+class DemandCharge(object):
+    """
+        The billed demand and cost of each billing period of a demand charge.
+
+        Arrays have a row per billing period and a column per meter for fleet meter data. Timestamps are those of the
+        start of the demand window of each peak, NaT where a billing period has no eligible windows.
+    """
+    __slots__ = ('charge', 'periods', 'peak', 'peak_timestamp', 'billed', 'billed_timestamp', 'ratcheted', 'costs')
+
+    def __init__(self, charge, periods, peak, peak_timestamp, billed, billed_timestamp, ratcheted, costs):
+        self.charge = charge
+        self.periods = periods
+        self.peak = peak
+        self.peak_timestamp = peak_timestamp
+        self.billed = billed
+        self.billed_timestamp = billed_timestamp
+        self.ratcheted = ratcheted
+        self.costs = costs
+
+
+def _timestamps(index, positions):
+    return numpy.where(positions >= 0, index.values[numpy.clip(positions, 0, None)], numpy.datetime64('NaT'))
+
+
+def _costs(charge, billed, periods):
+    if charge.schedule is not None:
+        rates = by_interval(charge.schedule.rates_at(periods), billed)
+        return numpy.where(numpy.isnan(rates), 0.0, rates * billed)
+    costs = numpy.zeros(billed.shape)
+    if charge.rate:
+        costs += charge.rate * billed
+    if charge.band_limits is not None:
+        # Each billing period's demand is apportioned to the rate bands on its own
+        costs += block_costs(billed, numpy.ones(len(billed), dtype=bool), numpy.arange(len(billed)),
+                             charge.band_limits, charge.band_rates)
+    return costs
+
+
+def shadow_prices(demand_charge):
+    """
+        The change in the cost of each billing period of a demand charge per unit change of its peak demand, nothing
+        where the billed demand was set by the ratchet.
+    """
+    charge, billed = demand_charge.charge, demand_charge.billed
+    if charge.schedule is not None:
+        rates = by_interval(charge.schedule.rates_at(demand_charge.periods), billed)
+        rates = numpy.where(numpy.isnan(rates), 0.0, rates) * numpy.ones(billed.shape)
+    else:
+        rates = numpy.full(billed.shape, float(charge.rate or 0.0))
+        if charge.band_limits is not None:
+            rates += band_rates(billed, charge.band_limits, charge.band_rates)
+    return numpy.where(demand_charge.ratcheted, 0.0, rates)
+
+
+DEMAND_COLUMNS = ('peak', 'peak_timestamp', 'billed', 'billed_timestamp', 'ratcheted', 'cost', 'shadow_price')
+
+
+def demand_frame(demand_charges, meters=None, columns=DEMAND_COLUMNS):
+    """
+        Tabulates demand charges.
+
+        :param demand_charges: the DemandCharge of each demand charge
+        :param meters: the meter ids of fleet meter data
+        :param columns: the columns to include, the attributes of a DemandCharge along with its shadow_price
+        :return: a DataFrame indexed by charge component and billing period, and meter for fleet meter data
+    """
+    names = []
+    frames = []
+    for demand_charge in demand_charges:
+        values = dict()
+        for column in columns:
+            if column == 'cost':
+                values[column] = demand_charge.costs
+            elif column == 'shadow_price':
+                values[column] = shadow_prices(demand_charge)
+            else:
+                values[column] = getattr(demand_charge, column)
+        periods = pandas.Index(demand_charge.periods, name='period')
+        if meters is not None:
+            index = pandas.MultiIndex.from_product([periods, pandas.Index(meters, name='meter')])
+            values = dict((column, array.reshape(-1)) for column, array in values.items())
+        else:
+            index = periods
+        names.append(demand_charge.charge.name)
+        frames.append(pandas.DataFrame(values, index=index, columns=list(columns)))
+    if not frames:
+        return pandas.DataFrame(columns=list(columns))
+    return pandas.concat(frames, keys=names, names=['component'])
+
+
+def demand_charges(plan, meter_data, rule):
+    """
+        Calculates the billed demand and cost of each demand charge of a billing plan.
+
+        :param plan: a BillingPlan
+        :param meter_data: a MeterData instance
+        :param rule: the resampling rule of the demand window of the tariff, e.g. 30min
+        :return: a DemandCharge per demand charge of the plan
+    """
+    charges = [charge for charge in plan.charges if charge.type == 'demand']
+    if not charges:
+        return []
+    windows = DemandWindows(meter_data, rule, plan.demand_window_type == 'rolling')
+    if not len(windows):
+        return []
+    starts, periods, ordinals = billing_periods(windows.features, plan.billing_period)
+
+    results = []
+    for charge in charges:
+        values = windows.values(charge.meter)
+        eligible = charge.mask(windows.features)
+        if active() is not None:
+            count('matched', charge=charge.name, charge_type='demand', intervals=len(windows),
+                  matched=int(numpy.count_nonzero(eligible)))
+        peak, peak_positions = period_peaks(values, eligible, starts)
+        peak_timestamp = _timestamps(windows.index, peak_positions)
+
+        billed, billed_timestamp = peak, peak_timestamp
+        ratcheted = numpy.zeros(peak.shape, dtype=bool)
+        if charge.ratchet is not None:
+            fraction, preceding = charge.ratchet
+            highest, sources = ratchet_peaks(peak, ordinals, preceding)
+            ratcheted = fraction * highest > peak
+            billed = numpy.where(ratcheted, fraction * highest, peak)
+            source_timestamp = numpy.take_along_axis(peak_timestamp, numpy.clip(sources, 0, None), axis=0)
+            billed_timestamp = numpy.where(ratcheted, source_timestamp, peak_timestamp)
+
+        results.append(DemandCharge(charge, periods, peak, peak_timestamp, billed, billed_timestamp, ratcheted,
+                                    _costs(charge, billed, periods)))
+    return results
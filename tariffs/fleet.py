@@ -0,0 +1,68 @@
+"""
+Fleet calculations applying a tariff to many meters at once.
+
+Fleet meter data is a wide DataFrame indexed by datetime whose columns are a MultiIndex of meter id and register
+(e.g. electricity_imported). Every charge is evaluated over all meters in one vectorized pass, block accumulations
+and demand peaks being tracked per meter.
+"""
+import numpy
+import pandas
+
+from tariffs.meter import MeterData
+
+
+FLEET_OUTPUT_FORMAT_CHOICES = (
+    ('total', 'total'),
+    ('total-components', 'total-components'),
+)
+
+
+def fleet_frame(values, index, meters, registers=('electricity_imported',)):
+    """
+        Builds fleet meter data from a NumPy array.
+
+        :param values: an array of shape (timestamps, meters) for a single register or (timestamps, meters, registers)
+        :param index: the DatetimeIndex of the timestamps
+        :param meters: the meter ids
+        :param registers: the register of each slice of the last axis (e.g. electricity_imported)
+        :return: a DataFrame with a column per meter and register
+    """
+    values = numpy.asarray(values)
+    if values.ndim == 2:
+        values = values[:, :, numpy.newaxis]
+    if values.shape[1:] != (len(meters), len(registers)):
+        raise ValueError('Expected meter data of shape (timestamps, %d, %d) but received %s' % (
+            len(meters), len(registers), values.shape))
+    columns = pandas.MultiIndex.from_product([meters, registers], names=['meter', 'register'])
+    return pandas.DataFrame(values.reshape(len(values), -1), index=pandas.DatetimeIndex(index), columns=columns)
+
+
+def apply_fleet(tariff, meter_data, start=None, end=None, output_format='total'):
+    """
+        Calculates the cost of energy given a tariff and the load of each of a fleet of meters.
+
+        :param tariff: a Tariff resource
+        :param meter_data: fleet meter data with a column per meter and register (see fleet_frame), or a MeterData
+            instance wrapping it
+        :param start: an optional datetime to select the commencement of the bill calculation
+        :param end: an optional datetime to select the termination of the bill calculation
+        :param output_format: 'total' for the total of each meter or 'total-components' for each charge component
+            of each meter along with its total
+        :return: a Series of totals or a DataFrame of components with one row per meter
+    """
+    if output_format not in dict(FLEET_OUTPUT_FORMAT_CHOICES):
+        raise UserWarning('Unsupported output format: %s' % output_format)
+
+    meter_data = MeterData.coerce(meter_data).truncate(before=start, after=end)
+    if not isinstance(meter_data.frame.columns, pandas.MultiIndex):
+        raise UserWarning('Fleet meter data requires a column MultiIndex of meter and register')
+    meters = pandas.Index(meter_data.frame.columns.get_level_values(0).unique(), name='meter')
+
+    charge_array = tariff.apply_charges(meter_data, output_format, engine='vectorized')
+    components = pandas.DataFrame({name: numpy.sum(costs, axis=0) for name, costs in charge_array.items()},
+                                  index=meters, columns=list(charge_array))
+    total = components.sum(1).rename('total')
+    if output_format == 'total':
+        return total
+    components['total'] = total
+    return components
@@ -0,0 +1,308 @@
+"""
+Streaming Green Button (ESPI) reader.
+
+Green Button files are Atom feeds whose entries hold ReadingType, MeterReading, IntervalBlock and LocalTimeParameters
+resources. The file is read incrementally with iterparse, clearing each element once read, so memory use is bounded
+by the chunk size rather than the file size. Interval readings are yielded as DataFrame chunks in the layout expected
+by Tariff.apply (electricity_imported and electricity_exported in kWh indexed by local interval start) and can be fed
+straight into a BillAccumulator.
+"""
+import xml.etree.ElementTree as ElementTree
+
+import numpy
+import pandas
+
+from tariffs.streaming import BillAccumulator
+
+
+REGISTERS = ('electricity_imported', 'electricity_exported')
+
+# ESPI flow directions, forward is delivered to the customer and reverse received from the customer
+FLOW_DIRECTION_TO_REGISTER = {
+    1: 'electricity_imported',
+    19: 'electricity_exported',
+}
+
+# ESPI unit of measure codes converted to kilo units
+UOM_SCALE = {
+    72: 0.001,  # Wh
+}
+
+DEFAULT_READING_TYPE = {
+    'flowDirection': 1,
+    'powerOfTenMultiplier': 0,
+    'uom': 72,
+}
+
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def _link(href):
+    return href.rstrip('/') if href else href
+
+
+def _reading_type(element):
+    reading_type = dict(DEFAULT_READING_TYPE)
+    for field in element:
+        name = _local_name(field.tag)
+        if name in reading_type:
+            reading_type[name] = int(field.text)
+    return reading_type
+
+
+def _local_time_parameters(element):
+    """The offset of local standard time from UTC in seconds and the daylight saving time offset and rules, if any"""
+    fields = dict((_local_name(field.tag), field.text) for field in element)
+    tz_offset = int(fields['tzOffset']) if fields.get('tzOffset') else None
+    dst = None
+    if int(fields.get('dstOffset') or 0) and fields.get('dstStartRule') and fields.get('dstEndRule'):
+        dst = (int(fields['dstOffset']), int(fields['dstStartRule'], 16), int(fields['dstEndRule'], 16))
+    return tz_offset, dst
+
+
+def _dst_transition(rule, year):
+    """
+        The local datetime of a daylight saving time transition in a year, given an ESPI DstRuleType of seconds
+        (bits 0 - 11), hour (bits 12 - 16), day of the week from Monday as 1 (bits 17 - 19), day of the month (bits
+        20 - 24), operator (bits 25 - 27) and month (bits 28 - 31)
+    """
+    seconds, hour = rule & 0xFFF, (rule >> 12) & 0x1F
+    weekday, day, operator, month = (rule >> 17) & 0x7, (rule >> 20) & 0x1F, (rule >> 25) & 0x7, (rule >> 28) & 0xF
+    if operator == 0:
+        date = pandas.Timestamp(year, month, day)
+    elif operator == 1:
+        # The day of the week on or after the day of the month
+        date = pandas.Timestamp(year, month, day)
+        date += pandas.Timedelta(days=(weekday - 1 - date.weekday()) % 7)
+    elif 2 <= operator <= 5:
+        # The first to fourth occurrence of the day of the week in the month
+        date = pandas.Timestamp(year, month, 1)
+        date += pandas.Timedelta(days=(weekday - 1 - date.weekday()) % 7 + 7 * (operator - 2))
+    elif operator == 6:
+        # The last occurrence of the day of the week in the month
+        date = pandas.Timestamp(year, month, 1) + pandas.offsets.MonthEnd(0)
+        date -= pandas.Timedelta(days=(date.weekday() - weekday + 1) % 7)
+    else:
+        raise UserWarning('Unsupported daylight saving time rule: %08X' % rule)
+    return date + pandas.Timedelta(hours=hour, seconds=seconds)
+
+
+def _iter_entries(source):
+    """Yields (links, content element) for each Atom entry, clearing each entry once processed"""
+    context = ElementTree.iterparse(source, events=('start', 'end'))
+    root = None
+    links = None
+    for event, element in context:
+        name = _local_name(element.tag)
+        if root is None:
+            root = element
+        if event == 'start':
+            if name == 'entry':
+                links = dict()
+            continue
+        if name == 'link' and links is not None:
+            links.setdefault(element.get('rel'), []).append(_link(element.get('href')))
+        elif name == 'entry':
+            yield links, element
+            links = None
+            root.clear()
+
+
+def read_metadata(source):
+    """
+        Reads the reading types and local time parameters of a Green Button file, skipping its interval readings.
+
+        :return: a dictionary with the reading type of each meter reading (keyed by meter reading link), the
+            offset of local standard time from UTC in seconds (or None if not given) and the daylight saving time
+            offset in seconds with its start and end rules (or None if not observed)
+    """
+    reading_types = dict()
+    meter_readings = dict()
+    tz_offset = dst = None
+    for links, entry in _iter_entries(source):
+        for element in entry.iter():
+            name = _local_name(element.tag)
+            if name == 'ReadingType':
+                for href in links.get('self', ()):
+                    reading_types[href] = _reading_type(element)
+            elif name == 'MeterReading':
+                for href in links.get('self', ()):
+                    meter_readings[href] = links.get('related', [])
+            elif name == 'LocalTimeParameters':
+                tz_offset, dst = _local_time_parameters(element)
+
+    resolved = dict()
+    for meter_reading, related in meter_readings.items():
+        for href in related:
+            if href in reading_types:
+                resolved[meter_reading] = reading_types[href]
+    return {'reading_types': resolved, 'tz_offset': tz_offset, 'dst': dst}
+
+
+def _to_local(starts, tz_offset, dst, timezone):
+    index = pandas.DatetimeIndex(starts.astype('datetime64[s]'))
+    if timezone is not None:
+        return index.tz_localize('UTC').tz_convert(timezone).tz_localize(None)
+    if tz_offset:
+        index = index + pandas.Timedelta(seconds=tz_offset)
+    if dst is None or not len(index):
+        return index
+    dst_offset, start_rule, end_rule = dst
+    # Daylight saving time starts at a local standard time and ends at a local daylight time
+    observed = numpy.zeros(len(index), dtype=bool)
+    for year in numpy.unique(index.year):
+        start = _dst_transition(start_rule, year)
+        end = _dst_transition(end_rule, year) - pandas.Timedelta(seconds=dst_offset)
+        in_year = index.year == year
+        if start < end:
+            observed |= in_year & (index >= start) & (index < end)
+        else:
+            # Southern hemisphere daylight saving time spans the new year
+            observed |= in_year & ((index >= start) | (index < end))
+    return index + pandas.to_timedelta(observed * dst_offset, unit='s')
+
+
+def iter_interval_readings(source, metadata=None, register=None, chunk_size=10000, timezone=None):
+    """
+        Yields the interval readings of a Green Button file as (register, Series) chunks of at most chunk_size
+        readings, each Series holding kWh indexed by local interval start.
+
+        :param source: the path or file object of a Green Button file
+        :param metadata: reading types and local time parameters, see read_metadata. By default the metadata is
+            taken from the entries preceding each interval block
+        :param register: an optional register (e.g. electricity_imported) to restrict the readings to
+        :param timezone: an optional timezone name to convert the UTC readings to, overriding the local time
+            parameters of the file
+    """
+    metadata = metadata or {'reading_types': dict(), 'tz_offset': None, 'dst': None}
+    reading_types = dict(metadata['reading_types'])
+    pending_meter_readings = dict()
+    seen_reading_types = dict()
+    tz_offset = metadata['tz_offset']
+    dst = metadata.get('dst')
+
+    context = ElementTree.iterparse(source, events=('start', 'end'))
+    root = None
+    links = dict()
+    reading_type = None
+    block = None
+    starts, values = [], []
+
+    def flush():
+        scale = 10.0 ** reading_type['powerOfTenMultiplier'] * UOM_SCALE.get(reading_type['uom'], 1.0)
+        series = pandas.Series(numpy.array(values, dtype=float) * scale,
+                               index=_to_local(numpy.array(starts, dtype='int64'), tz_offset, dst, timezone))
+        del starts[:], values[:]
+        return FLOW_DIRECTION_TO_REGISTER.get(reading_type['flowDirection']), series.sort_index()
+
+    for event, element in context:
+        name = _local_name(element.tag)
+        if root is None:
+            root = element
+        if event == 'start':
+            if name == 'entry':
+                links = dict()
+            elif name == 'IntervalBlock':
+                block = element
+                # Interval blocks link up to the meter reading they belong to
+                meter_reading = next((href.rsplit('/IntervalBlock', 1)[0] for href in links.get('up', ())), None)
+                reading_type = reading_types.get(meter_reading, DEFAULT_READING_TYPE)
+            continue
+
+        if name == 'link':
+            links.setdefault(element.get('rel'), []).append(_link(element.get('href')))
+        elif name == 'start' and reading_type is not None:
+            start = int(element.text)
+        elif name == 'value' and reading_type is not None:
+            value = float(element.text)
+        elif name == 'IntervalReading' and reading_type is not None:
+            starts.append(start)
+            values.append(value)
+            # Detached from its block, so that memory is bounded by the chunk size rather than the size of the block
+            element.clear()
+            if block is not None:
+                block.remove(element)
+            if len(values) >= chunk_size:
+                reading_register, series = flush()
+                if reading_register is not None and register in (None, reading_register):
+                    yield reading_register, series
+        elif name == 'IntervalBlock':
+            if values:
+                reading_register, series = flush()
+                if reading_register is not None and register in (None, reading_register):
+                    yield reading_register, series
+            reading_type = block = None
+        elif name == 'ReadingType':
+            for href in links.get('self', ()):
+                seen_reading_types[href] = _reading_type(element)
+            for meter_reading, related in pending_meter_readings.items():
+                for href in related:
+                    if href in seen_reading_types:
+                        reading_types.setdefault(meter_reading, seen_reading_types[href])
+        elif name == 'MeterReading':
+            for href in links.get('self', ()):
+                pending_meter_readings[href] = links.get('related', [])
+                for related in links.get('related', []):
+                    if related in seen_reading_types:
+                        reading_types.setdefault(href, seen_reading_types[related])
+        elif name == 'LocalTimeParameters' and metadata['tz_offset'] is None:
+            tz_offset, dst = _local_time_parameters(element)
+        elif name == 'entry':
+            root.clear()
+
+
+def iter_meter_data(path, chunk_size=10000, timezone=None):
+    """
+        Yields the interval readings of a Green Button file as chronological DataFrame chunks with
+        electricity_imported and electricity_exported columns (kWh) indexed by local interval start.
+
+        The file is read once for its metadata and then once per register, merging the registers by time, so that
+        imported and exported readings are aligned whatever order the file holds them in.
+
+        :param path: the path of a Green Button file
+        :param chunk_size: the maximum number of readings per register held in memory at once
+        :param timezone: an optional timezone name to convert the UTC readings to, overriding the local time
+            parameters of the file
+    """
+    metadata = read_metadata(path)
+    registers = set(FLOW_DIRECTION_TO_REGISTER.get(reading_type['flowDirection'])
+                    for reading_type in metadata['reading_types'].values()) or {REGISTERS[0]}
+    iterators = dict((register, iter_interval_readings(path, metadata, register, chunk_size, timezone))
+                     for register in REGISTERS if register in registers)
+    pending = dict((register, pandas.Series(dtype=float)) for register in iterators)
+
+    while iterators or any(len(series) for series in pending.values()):
+        # Every register still being read needs buffered readings to decide how far the registers are aligned
+        for register in list(iterators):
+            while not len(pending[register]):
+                try:
+                    pending[register] = next(iterators[register])[1]
+                except StopIteration:
+                    del iterators[register]
+                    break
+        cutoff = min(pending[register].index[-1] for register in iterators) if iterators else None
+
+        chunk = dict()
+        for register, series in pending.items():
+            ready = series if cutoff is None else series[series.index <= cutoff]
+            pending[register] = series.iloc[len(ready):]
+            chunk[register] = ready
+        meter_data = pandas.DataFrame(chunk).reindex(columns=list(REGISTERS)).fillna(0.0)
+        meter_data.index.name = 'datetime'
+        if len(meter_data):
+            yield meter_data
+
+
+def accumulate(tariff, path, chunk_size=10000, timezone=None):
+    """
+        Calculates the bill of a tariff for the interval readings of a Green Button file without loading the whole
+        file into memory.
+
+        :return: a BillAccumulator holding the bill, see BillAccumulator.components and BillAccumulator.total
+    """
+    accumulator = BillAccumulator(tariff)
+    for meter_data in iter_meter_data(path, chunk_size, timezone):
+        accumulator.update(meter_data)
+    return accumulator
@@ -0,0 +1,162 @@
+"""
+Instrumentation of bill calculations.
+
+Bill calculations report their phases (truncation, each resampling, each charge type pass and output formatting) and
+counts (rows and the intervals matched by the season and time-of-use periods of each charge) to the active Profiler:
+
+    with Profiler() as profiler:
+        tariff.apply(meter_data)
+    profiler.report()
+
+Profiling is opt-in. Without an active Profiler the hooks only look up a context variable and record nothing.
+The active Profiler is held in a context variable, so calculations on other threads or processes aren't recorded.
+"""
+import contextlib
+import contextvars
+import time
+import tracemalloc
+
+import pandas
+
+
+_profiler = contextvars.ContextVar('tariffs_profiler', default=None)
+
+
+def active():
+    """The active Profiler, or None if bill calculations aren't being profiled"""
+    return _profiler.get()
+
+
+class _NullPhase(object):
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_PHASE = _NullPhase()
+
+
+def phase(name, **fields):
+    """
+        Context manager timing a phase of a bill calculation for the active Profiler. It returns the record of the
+        phase, to which further fields may be added, or None if there is no active Profiler.
+    """
+    profiler = _profiler.get()
+    if profiler is None:
+        return _NULL_PHASE
+    return profiler.phase(name, **fields)
+
+
+def count(name, **fields):
+    """Records a count (e.g. of intervals matched by a charge) with the active Profiler"""
+    profiler = _profiler.get()
+    if profiler is not None:
+        profiler.count(name, **fields)
+
+
+@contextlib.contextmanager
+def trace_memory(record):
+    """
+        Context manager adding the peak memory allocated while it is active, in bytes above that allocated when it was
+        entered, to the record of a phase as traced by tracemalloc. Nothing is traced if the record is None, as when
+        there is no active Profiler. The peak of any enclosing trace is reset.
+    """
+    if record is None:
+        yield
+        return
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    try:
+        yield
+    finally:
+        _, peak = tracemalloc.get_traced_memory()
+        record['peak_memory'] = peak - allocated
+        if not tracing:
+            tracemalloc.stop()
+
+
+class _Phase(object):
+    __slots__ = ('profiler', 'record', 'started')
+
+    def __init__(self, profiler, record):
+        self.profiler = profiler
+        self.record = record
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        self.record['start'] = self.started - self.profiler.started
+        self.record['depth'] = self.profiler._depth
+        self.profiler._depth += 1
+        self.profiler.phases.append(self.record)
+        return self.record
+
+    def __exit__(self, *exc_info):
+        self.record['elapsed'] = time.perf_counter() - self.started
+        self.profiler._depth -= 1
+        if self.profiler.callback is not None:
+            self.profiler.callback(self.record)
+        return False
+
+
+class Profiler(object):
+    """
+        Records the phases and counts of the bill calculations made while it is active.
+
+        Each phase is recorded as a dictionary with its name (phase), start and elapsed times in seconds, nesting depth
+        and the fields given by the calculation, e.g. the rule and row counts of a resampling. Each count is recorded
+        as a dictionary with its name (count) and fields.
+
+        :param callback: an optional function called with the record of each phase as it completes, and of each count
+    """
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.phases = []
+        self.counts = []
+        self.started = time.perf_counter()
+        self._depth = 0
+        self._tokens = []
+
+    def __enter__(self):
+        self._tokens.append(_profiler.set(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        _profiler.reset(self._tokens.pop())
+        return False
+
+    def phase(self, name, **fields):
+        fields['phase'] = name
+        return _Phase(self, fields)
+
+    def count(self, name, **fields):
+        fields['count'] = name
+        self.counts.append(fields)
+        if self.callback is not None:
+            self.callback(fields)
+
+    def totals(self):
+        """The total elapsed time of each phase name"""
+        totals = dict()
+        for record in self.phases:
+            totals[record['phase']] = totals.get(record['phase'], 0.0) + record.get('elapsed', 0.0)
+        return totals
+
+    def report(self):
+        """A JSON-serializable report of the recorded phases, counts and the total elapsed time of each phase name"""
+        return {
+            'phases': [dict(record) for record in self.phases],
+            'counts': [dict(record) for record in self.counts],
+            'totals': self.totals(),
+        }
+
+    def to_frame(self):
+        """The recorded phases as a DataFrame with a row per phase"""
+        return pandas.DataFrame.from_records(self.phases)
@@ -0,0 +1,162 @@
+"""
+Tariff libraries.
+
+A TariffLibrary holds a large collection of tariffs (e.g. a national tariff database) as compact raw JSON, decoding
+each into a Tariff resource only when it is accessed. The fields tariffs are usually searched by are indexed as the
+library is loaded, so that selecting candidate tariffs doesn't decode any of them.
+"""
+import json
+from collections import OrderedDict
+
+import numpy
+from odin.codecs import dict_codec
+
+from tariffs.tariff import Tariff
+
+
+INDEXED_FIELDS = ('code', 'utility_code', 'service', 'sector', 'currency')
+
+BOUND_FIELDS = ('min_consumption', 'max_consumption', 'min_demand', 'max_demand')
+
+
+def raw_charge_types(data):
+    """The charge types of a tariff (see Tariff.charge_types) from its raw JSON data"""
+    charge_types = set()
+    for charge in data.get('charges') or ():
+        if charge.get('season'):
+            charge_types.add('seasonal')
+        if charge.get('time'):
+            charge_types.add('tou')
+        if charge.get('rate_bands'):
+            charge_types.add('block')
+        if charge.get('rate_schedule'):
+            charge_types.add('scheduled')
+        charge_type = charge.get('type') or 'consumption'
+        if charge_type in ('demand', 'consumption'):
+            charge_types.add(charge_type)
+    return charge_types
+
+
+def _bound(value):
+    return numpy.nan if value is None else float(value)
+
+
+class TariffLibrary(object):
+    """
+        A read-only collection of tariffs held as raw JSON and decoded on access.
+
+        Tariffs are identified by their position in the library. Decoded tariffs are kept in a bounded cache of the
+        most recently accessed, and shouldn't be modified as the indexes of the library aren't updated.
+
+        :param cache_size: the number of decoded tariffs to keep
+    """
+
+    def __init__(self, cache_size=1024):
+        self.cache_size = cache_size
+        self._raw = []
+        self._indexes = dict((field, dict()) for field in INDEXED_FIELDS + ('charge_types',))
+        self._bounds = dict((field, []) for field in BOUND_FIELDS)
+        self._bound_arrays = None
+        self._decoded = OrderedDict()
+
+    @classmethod
+    def load(cls, f, cache_size=1024):
+        """
+            Loads a library from a JSON file of a Spec (an object with a list of tariffs) or a list of tariffs.
+
+            :param f: a path or file object
+        """
+        if isinstance(f, str):
+            with open(f) as fp:
+                return cls.load(fp, cache_size)
+        return cls.from_data(json.load(f), cache_size)
+
+    @classmethod
+    def from_data(cls, data, cache_size=1024):
+        """Builds a library from the decoded JSON data of a Spec or a list of tariffs"""
+        library = cls(cache_size)
+        for tariff in data['tariffs'] if isinstance(data, dict) else data:
+            library.add(tariff)
+        return library
+
+    def add(self, data):
+        """Adds a tariff from its raw JSON data, returning its position"""
+        position = len(self._raw)
+        self._raw.append(json.dumps(data, separators=(',', ':')).encode('utf-8'))
+        for field in INDEXED_FIELDS:
+            self._indexes[field].setdefault(data.get(field), []).append(position)
+        for charge_type in raw_charge_types(data):
+            self._indexes['charge_types'].setdefault(charge_type, []).append(position)
+        for field in BOUND_FIELDS:
+            self._bounds[field].append(_bound(data.get(field)))
+        self._bound_arrays = None
+        return position
+
+    def __len__(self):
+        return len(self._raw)
+
+    def __getitem__(self, position):
+        tariff = self._decoded.get(position)
+        if tariff is None:
+            tariff = dict_codec.load(self.raw(position), Tariff)
+            self._decoded[position] = tariff
+            if len(self._decoded) > self.cache_size:
+                self._decoded.popitem(last=False)
+        else:
+            self._decoded.move_to_end(position)
+        return tariff
+
+    def __iter__(self):
+        for position in range(len(self)):
+            yield self[position]
+
+    def raw(self, position):
+        """The raw JSON data of a tariff"""
+        return json.loads(self._raw[position])
+
+    def values(self, field):
+        """The distinct values of an indexed field, e.g. the utility codes of the library"""
+        return [value for value in self._indexes[field] if value is not None]
+
+    def _positions(self, field, values):
+        mask = numpy.zeros(len(self), dtype=bool)
+        for value in values:
+            mask[self._indexes[field].get(value, [])] = True
+        return mask
+
+    def _bound_array(self, field):
+        if self._bound_arrays is None:
+            self._bound_arrays = dict((name, numpy.array(bounds, dtype=float)) for name, bounds in self._bounds.items())
+        return self._bound_arrays[field]
+
+    def _within(self, minimum, maximum, value):
+        minimum, maximum = self._bound_array(minimum), self._bound_array(maximum)
+        return (numpy.isnan(minimum) | (minimum <= value)) & (numpy.isnan(maximum) | (value <= maximum))
+
+    def select(self, charge_types=(), consumption=None, demand=None, **criteria):
+        """
+            Selects the positions of the tariffs matching every given criterion.
+
+            :param charge_types: the charge types (e.g. tou, demand) a tariff must all have
+            :param consumption: a consumption the tariff must be eligible for, in the consumption unit of the tariffs
+            :param demand: a demand the tariff must be eligible for, in the demand unit of the tariffs
+            :param criteria: values of the indexed fields (code, utility_code, service, sector or currency), each a
+                single value or a list of accepted values
+            :return: an array of positions in ascending order
+        """
+        mask = numpy.ones(len(self), dtype=bool)
+        for field, values in criteria.items():
+            if field not in INDEXED_FIELDS:
+                raise UserWarning('Unsupported tariff library index: %s' % field)
+            mask &= self._positions(field, values if isinstance(values, (list, tuple, set)) else [values])
+        for charge_type in [charge_types] if isinstance(charge_types, str) else charge_types:
+            mask &= self._positions('charge_types', [charge_type])
+        if consumption is not None:
+            mask &= self._within('min_consumption', 'max_consumption', consumption)
+        if demand is not None:
+            mask &= self._within('min_demand', 'max_demand', demand)
+        return numpy.flatnonzero(mask)
+
+    def find(self, charge_types=(), consumption=None, demand=None, **criteria):
+        """Decodes the tariffs matching every given criterion, see select"""
+        return [self[position] for position in self.select(charge_types, consumption, demand, **criteria)]
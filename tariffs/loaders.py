@@ -0,0 +1,194 @@
+"""
+Loading meter data.
+
+Meter data CSV files in the datetime,electricity_imported,electricity_exported layout are parsed with a vectorized
+datetime format rather than a per-row parser, optionally downcast to float32 and cached in a columnar binary format
+that later runs memory-map rather than parse.
+"""
+import json
+import os
+import warnings
+
+import numpy
+import pandas
+
+
+DATETIME_FORMAT = '%d/%m/%Y %H:%M'
+
+CACHE_FORMAT_CHOICES = (
+    ('npy', 'NumPy arrays (memory-mapped)'),
+    ('feather', 'Feather (memory-mapped, requires pyarrow)'),
+    ('parquet', 'Parquet (requires pyarrow)'),
+)
+
+CACHE_VERSION = 1
+
+
+def find_gaps(index, interval=None):
+    """
+        Finds the gaps in a DatetimeIndex of regular intervals.
+
+        :param index: a sorted DatetimeIndex
+        :param interval: the expected interval, by default the most common interval of the index
+        :return: a DataFrame with the start and end of each gap (the timestamps either side of the missing
+            intervals) and the number of missing intervals
+    """
+    steps = numpy.diff(index.asi8)
+    if interval is None:
+        if not len(steps):
+            return pandas.DataFrame({'start': index[:0], 'end': index[:0], 'missing': []})
+        values, counts = numpy.unique(steps, return_counts=True)
+        step = values[numpy.argmax(counts)]
+    else:
+        step = pandas.Timedelta(interval).value
+    gaps = numpy.flatnonzero(steps > step)
+    return pandas.DataFrame({
+        'start': index[gaps],
+        'end': index[gaps + 1],
+        'missing': steps[gaps] // step - 1,
+    })
+
+
+def validate_index(index, on_gap='warn', interval=None):
+    """
+        Checks that a meter data index is sorted and without duplicates, and reports its gaps.
+
+        :param on_gap: 'warn' to warn of gaps, 'raise' to raise a UserWarning or 'ignore'
+        :return: the gaps found, see find_gaps
+    """
+    if not index.is_monotonic_increasing:
+        raise UserWarning('Meter data timestamps are not in chronological order')
+    if index.has_duplicates:
+        raise UserWarning('Meter data contains duplicate timestamps')
+    gaps = find_gaps(index, interval)
+    if len(gaps) and on_gap != 'ignore':
+        message = 'Meter data has %d gaps totalling %d missing intervals, the first from %s to %s' % (
+            len(gaps), gaps['missing'].sum(), gaps['start'].iloc[0], gaps['end'].iloc[0])
+        if on_gap == 'raise':
+            raise UserWarning(message)
+        warnings.warn(message)
+    return gaps
+
+
+def parse_meter_data(path, datetime_format=DATETIME_FORMAT, dtype=numpy.float64, on_gap='warn'):
+    """
+        Parses a meter data CSV file.
+
+        :param path: the path or buffer of a CSV file with a datetime column followed by register columns, e.g.
+            electricity_imported and electricity_exported
+        :param datetime_format: the strftime format of the datetime column, or None to infer ISO 8601 datetimes
+        :param dtype: the dtype of the register columns, e.g. numpy.float32 to halve memory
+        :param on_gap: 'warn', 'raise' or 'ignore' gaps in the intervals of the meter data
+        :return: a DataFrame indexed by datetime with a column per register
+    """
+    frame = pandas.read_csv(path)
+    index = pandas.DatetimeIndex(pandas.to_datetime(frame.pop('datetime'), format=datetime_format), name='datetime')
+    meter_data = pandas.DataFrame(frame.to_numpy(dtype=dtype), index=index, columns=frame.columns)
+    meter_data.attrs['gaps'] = validate_index(index, on_gap)
+    return meter_data
+
+
+def _source_stamp(path):
+    stat = os.stat(path)
+    return {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def write_cache(meter_data, directory, cache_format='npy', source=None):
+    """
+        Writes meter data to a cache directory.
+
+        :param meter_data: a DataFrame indexed by datetime with a column per register
+        :param directory: the cache directory, created if it doesn't exist
+        :param cache_format: 'npy', 'feather' or 'parquet'
+        :param source: the path of the file the meter data was parsed from, used to invalidate the cache
+    """
+    if cache_format not in dict(CACHE_FORMAT_CHOICES):
+        raise UserWarning('Unsupported cache format: %s' % cache_format)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    if cache_format == 'npy':
+        numpy.save(os.path.join(directory, 'index.npy'), meter_data.index.asi8)
+        numpy.save(os.path.join(directory, 'values.npy'), numpy.ascontiguousarray(meter_data.to_numpy()))
+    else:
+        try:
+            import pyarrow
+            import pyarrow.feather
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError('pyarrow is required for %s meter data caches' % cache_format)
+        table = pyarrow.Table.from_pandas(meter_data, preserve_index=True)
+        if cache_format == 'feather':
+            pyarrow.feather.write_feather(table, os.path.join(directory, 'meter_data.feather'),
+                                          compression='uncompressed')
+        else:
+            pyarrow.parquet.write_table(table, os.path.join(directory, 'meter_data.parquet'))
+
+    meta = {
+        'version': CACHE_VERSION,
+        'format': cache_format,
+        'columns': list(meter_data.columns),
+        'timezone': str(meter_data.index.tz) if meter_data.index.tz is not None else None,
+        'source': _source_stamp(source) if source is not None else None,
+    }
+    with open(os.path.join(directory, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+
+def read_cache(directory, source=None):
+    """
+        Reads meter data from a cache directory, memory-mapping the register values where the format allows.
+
+        :param source: the path of the file the meter data was parsed from, the cache is treated as stale if the
+            file has changed since it was cached
+        :return: a DataFrame indexed by datetime with a column per register, or None if the cache is missing or stale
+    """
+    try:
+        with open(os.path.join(directory, 'meta.json')) as f:
+            meta = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+    if meta.get('version') != CACHE_VERSION:
+        return None
+    if source is not None and meta.get('source') != _source_stamp(source):
+        return None
+
+    if meta['format'] == 'npy':
+        index = pandas.DatetimeIndex(numpy.load(os.path.join(directory, 'index.npy')), name='datetime')
+        if meta['timezone'] is not None:
+            index = index.tz_localize('UTC').tz_convert(meta['timezone'])
+        values = numpy.load(os.path.join(directory, 'values.npy'), mmap_mode='r')
+        return pandas.DataFrame(values, index=index, columns=meta['columns'], copy=False)
+
+    import pyarrow.feather
+    import pyarrow.parquet
+    if meta['format'] == 'feather':
+        table = pyarrow.feather.read_table(os.path.join(directory, 'meter_data.feather'), memory_map=True)
+    else:
+        table = pyarrow.parquet.read_table(os.path.join(directory, 'meter_data.parquet'), memory_map=True)
+    return table.to_pandas()
+
+
+def read_meter_data(path, datetime_format=DATETIME_FORMAT, dtype=numpy.float64, cache=None, cache_format='npy',
+                    on_gap='warn'):
+    """
+        Loads meter data from a CSV file, using and refreshing an optional cache.
+
+        :param path: the path of a CSV file with a datetime column followed by register columns
+        :param datetime_format: the strftime format of the datetime column, or None to infer ISO 8601 datetimes
+        :param dtype: the dtype of the register columns, e.g. numpy.float32 to halve memory
+        :param cache: an optional cache directory, read if it is up to date with the CSV file and written otherwise
+        :param cache_format: 'npy', 'feather' or 'parquet'
+        :param on_gap: 'warn', 'raise' or 'ignore' gaps in the intervals of the meter data
+        :return: a DataFrame indexed by datetime with a column per register
+    """
+    if cache is not None:
+        meter_data = read_cache(cache, source=path)
+        if meter_data is not None and meter_data.dtypes.eq(numpy.dtype(dtype)).all():
+            meter_data.attrs['gaps'] = validate_index(meter_data.index, on_gap)
+            return meter_data
+
+    meter_data = parse_meter_data(path, datetime_format, dtype, on_gap)
+    if cache is not None:
+        write_cache(meter_data, cache, cache_format, source=path)
+    return meter_data
@@ -0,0 +1,164 @@
+"""
+Meter data shared between bill calculations.
+
+MeterData wraps a meter data DataFrame and memoizes the resampled frames, calendar features and truncations derived
+from it, so that tariffs billed against the same data only pay for each distinct resampling once. Memoized data is
+kept in bounded least recently used caches.
+
+Bill calculations given a DataFrame attach a MeterData to it, so that repeated calculations against the same
+DataFrame share its memoized data too. The content of the meter data is checksummed each time a calculation starts,
+and the memoized data discarded if the meter data has changed since.
+"""
+import hashlib
+import zlib
+from collections import OrderedDict
+
+import numpy
+
+from tariffs.instrumentation import count, phase
+from tariffs.plan import CalendarFeatures
+
+
+CACHE_SIZE = 32
+
+# The attribute of a DataFrame holding its attached MeterData
+_ATTACHED = '_tariffs_meter_data'
+
+
+def fingerprint(frame):
+    """A checksum of the index, columns and values of a DataFrame, used to detect changes to meter data"""
+    values = frame.to_numpy()
+    # The values of a single dtype DataFrame are held column by column, so their transpose is contiguous
+    checksum = zlib.crc32(numpy.ascontiguousarray(values.T))
+    checksum = zlib.crc32(numpy.ascontiguousarray(frame.index.asi8), checksum)
+    return frame.shape, hash(tuple(frame.columns)), checksum
+
+
+def _remember(cache, key, value, size):
+    cache[key] = value
+    while len(cache) > size:
+        # The unresampled meter data is never evicted
+        del cache[next(cached for cached in cache if cached != ())]
+
+
+def _recall(cache, key):
+    value = cache.get(key)
+    if value is not None:
+        cache.move_to_end(key)
+    return value
+
+
+class MeterData(object):
+    """
+        A meter data DataFrame (datetime index, imported energy (kwh), exported energy (kwh)) along with its memoized
+        resampled frames, calendar features and truncations.
+
+        Resampled frames are identified by a sequence of (rule, aggregation) steps applied in turn, e.g.
+        (('30min', 'mean'), ('MS', 'max')) for the peak half-hourly demand of each month.
+
+        :param frame: the meter data DataFrame
+        :param cache_size: the number of resampled frames, of calendar features and of truncations to keep
+    """
+
+    def __init__(self, frame, cache_size=CACHE_SIZE):
+        self.frame = frame
+        self.cache_size = cache_size
+        self._frames = OrderedDict([((), frame)])
+        self._features = OrderedDict()
+        self._truncations = OrderedDict()
+        self._fingerprint = None
+        self._digest = None
+
+    @classmethod
+    def attach(cls, frame, cache_size=CACHE_SIZE):
+        """
+            The MeterData attached to a meter data DataFrame, attaching one if there is none. The memoized data lives
+            as long as the DataFrame and is validated against its content.
+        """
+        meter_data = frame.__dict__.get(_ATTACHED)
+        if meter_data is None:
+            meter_data = cls(frame, cache_size)
+            # Set directly, as pandas reserves attribute assignment for columns
+            frame.__dict__[_ATTACHED] = meter_data
+        return meter_data.validate()
+
+    @classmethod
+    def coerce(cls, meter_data):
+        """Validates MeterData, or wraps a meter data DataFrame in its attached MeterData"""
+        if isinstance(meter_data, cls):
+            return meter_data.validate()
+        return cls.attach(meter_data)
+
+    def __len__(self):
+        return len(self.frame)
+
+    def validate(self):
+        """Discards the memoized data if the meter data has changed since it was last validated"""
+        current = fingerprint(self.frame)
+        if self._fingerprint is not None and current != self._fingerprint:
+            count('meter_data_changed', rows=len(self.frame))
+            self.invalidate()
+        self._fingerprint = current
+        return self
+
+    def invalidate(self):
+        """Discards the memoized data, e.g. after the meter data has been modified in place"""
+        self._frames = OrderedDict([((), self.frame)])
+        self._features.clear()
+        self._truncations.clear()
+        self._fingerprint = None
+        self._digest = None
+
+    def digest(self):
+        """
+            A stable hash of the index, columns and values of the meter data, identifying its content across processes
+            (unlike the fingerprint, which is only compared within a process). Computed once until the meter data
+            changes.
+        """
+        if self._digest is None:
+            frame = self.frame
+            digest = hashlib.blake2b(digest_size=20)
+            digest.update(repr((frame.shape, [str(column) for column in frame.columns],
+                                [str(dtype) for dtype in frame.dtypes], str(frame.index.tz))).encode())
+            digest.update(numpy.ascontiguousarray(frame.index.asi8))
+            for _, values in frame.items():
+                digest.update(numpy.ascontiguousarray(values.to_numpy()))
+            self._digest = digest.hexdigest()
+        return self._digest
+
+    def truncate(self, before=None, after=None):
+        """Selects the meter data between two optional datetimes"""
+        if before is None and after is None:
+            return self
+        key = (before, after)
+        truncated = _recall(self._truncations, key)
+        if truncated is None:
+            truncated = type(self)(self.frame.truncate(before=before, after=after), self.cache_size)
+            _remember(self._truncations, key, truncated, self.cache_size)
+        return truncated
+
+    def resample(self, *steps):
+        """Returns the meter data resampled by each (rule, aggregation) step in turn"""
+        steps = tuple(steps)
+        frame = _recall(self._frames, steps)
+        if frame is None:
+            rule, how = steps[-1]
+            source = self.resample(*steps[:-1])
+            with phase('resample', rule=rule, how=how, rows=len(source)) as record:
+                frame = getattr(source.resample(rule), how)()
+                if record is not None:
+                    record['rows_out'] = len(frame)
+            _remember(self._frames, steps, frame, self.cache_size + 1)
+        elif steps:
+            count('resample_cached', rule=steps[-1][0], how=steps[-1][1])
+        return frame
+
+    def features(self, *steps):
+        """Returns the calendar features of the index of the meter data resampled by each step in turn"""
+        # The resampled index only depends on the rules and not the aggregations
+        key = tuple(rule for rule, how in steps)
+        features = _recall(self._features, key)
+        if features is None:
+            features = CalendarFeatures(self.resample(*steps).index)
+            _remember(self._features, key, features, self.cache_size)
+        return features
@@ -0,0 +1,130 @@
+"""
+Parallel execution of large tariff x customer bill calculations.
+
+Fleet meter data is written once to memory-mapped files that every worker process maps read-only, so no meter data is
+pickled per task, and the tariffs are compiled and shipped to each worker once when its process starts. Customers are
+split into fixed-size chunks of meters, each chunk being billed against every tariff with a single fleet pass. As
+chunking doesn't depend on the number of workers, the results are identical whatever the worker count.
+"""
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+import numpy
+import pandas
+
+from tariffs.fleet import apply_fleet
+from tariffs.portfolio import tariff_labels
+
+
+# State of each worker process, set once by _initialize_worker
+_worker_state = {}
+
+
+def _initialize_worker(tariffs, labels, directory, meters, registers):
+    _worker_state.update(
+        tariffs=tariffs,
+        labels=labels,
+        values=numpy.load(os.path.join(directory, 'values.npy'), mmap_mode='r'),
+        index=pandas.DatetimeIndex(numpy.load(os.path.join(directory, 'index.npy'))),
+        meters=meters,
+        registers=registers,
+    )
+
+
+def _bill_chunk(task):
+    chunk, start, stop = task
+    meters = _worker_state['meters'][start:stop]
+    registers = _worker_state['registers']
+    values = _worker_state['values'][:, start * len(registers):stop * len(registers)]
+    columns = pandas.MultiIndex.from_product([meters, registers], names=['meter', 'register'])
+    meter_data = pandas.DataFrame(numpy.array(values), index=_worker_state['index'], columns=columns)
+
+    totals = dict()
+    for label, tariff in zip(_worker_state['labels'], _worker_state['tariffs']):
+        totals[label] = apply_fleet(tariff, meter_data)
+    return chunk, pandas.DataFrame(totals, columns=_worker_state['labels'])
+
+
+class ParallelRunner(object):
+    """
+        Bills customers against a collection of tariffs across a pool of worker processes.
+
+        :param tariffs: an iterable of Tariff resources
+        :param workers: the number of worker processes, defaults to the number of CPUs. With a single worker the
+            calculation runs in the calling process
+        :param chunk_size: the number of customers billed by each task
+    """
+
+    def __init__(self, tariffs, workers=None, chunk_size=100):
+        self.tariffs = list(tariffs)
+        self.labels = tariff_labels(self.tariffs)
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        for tariff in self.tariffs:
+            # Compile up front so the plans are shipped to the workers along with the tariffs
+            tariff.compile()
+
+    @staticmethod
+    def fleet_data(meter_data):
+        """Combines a dictionary of customer meter data DataFrames into fleet meter data"""
+        if isinstance(meter_data, dict):
+            return pandas.concat(meter_data, axis=1, names=['meter', 'register'])
+        return meter_data
+
+    def imap(self, meter_data):
+        """
+            Bills each customer against each tariff, yielding a DataFrame of totals (one row per customer and a
+            column per tariff) for each chunk of customers as soon as it completes.
+
+            :param meter_data: fleet meter data with a column per meter and register, or a dictionary of customer
+                meter data DataFrames
+        """
+        meter_data = self.fleet_data(meter_data)
+        meters = list(meter_data.columns.get_level_values(0).unique())
+        registers = list(meter_data.columns.get_level_values(-1).unique())
+        # Meter-major columns so that each chunk of customers is a contiguous block of columns
+        columns = pandas.MultiIndex.from_product([meters, registers])
+        values = meter_data.reindex(columns=columns).fillna(0.0).to_numpy(dtype=float)
+        tasks = [(chunk, start, min(start + self.chunk_size, len(meters)))
+                 for chunk, start in enumerate(range(0, len(meters), self.chunk_size))]
+
+        directory = tempfile.mkdtemp(prefix='tariffs-')
+        try:
+            numpy.save(os.path.join(directory, 'values.npy'), values)
+            numpy.save(os.path.join(directory, 'index.npy'), meter_data.index.values)
+            del values
+            initargs = (self.tariffs, self.labels, directory, meters, registers)
+
+            if self.workers == 1:
+                _initialize_worker(*initargs)
+                for task in tasks:
+                    yield _bill_chunk(task)[1]
+                _worker_state.clear()
+                return
+
+            pool = multiprocessing.Pool(min(self.workers, len(tasks)) or 1, _initialize_worker, initargs)
+            try:
+                for chunk, totals in pool.imap_unordered(_bill_chunk, tasks):
+                    yield totals
+            finally:
+                pool.terminate()
+                pool.join()
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def run(self, meter_data):
+        """
+            Bills each customer against each tariff.
+
+            :param meter_data: fleet meter data with a column per meter and register, or a dictionary of customer
+                meter data DataFrames
+            :return: a DataFrame of totals with one row per customer and a column per tariff, in input order
+        """
+        meter_data = self.fleet_data(meter_data)
+        meters = pandas.Index(meter_data.columns.get_level_values(0).unique(), name='meter')
+        chunks = list(self.imap(meter_data))
+        if not chunks:
+            return pandas.DataFrame(index=meters, columns=self.labels, dtype=float)
+        return pandas.concat(chunks).reindex(meters)
@@ -0,0 +1,210 @@
+"""
+Out-of-core bill calculation for fleet meter data partitioned across files.
+
+Partitions are billed one at a time in order, each holding the meter data of a group of meters over a time range, so
+only one partition is held in memory. A BillAccumulator per group of meters carries block accumulations and peak
+demand across the time ranges of the group, the partitions of a group following each other in chronological order.
+As billing periods close their bills are written to a directory of Parquet files, one per partition, and a checkpoint
+of the accumulators is saved so that an interrupted run resumes from the last completed partition.
+"""
+import functools
+import json
+import os
+
+import numpy
+import pandas
+
+from tariffs.instrumentation import count
+from tariffs.plan import fleet_meters
+from tariffs.streaming import BillAccumulator
+
+
+CHECKPOINT_VERSION = 1
+
+# Files starting with an underscore are ignored by Parquet dataset readers
+CHECKPOINT_NAME = '_checkpoint.json'
+
+
+def _import_parquet():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError('pyarrow is required for partitioned bill calculation')
+    return pyarrow, pyarrow.parquet
+
+
+def long_fleet_frame(frame, meter_column='meter', datetime_column='datetime'):
+    """
+        Builds fleet meter data from long meter data, a row per meter and timestamp with a column per register.
+
+        :return: a DataFrame with a column per meter and register, meters in sorted order
+    """
+    registers = [column for column in frame.columns if column not in (meter_column, datetime_column)]
+    wide = frame.pivot(index=datetime_column, columns=meter_column, values=registers)
+    wide.columns = wide.columns.swaplevel(0, 1)
+    columns = pandas.MultiIndex.from_product([sorted(frame[meter_column].unique()), registers],
+                                             names=['meter', 'register'])
+    wide = wide.reindex(columns=columns).sort_index()
+    wide.index = pandas.DatetimeIndex(wide.index, name='datetime')
+    return wide
+
+
+def _read_row_group(path, row_group, meter_column, datetime_column):
+    _, parquet = _import_parquet()
+    frame = parquet.ParquetFile(path).read_row_group(row_group).to_pandas()
+    return long_fleet_frame(frame, meter_column, datetime_column)
+
+
+def parquet_partitions(paths, meter_column='meter', datetime_column='datetime'):
+    """
+        Partitions long meter data held in Parquet files by row group, e.g. files of groups of meters whose row groups
+        are consecutive time ranges.
+
+        :param paths: the paths of the Parquet files, in the order their row groups are billed
+        :return: an iterator of the key (path and row group) of each partition and a function loading it as fleet
+            meter data
+    """
+    _, parquet = _import_parquet()
+    for path in paths:
+        for row_group in range(parquet.ParquetFile(path).num_row_groups):
+            yield [path, row_group], functools.partial(_read_row_group, path, row_group, meter_column,
+                                                       datetime_column)
+
+
+class PartitionedRunner(object):
+    """
+        Bills partitioned fleet meter data against a tariff, writing the bill of each meter and billing period to a
+        directory of Parquet files.
+
+        Demand charges are limited to those supported by a BillAccumulator.
+
+        :param tariff: a Tariff resource
+        :param output: the output directory, holding a part file per partition and the checkpoint of the run
+    """
+
+    def __init__(self, tariff, output):
+        self.tariff = tariff
+        self.output = output
+        self.components = list(tariff.compile().components)
+
+    @property
+    def checkpoint_path(self):
+        return os.path.join(self.output, CHECKPOINT_NAME)
+
+    def _part_path(self, sequence):
+        return os.path.join(self.output, 'part-%05d.parquet' % sequence)
+
+    def _load_checkpoint(self):
+        try:
+            with open(self.checkpoint_path) as f:
+                checkpoint = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if checkpoint.get('version') != CHECKPOINT_VERSION or checkpoint.get('components') != self.components:
+            raise UserWarning('The checkpoint in %s is of another version or tariff' % self.output)
+        return checkpoint
+
+    def _save_checkpoint(self, checkpoint):
+        # Replaced atomically so that an interrupted save leaves the previous checkpoint
+        path = self.checkpoint_path + '.tmp'
+        with open(path, 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(path, self.checkpoint_path)
+
+    def _rows(self, meters, periods):
+        """A DataFrame of the components and total of each meter and billing period"""
+        rows = pandas.DataFrame({
+            'meter': numpy.tile(numpy.asarray(meters, dtype=object), len(periods)),
+            'period': numpy.repeat(pandas.DatetimeIndex(list(periods)).values, len(meters)),
+        })
+        costs = numpy.zeros((len(periods), len(meters), len(self.components)))
+        for position, components in enumerate(periods.values()):
+            for name, cost in components.items():
+                costs[position, :, self.components.index(name)] = cost
+        costs = costs.reshape(-1, len(self.components))
+        for position, name in enumerate(self.components):
+            rows[name] = costs[:, position]
+        rows['total'] = costs.sum(axis=1)
+        return rows
+
+    def _write(self, sequence, rows):
+        pyarrow, parquet = _import_parquet()
+        path = self._part_path(sequence)
+        if not len(rows):
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        parquet.write_table(pyarrow.Table.from_pandas(rows, preserve_index=False), path + '.tmp')
+        os.replace(path + '.tmp', path)
+
+    def run(self, partitions, resume=True):
+        """
+            Bills each partition in turn.
+
+            :param partitions: an iterable of the key of each partition, a JSON-serializable identifier such as its
+                path, and its fleet meter data or a function loading it (see parquet_partitions)
+            :param resume: whether to resume from the checkpoint of a previous run over the same partitions, skipping
+                the partitions it completed without loading them, otherwise any previous output is replaced
+            :return: the number of partitions billed
+        """
+        if not os.path.isdir(self.output):
+            os.makedirs(self.output)
+        checkpoint = self._load_checkpoint() if resume else None
+        if checkpoint is None:
+            for name in os.listdir(self.output):
+                if name.startswith('part-'):
+                    os.remove(os.path.join(self.output, name))
+            checkpoint = {'version': CHECKPOINT_VERSION, 'components': self.components, 'partitions': [],
+                          'accumulators': [], 'finished': False}
+        completed = checkpoint['partitions']
+        accumulators = dict((tuple(meters), BillAccumulator.from_state(self.tariff, state))
+                            for meters, state in checkpoint['accumulators'])
+
+        billed = 0
+        for sequence, (key, partition) in enumerate(partitions):
+            key = json.loads(json.dumps(key))
+            if sequence < len(completed):
+                if completed[sequence] != key:
+                    raise UserWarning('Partition %s differs from the partition %s completed by the checkpoint' % (
+                        key, completed[sequence]))
+                continue
+            if checkpoint['finished']:
+                raise UserWarning('Partition %s follows the partitions of a finished run' % key)
+
+            meter_data = partition() if callable(partition) else partition
+            meters = fleet_meters(meter_data)
+            if meters is None:
+                raise UserWarning('Partitions require fleet meter data with a column MultiIndex of meter and register')
+            group = tuple(meters.tolist())
+            accumulator = accumulators.setdefault(group, BillAccumulator(self.tariff))
+            accumulator.update(meter_data)
+            count('partition', key=key, rows=len(meter_data), meters=len(group))
+            self._write(sequence, self._rows(group, accumulator.pop_periods()))
+            # Released before the next partition is loaded
+            del meter_data
+
+            completed.append(key)
+            checkpoint['accumulators'] = [[list(group), accumulator.state()]
+                                          for group, accumulator in accumulators.items()]
+            self._save_checkpoint(checkpoint)
+            billed += 1
+
+        if not checkpoint['finished']:
+            # The open billing periods of every group of meters are written once all partitions are billed
+            rows = [self._rows(list(group), accumulator.pop_periods(final=True))
+                    for group, accumulator in accumulators.items()]
+            self._write(len(completed), pandas.concat(rows, ignore_index=True) if rows else self._rows([], {}))
+            checkpoint.update(accumulators=[], finished=True)
+            self._save_checkpoint(checkpoint)
+        return billed
+
+    def results(self):
+        """The bill of each meter and billing period written so far, as a DataFrame"""
+        _, parquet = _import_parquet()
+        paths = sorted(name for name in os.listdir(self.output) if name.startswith('part-') and
+                       name.endswith('.parquet'))
+        if not paths:
+            return pandas.DataFrame(columns=['meter', 'period'] + self.components + ['total'])
+        return pandas.concat([parquet.read_table(os.path.join(self.output, path)).to_pandas() for path in paths],
+                             ignore_index=True)
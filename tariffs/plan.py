@@ -0,0 +1,365 @@
+"""
+Compiled billing plans.
+
+A billing plan is an immutable, array-backed interpretation of a Tariff resource. Seasons are compiled into a
+366-slot day-of-year table and time-of-use times into a 10080-slot minute-of-week table so that evaluating a charge
+over a meter data index reduces to integer gathers.
+"""
+import sys
+
+import numpy
+import odin
+import pandas
+from odin.utils import field_iter_items
+
+from tariffs.instrumentation import active, count
+
+
+MINUTES_PER_DAY = 1440
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+DAYS_PER_YEAR = 366
+
+# Days of a leap year, seasons are keyed by month and day so each season table covers the 29th of February
+_CALENDAR = numpy.arange('2000-01-01', '2001-01-01', dtype='datetime64[D]')
+_CALENDAR_MONTH = _CALENDAR.astype('datetime64[M]').astype(int) % 12 + 1
+_CALENDAR_DAY = (_CALENDAR - _CALENDAR.astype('datetime64[M]')).astype(int) + 1
+_MONTH_OFFSETS = numpy.searchsorted(_CALENDAR_MONTH, numpy.arange(1, 13))
+
+
+def _read_only(array):
+    array.flags.writeable = False
+    return array
+
+
+def season_table(season):
+    """Compiles a season into a boolean day-of-year table"""
+    month_day = _CALENDAR_MONTH * 100 + _CALENDAR_DAY
+    return _read_only((season.from_month * 100 + season.from_day <= month_day) &
+                      (month_day <= season.to_month * 100 + season.to_day))
+
+
+def time_table(time):
+    """Compiles the periods of a time-of-use time into a boolean minute-of-week table"""
+    weekday, minute = numpy.divmod(numpy.arange(MINUTES_PER_WEEK), MINUTES_PER_DAY)
+    table = numpy.zeros(MINUTES_PER_WEEK, dtype=bool)
+    for period in time.periods:
+        table |= ((period.from_weekday <= weekday) & (weekday <= period.to_weekday) &
+                  (period.from_hour * 60 + period.from_minute <= minute) &
+                  (minute <= period.to_hour * 60 + period.to_minute))
+    return _read_only(table)
+
+
+def resource_signature(resource):
+    """
+        Builds a hashable snapshot of the field values of a resource, used to detect when a compiled plan is stale.
+
+        Rate schedules are identified by the list object and its length rather than item by item.
+    """
+    if isinstance(resource, odin.Resource):
+        signature = []
+        for field, value in field_iter_items(resource):
+            if field.attname == 'rate_schedule' and value is not None:
+                signature.append((id(value), len(value)))
+            else:
+                signature.append(resource_signature(value))
+        return tuple(signature)
+    if isinstance(resource, (list, tuple)):
+        return tuple(resource_signature(value) for value in resource)
+    if isinstance(resource, dict):
+        return tuple(sorted((key, resource_signature(value)) for key, value in resource.items()))
+    return resource
+
+
+class CalendarFeatures(object):
+    """Calendar fields of a DatetimeIndex computed once and shared by every charge evaluated against it"""
+    __slots__ = ('index', 'year', 'month', 'day', 'minute_of_week', 'day_of_year')
+
+    def __init__(self, index):
+        month = numpy.asarray(index.month)
+        day = numpy.asarray(index.day)
+        hour = numpy.asarray(index.hour)
+        minute = numpy.asarray(index.minute)
+        self.index = index
+        self.year = numpy.asarray(index.year)
+        self.month = month
+        self.day = day
+        self.minute_of_week = numpy.asarray(index.dayofweek) * MINUTES_PER_DAY + hour * 60 + minute
+        self.day_of_year = _MONTH_OFFSETS[month - 1] + day - 1
+
+    def __len__(self):
+        return len(self.index)
+
+
+def billing_cycles(features, billing_period, charge_type='consumption'):
+    """
+        Labels each timestamp with the billing cycle it falls within, block charge accumulations run within a
+        cycle. Demand charges are assessed against the peak of each billing period so every interval is its own cycle.
+    """
+    if charge_type == 'demand':
+        return numpy.arange(len(features))
+    if billing_period == 'daily':
+        return (features.year * 12 + features.month) * 31 + features.day
+    elif billing_period == 'monthly':
+        return features.year * 12 + features.month
+    elif billing_period == 'quarterly':
+        return features.year * 4 + (features.month - 1) // 3
+    elif billing_period == 'annually':
+        return features.year
+    return numpy.zeros(len(features), dtype=int)
+
+
+def by_interval(array, values):
+    """Reshapes a per-interval array to broadcast against a meter data array with a column per meter"""
+    return array.reshape(array.shape + (1,) * (values.ndim - 1))
+
+
+def fleet_meters(meter_data):
+    """The meter ids of fleet meter data, whose columns are a MultiIndex of meter and register, otherwise None"""
+    if isinstance(meter_data.columns, pandas.MultiIndex):
+        return pandas.Index(meter_data.columns.get_level_values(0).unique(), name='meter')
+    return None
+
+
+def register_values(meter_data, register):
+    """
+        Selects a register (e.g. electricity_imported) of meter data as a float array. Fleet meter data, whose columns
+        are a MultiIndex of meter and register, gives an array with a column per meter.
+    """
+    meters = fleet_meters(meter_data)
+    if meters is not None:
+        return meter_data.xs(register, axis=1, level=-1).reindex(columns=meters).fillna(0.0).to_numpy(dtype=float)
+    return meter_data[register].to_numpy(dtype=float)
+
+
+def grouped_cumsum(values, labels):
+    """Cumulative sum along the first axis restarting wherever the (contiguous) label changes"""
+    cumulative = numpy.cumsum(values, axis=0)
+    if len(labels) == 0:
+        return cumulative
+    changes = labels[1:] != labels[:-1]
+    group = numpy.concatenate(([0], numpy.cumsum(changes)))
+    starts = numpy.flatnonzero(changes) + 1
+    offsets = numpy.concatenate((numpy.zeros_like(cumulative[:1]), cumulative[starts - 1]))
+    return cumulative - offsets[group]
+
+
+def block_costs(values, mask, cycles, band_limits, band_rates, initial=None):
+    """
+        Calculates the cost of each interval against a block / rate band structure. The cumulative usage within each
+        billing cycle is apportioned across the rate bands, whose limits are cumulative, by clipping the usage before
+        and after each interval to the bounds of every band.
+
+        An initial accumulation carried over from earlier meter data may be given for the first billing cycle.
+    """
+    usage = numpy.where(by_interval(mask, values), values, 0.0)
+    cumulative = grouped_cumsum(usage, cycles)
+    if initial is not None and len(cycles):
+        cumulative[:numpy.argmax(numpy.append(cycles, cycles[0] + 1) != cycles[0])] += initial
+    cumulative = cumulative[..., numpy.newaxis]
+    previous = cumulative - usage[..., numpy.newaxis]
+    lower = numpy.maximum.accumulate(numpy.concatenate(([0.0], band_limits[:-1])))
+    upper = numpy.maximum(band_limits, lower)
+    band_usage = numpy.clip(cumulative, lower, upper) - numpy.clip(previous, lower, upper)
+    return numpy.dot(band_usage, band_rates)
+
+
+def band_rates(usage, band_limits, band_rates):
+    """
+        The rate of the band reached by each cumulative usage, i.e. the rate of the next unit of usage, against a block
+        / rate band structure. Usage beyond the last band costs nothing, as in block_costs.
+    """
+    lower = numpy.maximum.accumulate(numpy.concatenate(([0.0], band_limits[:-1])))
+    upper = numpy.maximum(band_limits, lower)
+    return numpy.append(band_rates, 0.0)[numpy.searchsorted(upper, usage, side='right')]
+
+
+def cycle_totals(values, cycles):
+    """The total of each (contiguous) billing cycle along the first axis, for each of its rows"""
+    if len(cycles) == 0:
+        return values
+    changes = cycles[1:] != cycles[:-1]
+    group = numpy.concatenate(([0], numpy.cumsum(changes)))
+    starts = numpy.concatenate(([0], numpy.flatnonzero(changes) + 1))
+    return numpy.add.reduceat(values, starts, axis=0)[group]
+
+
+def component_name(charge, service):
+    """The name of the charge component a charge is billed in, None for charges without rates"""
+    name = str(charge.code) + str(service) + str(charge.type)
+    if charge.time and charge.season:
+        name += charge.season.name + charge.time.name
+    elif charge.season:
+        name += charge.season.name
+    elif charge.time:
+        name += charge.time.name
+    elif charge.rate_schedule:
+        name += 'scheduled'
+    elif not (charge.rate or charge.rate_bands):
+        return None
+    return sys.intern(name)
+
+
+class _Immutable(object):
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError('%s is immutable' % type(self).__name__)
+
+    def _init(self, **values):
+        for name, value in values.items():
+            object.__setattr__(self, name, value)
+
+    def __getstate__(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for value in state.values():
+            if isinstance(value, numpy.ndarray):
+                _read_only(value)
+        self._init(**state)
+
+
+class ChargePlan(_Immutable):
+    """A compiled charge component"""
+    __slots__ = ('component', 'name', 'type', 'meter', 'rate', 'band_limits', 'band_rates', 'schedule', 'time_table',
+                 'season_table', 'ratchet')
+
+    def __init__(self, charge, component, name):
+        band_limits = band_rates = schedule = None
+        if charge.rate_bands:
+            band_limits = _read_only(numpy.array([rate_band.limit for rate_band in charge.rate_bands], dtype=float))
+            band_rates = _read_only(numpy.array([rate_band.rate for rate_band in charge.rate_bands], dtype=float))
+        if charge.rate_schedule and not (charge.time or charge.season):
+            schedule = charge.get_rate_schedule()
+        self._init(
+            component=component,
+            name=name,
+            type=charge.type,
+            meter=charge.meter,
+            rate=charge.rate,
+            band_limits=band_limits,
+            band_rates=band_rates,
+            schedule=schedule,
+            time_table=time_table(charge.time) if charge.time else None,
+            season_table=season_table(charge.season) if charge.season else None,
+            # The fraction of the highest peak of the preceding billing periods and the number of periods
+            ratchet=(charge.ratchet.percentage / 100.0, charge.ratchet.periods or 11) if charge.ratchet else None,
+        )
+
+    def mask(self, features):
+        """Boolean array marking the intervals falling within the season and time-of-use periods of the charge"""
+        mask = numpy.ones(len(features), dtype=bool)
+        if self.season_table is not None:
+            mask &= self.season_table[features.day_of_year]
+        if self.time_table is not None:
+            mask &= self.time_table[features.minute_of_week]
+        return mask
+
+    def matched(self, features):
+        """The number of intervals falling within the season and time-of-use periods, or rate schedule, of the charge"""
+        if self.schedule is not None:
+            return int(numpy.count_nonzero(~numpy.isnan(self.schedule.rates_at(features.index))))
+        return int(numpy.count_nonzero(self.mask(features)))
+
+    def costs(self, values, features, cycles=None, initial=None):
+        """
+            Calculates the cost of each interval of a meter data array against the charge, the array may have a
+            column per meter in which case each meter is costed independently. Block charges accumulate within the
+            given billing cycles, starting the first cycle from an optional initial accumulation.
+        """
+        if self.schedule is not None:
+            rates = by_interval(self.schedule.rates_at(features.index), values)
+            return numpy.where(numpy.isnan(rates), 0.0, rates * values)
+
+        mask = self.mask(features)
+        costs = numpy.zeros(values.shape)
+        if self.rate:
+            costs += numpy.where(by_interval(mask, values), self.rate * values, 0.0)
+        if self.band_limits is not None:
+            costs += block_costs(values, mask, cycles, self.band_limits, self.band_rates, initial)
+        return costs
+
+    def marginal_rates(self, values, features, cycles=None):
+        """
+            Calculates the change in the cost of the charge per unit change of each interval of a meter data array,
+            evaluated as by costs. Every interval of a block charge's billing cycle has the rate of the band reached
+            by the cycle's total usage, the cost of a block charge only depending on that total.
+        """
+        if self.schedule is not None:
+            rates = by_interval(self.schedule.rates_at(features.index), values)
+            return numpy.broadcast_to(numpy.where(numpy.isnan(rates), 0.0, rates), values.shape)
+
+        mask = by_interval(self.mask(features), values)
+        rates = numpy.zeros(values.shape)
+        if self.rate:
+            rates += numpy.where(mask, self.rate, 0.0)
+        if self.band_limits is not None:
+            totals = cycle_totals(numpy.where(mask, values, 0.0), cycles)
+            rates += numpy.where(mask, band_rates(totals, self.band_limits, self.band_rates), 0.0)
+        return rates
+
+
+class BillingPlan(_Immutable):
+    """A compiled tariff, created by Tariff.compile()"""
+    __slots__ = ('service', 'billing_period', 'demand_window', 'demand_window_type', 'charge_types', 'components',
+                 'charges', 'signature')
+
+    def __init__(self, tariff, signature=None):
+        components = []
+        charges = []
+        for charge in tariff.charges or ():
+            name = component_name(charge, tariff.service)
+            if name is None:
+                continue
+            # Charges sharing a name accumulate into the same component
+            if name not in components:
+                components.append(name)
+            charges.append(ChargePlan(charge, components.index(name), name))
+
+        self._init(
+            service=tariff.service,
+            billing_period=tariff.billing_period,
+            demand_window=tariff.demand_window,
+            demand_window_type=tariff.demand_window_type or 'fixed',
+            charge_types=frozenset(tariff.charge_types),
+            components=tuple(components),
+            charges=tuple(charges),
+            signature=signature if signature is not None else resource_signature(tariff),
+        )
+
+    def with_signature(self, signature):
+        """A copy of the plan identifying the tariff it was compiled from by another signature"""
+        plan = type(self).__new__(type(self))
+        state = self.__getstate__()
+        state['signature'] = signature
+        plan.__setstate__(state)
+        return plan
+
+    def apply_by_charge_type(self, meter_data, charge_type='consumption', features=None):
+        """
+            Calculates the cost of energy given the compiled tariff and load.
+
+            :param meter_data: a three-column pandas array with datetime, imported energy (kwh), exported energy (kwh),
+                or fleet meter data with a column per meter and register
+            :param features: optional pre-computed calendar features of the meter data index
+            :return: a dictionary containing the charge components (e.g. off_peak, shoulder, peak, total)
+        """
+        if features is None:
+            features = CalendarFeatures(meter_data.index)
+
+        charge_array = dict()
+        cycles = None
+        for charge in self.charges:
+            if charge.type != charge_type:
+                continue
+            if charge.band_limits is not None and cycles is None:
+                cycles = billing_cycles(features, self.billing_period, charge_type)
+            costs = charge.costs(register_values(meter_data, charge.meter), features, cycles)
+            if active() is not None:
+                count('matched', charge=charge.name, charge_type=charge_type, intervals=len(features),
+                      matched=charge.matched(features))
+            if charge.name in charge_array:
+                costs = charge_array[charge.name] + costs
+            charge_array[charge.name] = costs
+
+        return charge_array
@@ -0,0 +1,51 @@
+"""
+Portfolio calculations applying many tariffs to the same meter data, e.g. for tariff switching analysis.
+"""
+import pandas
+
+from tariffs.meter import MeterData
+
+
+PORTFOLIO_OUTPUT_FORMAT_CHOICES = (
+    ('total', 'total'),
+    ('total-components', 'total-components'),
+)
+
+
+def tariff_labels(tariffs):
+    """Labels each tariff by its code, falling back to its position for tariffs without a code"""
+    return [tariff.code if tariff.code is not None else i for i, tariff in enumerate(tariffs)]
+
+
+def apply_many(tariffs, meter_data, start=None, end=None, output_format='total', engine='vectorized'):
+    """
+        Calculates the cost of energy for each of a collection of tariffs given a single load. Each distinct
+        resampling of the meter data and its calendar features are computed once and shared between all tariffs.
+
+        :param tariffs: an iterable of Tariff resources
+        :param meter_data: a three-column pandas array with datetime, imported energy (kwh), exported energy (kwh),
+            or a MeterData instance
+        :param start: an optional datetime to select the commencement of the bill calculation
+        :param end: an optional datetime to select the termination of the bill calculation
+        :param output_format: 'total' for the total of each tariff or 'total-components' for each charge component
+            of each tariff along with its total
+        :return: a DataFrame with one row per tariff, indexed by tariff code
+    """
+    if output_format not in dict(PORTFOLIO_OUTPUT_FORMAT_CHOICES):
+        raise UserWarning('Unsupported output format: %s' % output_format)
+
+    tariffs = list(tariffs)
+    meter_data = MeterData.coerce(meter_data).truncate(before=start, after=end)
+    records = []
+    for tariff in tariffs:
+        components = tariff.apply(meter_data, output_format='total-components', engine=engine)
+        record = dict(components) if output_format == 'total-components' else dict()
+        record['total'] = sum(components.values())
+        records.append(record)
+
+    output = pandas.DataFrame.from_records(records, index=pandas.Index(tariff_labels(tariffs), name='tariff'))
+    if output_format == 'total-components':
+        # Tariffs without a given component contribute nothing to it
+        output = output.fillna(0.0)
+        output = output[[column for column in output.columns if column != 'total'] + ['total']]
+    return output
@@ -0,0 +1,86 @@
+"""
+Marginal prices, e.g. for battery and flexible load dispatch optimisation.
+
+The marginal price of an interval is the change in the bill per unit change of the energy imported or exported in
+that interval, evaluated by the compiled charges over the same resampled meter data as the bill: the time-of-use,
+seasonal or scheduled rate of each charge and, for block charges, the rate of the band reached within the billing
+cycle. Exported energy is priced by the charges on the exported register, feed-in tariffs giving negative prices.
+
+Demand charges are priced per billing period as the change in the cost of each charge per unit change of its peak
+demand, its shadow price, along with the peak and the start of the demand window setting it.
+"""
+import numpy
+import pandas
+
+from tariffs.demand import DEMAND_COLUMNS, demand_charges, demand_frame
+from tariffs.meter import MeterData
+from tariffs.plan import billing_cycles, fleet_meters, register_values
+from tariffs.streaming import bin_labels
+from tariffs.tariff import PERIOD_TO_TIMESTEP
+
+
+REGISTERS = ('electricity_imported', 'electricity_exported')
+
+
+def interval_prices(tariff, meter_data):
+    """
+        Calculates the marginal price of each interval for each register priced by a consumption charge.
+
+        :param tariff: a Tariff resource
+        :param meter_data: a MeterData instance
+        :return: a dictionary of the marginal prices of each register, arrays with a row per interval and a column per
+            meter for fleet meter data
+    """
+    plan = tariff.compile()
+    frame = meter_data.frame
+    meters = fleet_meters(frame)
+    shape = (len(frame),) if meters is None else (len(frame), len(meters))
+    prices = dict((register, numpy.zeros(shape)) for register in REGISTERS)
+    if 'consumption' not in plan.charge_types or not len(frame):
+        return prices
+
+    steps = tariff.resampling_steps('consumption')
+    resampled = meter_data.resample(*steps)
+    features = meter_data.features(*steps)
+    cycles = billing_cycles(features, plan.billing_period)
+    # The resampled row each interval is billed within, the rows being sums of the intervals
+    positions = resampled.index.get_indexer(bin_labels(frame.index, steps[-1][0])) if steps else None
+    for charge in plan.charges:
+        if charge.type != 'consumption':
+            continue
+        rates = charge.marginal_rates(register_values(resampled, charge.meter), features, cycles)
+        if positions is not None:
+            rates = rates[positions]
+        prices[charge.meter] = prices.get(charge.meter, 0.0) + rates
+    return prices
+
+
+def marginal_prices(tariff, meter_data, start=None, end=None):
+    """
+        Calculates the marginal prices of a tariff given a load, in a single pass over the meter data.
+
+        :param tariff: a Tariff resource
+        :param meter_data: a three-column pandas array with datetime, imported energy (kwh), exported energy (kwh),
+            fleet meter data with a column per meter and register, or a MeterData instance
+        :param start: an optional datetime to select the commencement of the bill calculation
+        :param end: an optional datetime to select the termination of the bill calculation
+        :return: a DataFrame of the marginal price of each register (electricity_imported, electricity_exported and
+            any other register priced by a charge) aligned to the index of the meter data, with a column per meter and
+            register for fleet meter data, and a DataFrame of the shadow price of each demand charge and billing
+            period (see Tariff.demand_peaks) along with the peak demand and the start of its demand window
+    """
+    meter_data = MeterData.coerce(meter_data).truncate(before=start, after=end)
+    frame = meter_data.frame
+    meters = fleet_meters(frame)
+
+    prices = interval_prices(tariff, meter_data)
+    if meters is None:
+        intervals = pandas.DataFrame(prices, index=frame.index, columns=list(prices))
+    else:
+        columns = pandas.MultiIndex.from_product([meters, list(prices)], names=['meter', 'register'])
+        intervals = pandas.DataFrame(numpy.stack(list(prices.values()), axis=-1).reshape(len(frame), -1),
+                                     index=frame.index, columns=columns)
+
+    demand = demand_frame(demand_charges(tariff.compile(), meter_data, PERIOD_TO_TIMESTEP[tariff.demand_window]),
+                          meters, ('peak', 'peak_timestamp', 'ratcheted') + DEMAND_COLUMNS[-1:])
+    return intervals, demand
@@ -0,0 +1,275 @@
+"""
+Ranking tariffs by the bill of a load, e.g. to find the cheapest tariffs for a customer.
+
+Rather than billing every tariff, each tariff's bill is bounded from a summary of the load computed once: the energy
+of each register by minute of the week and by day of the year, giving the energy within the seasons or times of a
+charge, and the unrestricted peak demand of each billing period. Tariffs are then billed in order of their lower
+bound until no further tariff could be cheaper than the k cheapest billed so far.
+
+Bounds cover the charges billed by Tariff.apply, so the bills of the ranked tariffs are exactly those of Tariff.apply.
+"""
+import heapq
+
+import numpy
+import pandas
+
+from tariffs.demand import DemandWindows, billing_periods, period_peaks, ratchet_peaks
+from tariffs.instrumentation import count
+from tariffs.meter import MeterData
+from tariffs.plan import DAYS_PER_YEAR, MINUTES_PER_WEEK, fleet_meters, register_values
+from tariffs.portfolio import tariff_labels
+from tariffs.tariff import PERIOD_TO_TIMESTEP
+
+
+# Bounds are widened by this relative tolerance as they are summed in a different order to the bill
+TOLERANCE = 1e-9
+
+
+def _scaled(rate_lower, rate_upper, lower, upper):
+    """The bounds of the product of a rate and a quantity, each within bounds"""
+    products = numpy.array([rate_lower * lower, rate_lower * upper, rate_upper * lower, rate_upper * upper])
+    return products.min(axis=0), products.max(axis=0)
+
+
+def _slopes(charge, upper):
+    """The bounds of the rates of the bands of a block charge reachable by usage up to an upper bound"""
+    rates = charge.band_rates
+    if upper > charge.band_limits.max():
+        # Usage beyond the last band costs nothing
+        rates = numpy.append(rates, 0.0)
+    return rates.min(), rates.max()
+
+
+class LoadSummary(object):
+    """
+        The aggregates of a single meter's load used to bound bills, each computed when first required.
+
+        :param meter_data: a MeterData instance
+    """
+
+    def __init__(self, meter_data):
+        self.meter_data = meter_data
+        self._registers = dict()
+        self._peaks = dict()
+
+    def register(self, register):
+        """
+            The energy of a register by minute of the week and day of the year, separately for the intervals of
+            positive and negative energy, along with the total positive and negative energy.
+        """
+        summary = self._registers.get(register)
+        if summary is None:
+            frame = self.meter_data.frame
+            features = self.meter_data.features()
+            values = register_values(frame, register) if register in frame else numpy.zeros(len(frame))
+            values = numpy.where(numpy.isnan(values), 0.0, values)
+            summary = dict()
+            for sign, part in (('positive', numpy.maximum(values, 0.0)), ('negative', numpy.minimum(values, 0.0))):
+                summary[sign] = (
+                    float(part.sum()),
+                    numpy.bincount(features.minute_of_week, part, minlength=MINUTES_PER_WEEK),
+                    numpy.bincount(features.day_of_year, part, minlength=DAYS_PER_YEAR),
+                )
+            self._registers[register] = summary
+        return summary
+
+    def usage(self, charge):
+        """
+            The bounds of the positive and negative energy of the register of a consumption charge within its seasons
+            and times. Either restriction alone is exact, both together are bounded by the energy within each.
+        """
+        bounds = []
+        for sign in ('positive', 'negative'):
+            total, by_minute, by_day = self.register(charge.meter)[sign]
+            if charge.time_table is None and charge.season_table is None:
+                bounds.extend((total, total))
+                continue
+            within_time = float(numpy.dot(by_minute, charge.time_table)) if charge.time_table is not None else total
+            within_season = float(numpy.dot(by_day, charge.season_table)) if charge.season_table is not None \
+                else total
+            if charge.time_table is None or charge.season_table is None:
+                within = within_time if charge.season_table is None else within_season
+                bounds.extend((within, within))
+            elif sign == 'positive':
+                bounds.extend((max(0.0, within_time + within_season - total), min(within_time, within_season)))
+            else:
+                bounds.extend((max(within_time, within_season), min(0.0, within_time + within_season - total)))
+        return tuple(bounds)
+
+    def peaks(self, register, rule, rolling, billing_period):
+        """
+            The highest and lowest demand of the windows of each billing period, along with the consecutive ordinal
+            and start of each billing period.
+        """
+        key = (register, rule, rolling, billing_period)
+        peaks = self._peaks.get(key)
+        if peaks is None:
+            windows = DemandWindows(self.meter_data, rule, rolling)
+            if not len(windows):
+                peaks = (numpy.zeros(0), numpy.zeros(0), numpy.zeros(0, dtype=int), windows.index)
+            else:
+                starts, periods, ordinals = billing_periods(windows.features, billing_period)
+                values = windows.values(register) if register in windows.frame else numpy.zeros(len(windows))
+                highest, _ = period_peaks(values, numpy.ones(len(windows), dtype=bool), starts)
+                lowest = numpy.minimum.reduceat(numpy.where(numpy.isnan(values), numpy.inf, values), starts)
+                peaks = (highest, numpy.where(numpy.isinf(lowest), 0.0, lowest), ordinals, periods)
+            self._peaks[key] = peaks
+        return peaks
+
+    def consumption(self):
+        """The total imported energy, as assessed by the consumption eligibility of tariffs"""
+        summary = self.register('electricity_imported')
+        return summary['positive'][0] + summary['negative'][0]
+
+    def demand(self, tariff):
+        """The peak imported demand of the demand windows of a tariff, as assessed by its demand eligibility"""
+        highest = self.peaks('electricity_imported', PERIOD_TO_TIMESTEP[tariff.demand_window],
+                             tariff.demand_window_type == 'rolling', tariff.billing_period)[0]
+        return float(highest.max()) if len(highest) else 0.0
+
+
+def eligible(tariff, summary):
+    """Whether a load is within the consumption and demand bounds of a tariff"""
+    if tariff.min_consumption is not None or tariff.max_consumption is not None:
+        consumption = summary.consumption()
+        if tariff.min_consumption is not None and consumption < tariff.min_consumption:
+            return False
+        if tariff.max_consumption is not None and consumption > tariff.max_consumption:
+            return False
+    if tariff.min_demand is not None or tariff.max_demand is not None:
+        demand = summary.demand(tariff)
+        if tariff.min_demand is not None and demand < tariff.min_demand:
+            return False
+        if tariff.max_demand is not None and demand > tariff.max_demand:
+            return False
+    return True
+
+
+def _consumption_bounds(charge, summary):
+    positive_lower, positive_upper, negative_lower, negative_upper = summary.usage(charge)
+    if charge.schedule is not None:
+        rates = charge.schedule.rates[~numpy.isnan(charge.schedule.rates)]
+        # Intervals after the last rate of the schedule cost nothing
+        rate_lower, rate_upper = min(rates.min(initial=0.0), 0.0), max(rates.max(initial=0.0), 0.0)
+        positive = _scaled(rate_lower, rate_upper, positive_lower, positive_upper)
+        negative = _scaled(rate_lower, rate_upper, negative_lower, negative_upper)
+        return positive[0] + negative[0], positive[1] + negative[1]
+
+    lower = upper = 0.0
+    if charge.rate:
+        rate_lower, rate_upper = _scaled(charge.rate, charge.rate, positive_lower + negative_lower,
+                                         positive_upper + negative_upper)
+        lower, upper = lower + rate_lower, upper + rate_upper
+    if charge.band_limits is not None:
+        # The positive usage of the billing cycles, only which is costed by the bands
+        usage_lower, usage_upper = max(positive_lower + negative_lower, 0.0), positive_upper
+        band_lower, band_upper = _scaled(*_slopes(charge, usage_upper) + (usage_lower, usage_upper))
+        lower, upper = lower + band_lower, upper + band_upper
+    return lower, upper
+
+
+def _demand_bounds(plan, charge, summary, rule):
+    highest, lowest, ordinals, periods = summary.peaks(charge.meter, rule, plan.demand_window_type == 'rolling',
+                                                       plan.billing_period)
+    if not len(highest):
+        return 0.0, 0.0
+    if charge.time_table is None and charge.season_table is None:
+        billed_lower, billed_upper = highest, highest
+    else:
+        # Billing periods without eligible windows have no peak
+        billed_lower, billed_upper = numpy.minimum(lowest, 0.0), numpy.maximum(highest, 0.0)
+    if charge.ratchet is not None:
+        fraction, preceding = charge.ratchet
+        billed_upper = numpy.maximum(billed_upper, fraction * ratchet_peaks(billed_upper, ordinals, preceding)[0])
+
+    if charge.schedule is not None:
+        rates = charge.schedule.rates_at(periods)
+        rates = numpy.where(numpy.isnan(rates), 0.0, rates)
+        lower, upper = _scaled(rates, rates, billed_lower, billed_upper)
+        return float(lower.sum()), float(upper.sum())
+    lower = numpy.zeros(len(highest))
+    upper = numpy.zeros(len(highest))
+    if charge.rate:
+        rate_lower, rate_upper = _scaled(charge.rate, charge.rate, billed_lower, billed_upper)
+        lower, upper = lower + rate_lower, upper + rate_upper
+    if charge.band_limits is not None:
+        usage_lower, usage_upper = numpy.maximum(billed_lower, 0.0), numpy.maximum(billed_upper, 0.0)
+        band_lower, band_upper = _scaled(*_slopes(charge, usage_upper.max()) + (usage_lower, usage_upper))
+        lower, upper = lower + band_lower, upper + band_upper
+    return float(lower.sum()), float(upper.sum())
+
+
+def bill_bounds(tariff, summary):
+    """
+        Bounds the bill of a tariff, as calculated by Tariff.apply, from a summary of a load.
+
+        :param tariff: a Tariff resource
+        :param summary: a LoadSummary of the load
+        :return: the lower and upper bounds of the bill
+    """
+    plan = tariff.compile()
+    rule = PERIOD_TO_TIMESTEP[plan.demand_window]
+    lower = upper = 0.0
+    for charge in plan.charges:
+        if charge.type == 'demand':
+            charge_lower, charge_upper = _demand_bounds(plan, charge, summary, rule)
+        else:
+            charge_lower, charge_upper = _consumption_bounds(charge, summary)
+        lower, upper = lower + charge_lower, upper + charge_upper
+    slack = TOLERANCE * max(abs(lower), abs(upper), 1.0)
+    return lower - slack, upper + slack
+
+
+def rank_tariffs(tariffs, meter_data, k=1, start=None, end=None, check_eligibility=True, engine='vectorized'):
+    """
+        Finds the k cheapest tariffs for a load, only billing the tariffs that could be among them.
+
+        :param tariffs: an iterable of Tariff resources
+        :param meter_data: a three-column pandas array with datetime, imported energy (kwh), exported energy (kwh),
+            or a MeterData instance
+        :param k: the number of tariffs to rank
+        :param start: an optional datetime to select the commencement of the bill calculation
+        :param end: an optional datetime to select the termination of the bill calculation
+        :param check_eligibility: whether to exclude the tariffs whose consumption or demand bounds (min_consumption,
+            max_consumption, min_demand and max_demand) exclude the load, its consumption being the total imported
+            energy of the meter data and its demand the peak imported demand of the tariff's demand windows
+        :return: a DataFrame of the bill of the k cheapest eligible tariffs in ascending order, indexed by tariff code,
+            along with their rank and the bounds of their bills
+    """
+    tariffs = list(tariffs)
+    meter_data = MeterData.coerce(meter_data).truncate(before=start, after=end)
+    if fleet_meters(meter_data.frame) is not None:
+        raise UserWarning('Ranking tariffs requires the meter data of a single meter')
+    summary = LoadSummary(meter_data)
+
+    candidates = [position for position, tariff in enumerate(tariffs)
+                  if not check_eligibility or eligible(tariff, summary)]
+    bounds = dict((position, bill_bounds(tariffs[position], summary)) for position in candidates)
+    # Tariffs whose lower bound exceeds the upper bound of k others can't be among the k cheapest
+    if len(candidates) > k:
+        threshold = numpy.partition([bounds[position][1] for position in candidates], k - 1)[k - 1]
+        candidates = [position for position in candidates if bounds[position][0] <= threshold]
+
+    # The k cheapest bills so far, as a heap of (-bill, -position)
+    cheapest = []
+    billed = 0
+    for position in sorted(candidates, key=lambda position: (bounds[position][0], position)):
+        if len(cheapest) == k and bounds[position][0] > -cheapest[0][0]:
+            break
+        bill = tariffs[position].apply(meter_data, engine=engine)
+        billed += 1
+        entry = (-bill, -position)
+        if len(cheapest) < k:
+            heapq.heappush(cheapest, entry)
+        elif entry > cheapest[0]:
+            heapq.heapreplace(cheapest, entry)
+    count('ranked', tariffs=len(tariffs), eligible=len(bounds), candidates=len(candidates), billed=billed)
+
+    ranked = sorted((-bill, -position) for bill, position in cheapest)
+    labels = tariff_labels(tariffs)
+    return pandas.DataFrame({
+        'rank': numpy.arange(1, len(ranked) + 1),
+        'total': [bill for bill, _ in ranked],
+        'lower': [bounds[position][0] for _, position in ranked],
+        'upper': [bounds[position][1] for _, position in ranked],
+    }, index=pandas.Index([labels[position] for _, position in ranked], name='tariff'))
@@ -0,0 +1,157 @@
+"""
+Content-addressed cache of bill results.
+
+Results are keyed by a digest of the serialized tariff, a digest of the meter data and the arguments of the bill
+calculation, so a cached result is only returned for the same tariff content billed against the same meter data and
+modifying either misses the cache without any explicit invalidation. Results are kept in a bounded least recently used
+cache in memory and optionally in a directory on local disk, bounded in size, which may be shared between processes.
+"""
+import copy
+import hashlib
+import os
+import pickle
+import threading
+import uuid
+from collections import OrderedDict
+
+from tariffs.instrumentation import count
+from tariffs.meter import MeterData
+
+
+CACHE_VERSION = 1
+
+SUFFIX = '.pickle'
+
+
+class ResultCache(object):
+    """
+        Bill results of Tariff.apply, held in memory and optionally on disk. Cached results are copied when returned
+        so that they may be modified freely.
+
+        :param cache_size: the number of results to keep in memory
+        :param directory: an optional directory to also keep results in, created if missing
+        :param max_disk_size: the total size in bytes of the results kept in the directory, the least recently used
+            results being removed beyond it
+    """
+
+    def __init__(self, cache_size=128, directory=None, max_disk_size=2 ** 30):
+        self.cache_size = cache_size
+        self.directory = directory
+        self.max_disk_size = max_disk_size
+        self.hits = 0
+        self.misses = 0
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+        if directory is not None and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def __len__(self):
+        return len(self._results)
+
+    @staticmethod
+    def key(tariff, meter_data, start=None, end=None, output_format='total', engine='vectorized'):
+        """The content hash of a bill calculation, see Tariff.apply for the arguments"""
+        arguments = repr((CACHE_VERSION, tariff.digest(), MeterData.coerce(meter_data).digest(), str(start), str(end),
+                          output_format, engine))
+        return hashlib.sha256(arguments.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + SUFFIX)
+
+    def get(self, key):
+        """The result cached for a key, or None"""
+        with self._lock:
+            result = self._results.get(key)
+            if result is not None:
+                self._results.move_to_end(key)
+        if result is not None:
+            count('result_cached', source='memory')
+            return copy.deepcopy(result)
+        if self.directory is None:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                result = pickle.load(f)
+            # Modification times order the results on disk by use
+            os.utime(path)
+        except (IOError, OSError):
+            return None
+        except Exception:
+            # A truncated or unreadable result is discarded
+            self._remove(path)
+            return None
+        count('result_cached', source='disk')
+        self._remember(key, result)
+        return copy.deepcopy(result)
+
+    def put(self, key, result):
+        """Caches the result of a key"""
+        self._remember(key, copy.deepcopy(result))
+        if self.directory is None:
+            return
+        path = self._path(key)
+        # Written under a unique name and renamed so that readers never see a partial result
+        temporary = '%s.%s.tmp' % (path, uuid.uuid4().hex)
+        with open(temporary, 'wb') as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, path)
+        self._evict()
+
+    def _remember(self, key, result):
+        with self._lock:
+            self._results[key] = result
+            self._results.move_to_end(key)
+            while len(self._results) > self.cache_size:
+                self._results.popitem(last=False)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _evict(self):
+        """Removes the least recently used results on disk beyond the size limit"""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(SUFFIX):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        size = sum(entry_size for _, entry_size, _ in entries)
+        for _, entry_size, path in sorted(entries):
+            if size <= self.max_disk_size:
+                break
+            self._remove(path)
+            size -= entry_size
+
+    def disk_size(self):
+        """The total size in bytes of the results kept on disk"""
+        if self.directory is None:
+            return 0
+        return sum(entry.stat().st_size for entry in os.scandir(self.directory) if entry.name.endswith(SUFFIX))
+
+    def clear(self):
+        """Discards every cached result, in memory and on disk"""
+        with self._lock:
+            self._results.clear()
+        if self.directory is not None:
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(SUFFIX):
+                    self._remove(entry.path)
+
+    def apply(self, tariff, meter_data, start=None, end=None, output_format='total', engine='vectorized'):
+        """Tariff.apply, returning the cached result of the same tariff, meter data and arguments if any"""
+        key = self.key(tariff, meter_data, start, end, output_format, engine)
+        result = self.get(key)
+        if result is not None:
+            self.hits += 1
+            return result
+        self.misses += 1
+        result = tariff.apply(meter_data, start, end, output_format, engine)
+        self.put(key, result)
+        return result
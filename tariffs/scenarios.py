@@ -0,0 +1,142 @@
+"""
+Scenario calculations billing modified versions of a single load, e.g. for solar, battery or efficiency savings.
+
+Every scenario is billed in one vectorized pass as a meter of fleet meter data, sharing the compiled billing plan and
+calendar features. Billing periods are independent unless the tariff has ratchets or rolling demand windows, so only
+the billing periods in which a scenario differs from the base load are billed and the savings of each scenario are
+the difference between its bill and the base bill over those billing periods.
+"""
+import numbers
+from collections import OrderedDict
+
+import numpy
+import pandas
+
+from tariffs.fleet import fleet_frame
+from tariffs.instrumentation import count
+from tariffs.meter import MeterData
+from tariffs.plan import billing_cycles
+
+
+SCENARIO_OUTPUT_FORMAT_CHOICES = (
+    ('total', 'total'),
+    ('total-components', 'total-components'),
+)
+
+
+def offset_scenarios(meter_data, profile, sizes, imported='electricity_imported', exported='electricity_exported'):
+    """
+        Builds scenarios offsetting the load of meter data by a generation or storage profile at each of a number of
+        sizes, e.g. the output of 1 kW of solar PV at sizes of 1 to 20 kW. Energy supplied by the profile offsets the
+        imported energy of each interval and any surplus is exported, while energy drawn by the profile (e.g. a
+        charging battery) absorbs the exported energy and any shortfall is imported.
+
+        :param meter_data: a three-column pandas array with datetime, imported energy (kwh), exported energy (kwh)
+        :param profile: a Series of the energy (kwh) supplied by one unit of the profile in each interval, negative
+            where it draws energy, missing intervals supplying none
+        :param sizes: the sizes of each scenario, which also label the scenarios
+        :return: an ordered dictionary of the changes to the imported and exported energy of each scenario
+    """
+    frame = meter_data.frame if isinstance(meter_data, MeterData) else meter_data
+    sizes = list(sizes)
+    supplied = profile.reindex(frame.index).fillna(0.0).to_numpy(dtype=float)[:, numpy.newaxis] * numpy.array(sizes)
+    base_imported = frame[imported].to_numpy(dtype=float)[:, numpy.newaxis]
+    base_exported = (frame[exported].to_numpy(dtype=float)[:, numpy.newaxis] if exported in frame
+                     else numpy.zeros((len(frame), 1)))
+    changes_imported = numpy.where(supplied >= 0, -numpy.minimum(supplied, base_imported),
+                                   numpy.maximum(-supplied - base_exported, 0.0))
+    changes_exported = numpy.where(supplied >= 0, numpy.maximum(supplied - base_imported, 0.0),
+                                   -numpy.minimum(-supplied, base_exported))
+    return OrderedDict((size, pandas.DataFrame({imported: changes_imported[:, position],
+                                                exported: changes_exported[:, position]}, index=frame.index))
+                       for position, size in enumerate(sizes))
+
+
+def scenario_values(frame, scenarios):
+    """
+        Applies scenarios to meter data.
+
+        :param frame: a meter data DataFrame
+        :param scenarios: the modification of each scenario, see apply_scenarios
+        :return: an array of shape (timestamps, scenarios + 1, registers), the base meter data being first, and a
+            boolean array marking the intervals in which any scenario differs from the base meter data
+    """
+    registers = list(frame.columns)
+    base = frame.to_numpy(dtype=float)
+    # Filled a scenario at a time, each scenario being contiguous
+    values = numpy.empty((len(scenarios) + 1, len(frame), len(registers)))
+    values[0] = base
+    changed = numpy.zeros(len(frame), dtype=bool)
+    for position, modification in enumerate(scenarios, 1):
+        if isinstance(modification, numbers.Number):
+            numpy.multiply(base, modification, out=values[position])
+            if modification != 1:
+                changed |= (base != 0).any(axis=1)
+            continue
+        if modification.index.equals(frame.index) and list(modification.columns) == registers:
+            changes = modification.to_numpy(dtype=float)
+            changes = numpy.where(numpy.isnan(changes), 0.0, changes)
+        else:
+            changes = modification.reindex(index=frame.index, columns=registers).fillna(0.0).to_numpy(dtype=float)
+        numpy.add(base, changes, out=values[position])
+        changed |= (changes != 0).any(axis=1)
+    return values.transpose(1, 0, 2), changed
+
+
+def apply_scenarios(tariff, meter_data, scenarios, start=None, end=None, output_format='total'):
+    """
+        Calculates the cost of energy and the savings against the base bill of each of a number of modifications of a
+        single load.
+
+        :param tariff: a Tariff resource
+        :param meter_data: a three-column pandas array with datetime, imported energy (kwh), exported energy (kwh),
+            or a MeterData instance
+        :param scenarios: a dictionary of the modification of each scenario, either a factor scaling every register
+            of the meter data (e.g. 0.9 for a 10% efficiency saving) or a DataFrame of changes added to the registers
+            of the meter data (see offset_scenarios), missing intervals and registers being unchanged
+        :param start: an optional datetime to select the commencement of the bill calculation
+        :param end: an optional datetime to select the termination of the bill calculation
+        :param output_format: 'total' for the total of each scenario or 'total-components' for each charge component
+            of each scenario along with its total
+        :return: a DataFrame with one row per scenario, indexed by scenario, of its total and its savings against the
+            bill of the unmodified meter data
+    """
+    if output_format not in dict(SCENARIO_OUTPUT_FORMAT_CHOICES):
+        raise UserWarning('Unsupported output format: %s' % output_format)
+
+    meter_data = MeterData.coerce(meter_data).truncate(before=start, after=end)
+    frame = meter_data.frame
+    if isinstance(frame.columns, pandas.MultiIndex):
+        raise UserWarning('Scenarios require the meter data of a single meter')
+    scenarios = OrderedDict(scenarios)
+    labels = pandas.Index(list(scenarios), name='scenario')
+
+    base = dict((name, float(numpy.sum(costs)))
+                for name, costs in tariff.apply_charges(meter_data, 'total-components').items())
+    changes = numpy.zeros((len(scenarios), len(base)))
+
+    values, rows = scenario_values(frame, scenarios.values())
+    plan = tariff.compile()
+    if plan.demand_window_type == 'rolling' or any(charge.ratchet is not None for charge in plan.charges):
+        # The demand of a billing period depends on the meter data of other billing periods
+        rows[:] = True
+    elif rows.any() and not rows.all():
+        # Bill whole billing periods, block charges accumulating over them
+        cycles = billing_cycles(meter_data.features(), plan.billing_period)
+        rows = numpy.isin(cycles, numpy.unique(cycles[rows]))
+    count('scenario_intervals', scenarios=len(scenarios), intervals=len(frame), billed=int(rows.sum()))
+
+    if rows.any():
+        billed = fleet_frame(values[rows], frame.index[rows], range(len(scenarios) + 1), list(frame.columns))
+        charge_array = tariff.apply_charges(MeterData(billed), 'total-components')
+        for component, name in enumerate(base):
+            if name in charge_array:
+                costs = numpy.sum(charge_array[name], axis=0)
+                changes[:, component] = costs[1:] - costs[0]
+
+    output = pandas.DataFrame(numpy.array(list(base.values())) + changes, index=labels, columns=list(base))
+    output['total'] = output.sum(1)
+    output['savings'] = sum(base.values()) - output['total']
+    if output_format == 'total':
+        return output[['total', 'savings']]
+    return output
@@ -0,0 +1,97 @@
+"""
+Array-backed rate schedules for scheduled / real-time pricing.
+
+A RateSchedule holds the schedule as sorted datetime64 and float arrays so that the rate applying to every interval
+of a meter data index is resolved with a single binary search, and can be loaded from a pandas Series or an
+Arrow/Parquet file without decoding a ScheduleItem resource per item.
+
+A RateSchedule is an odin ResourceIterable, so it may be assigned to the rate_schedule field of a charge. Its
+ScheduleItem resources are only built when iterated, as when the charge is validated or encoded.
+"""
+import numpy
+import pandas
+from odin.bases import ResourceIterable
+
+
+def _read_only(array):
+    array.flags.writeable = False
+    return array
+
+
+class RateSchedule(ResourceIterable):
+    """A scheduled or real-time pricing rate structure, each rate applies to the intervals preceding its datetime"""
+    __slots__ = ('datetimes', 'rates')
+
+    def __init__(self, datetimes, rates):
+        datetimes = numpy.asarray(datetimes, dtype='datetime64[ns]')
+        rates = numpy.asarray(rates, dtype=float)
+        if datetimes.shape != rates.shape:
+            raise ValueError('A rate schedule requires one rate per datetime')
+        order = numpy.argsort(datetimes, kind='mergesort')
+        self.datetimes = _read_only(datetimes[order])
+        # A trailing NaN is assigned to intervals after the last datetime of the schedule
+        self.rates = _read_only(numpy.append(rates[order], numpy.nan))
+
+    @classmethod
+    def from_items(cls, schedule_items):
+        """Creates a rate schedule from a list of ScheduleItem resources"""
+        return cls([schedule_item.datetime for schedule_item in schedule_items],
+                   [schedule_item.rate for schedule_item in schedule_items])
+
+    @classmethod
+    def from_series(cls, series):
+        """Creates a rate schedule from a pandas Series of rates indexed by datetime"""
+        index = pandas.DatetimeIndex(series.index)
+        if index.tz is not None:
+            index = index.tz_localize(None)
+        return cls(index.values, series.to_numpy(dtype=float))
+
+    @classmethod
+    def from_arrow(cls, table, datetime_column='datetime', rate_column='rate'):
+        """Creates a rate schedule from the datetime and rate columns of a pyarrow Table"""
+        datetimes = pandas.DatetimeIndex(table.column(datetime_column).to_numpy())
+        if datetimes.tz is not None:
+            datetimes = datetimes.tz_localize(None)
+        return cls(datetimes.values, table.column(rate_column).to_numpy())
+
+    @classmethod
+    def from_parquet(cls, path, datetime_column='datetime', rate_column='rate'):
+        """Creates a rate schedule from the datetime and rate columns of a Parquet file"""
+        try:
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError('pyarrow is required to load rate schedules from Parquet files')
+        table = pyarrow.parquet.read_table(path, columns=[datetime_column, rate_column])
+        return cls.from_arrow(table, datetime_column, rate_column)
+
+    @classmethod
+    def coerce(cls, source):
+        """
+            Creates a rate schedule from any supported source: a RateSchedule, a list of ScheduleItem resources, a
+            pandas Series of rates indexed by datetime, a pyarrow Table or the path of a Parquet file.
+        """
+        if isinstance(source, cls):
+            return source
+        if isinstance(source, pandas.Series):
+            return cls.from_series(source)
+        if isinstance(source, str):
+            return cls.from_parquet(source)
+        if hasattr(source, 'column_names'):
+            return cls.from_arrow(source)
+        return cls.from_items(source)
+
+    def __len__(self):
+        return len(self.datetimes)
+
+    def __iter__(self):
+        from tariffs.tariff import ScheduleItem
+        for dt, rate in zip(pandas.DatetimeIndex(self.datetimes).to_pydatetime(), self.rates[:-1].tolist()):
+            yield ScheduleItem(datetime=dt, rate=rate)
+
+    def rates_at(self, index):
+        """
+            Looks up the rate applying to each timestamp of a DatetimeIndex, that of the first schedule datetime
+            falling after the timestamp. Timestamps after the last schedule datetime are assigned a NaN rate.
+        """
+        values = index.values if index.tz is None else index.tz_localize(None).values
+        return self.rates[numpy.searchsorted(self.datetimes, values, side='right')]
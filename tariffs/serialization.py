@@ -0,0 +1,360 @@
+"""
+Binary tariff bundles.
+
+A tariff bundle stores tariffs along with their compiled billing plans in a single versioned file so that a worker
+can become ready to bill against thousands of tariffs without decoding and validating each resource through odin:
+
+    dump_tariffs(tariffs, 'tariffs.bundle')
+    tariffs = TariffBundle('tariffs.bundle')  # or load_tariffs('tariffs.bundle') for a list
+
+The file starts with a magic number and a JSON header followed by a record per tariff, whose fields are encoded
+positionally as compact JSON, and the arrays of the billing plans (time-of-use and season tables, shared between
+plans where identical, and rate schedules). The file is memory-mapped or taken from a single bulk read and each
+tariff is decoded when first accessed. Resources are built without validation when the checksum of the bundle
+matches, otherwise they are decoded and validated through odin and their plans recompiled.
+"""
+import datetime
+import hashlib
+import json
+import struct
+
+import numpy
+import odin
+from odin.codecs import dict_codec
+from odin.fields.composite import DictAs, ListOf, ObjectAs
+from odin.utils import getmeta
+
+from tariffs.plan import DAYS_PER_YEAR, MINUTES_PER_WEEK, BillingPlan, ChargePlan
+from tariffs.schedule import RateSchedule
+from tariffs.tariff import Charge, Ratchet, RateBand, ScheduleItem, Season, Seasons, Tariff, Time, Times, Period
+
+
+MAGIC = b'TARIFFS\x00'
+
+BUNDLE_VERSION = 2
+
+ALIGNMENT = 64
+
+RESOURCES = (Tariff, Charge, RateBand, Period, Time, ScheduleItem, Season, Times, Seasons, Ratchet)
+
+_HEADER = struct.Struct('<8sQ')
+
+
+def _kind(field):
+    if isinstance(field, ListOf):
+        return 'list'
+    if isinstance(field, (DictAs, ObjectAs)):
+        return 'object'
+    if isinstance(field, (odin.DateTimeField, odin.NaiveDateTimeField)):
+        return 'datetime'
+    if isinstance(field, odin.DateField):
+        return 'date'
+    if isinstance(field, (odin.TimeField, odin.NaiveTimeField)):
+        return 'time'
+    return None
+
+
+# The attribute name, kind and nested resource of each field of each resource
+_FIELDS = dict((resource, tuple((field.attname, _kind(field), getattr(field, 'of', None))
+                                for field in getmeta(resource).fields)) for resource in RESOURCES)
+
+_FROM_ISOFORMAT = {
+    'datetime': datetime.datetime.fromisoformat,
+    'date': datetime.date.fromisoformat,
+    'time': datetime.time.fromisoformat,
+}
+
+
+def schema():
+    """The field names of each resource, a bundle can only be loaded by the schema it was written with"""
+    return dict((resource.__name__, [attname for attname, _, _ in _FIELDS[resource]]) for resource in RESOURCES)
+
+
+class _Arrays(object):
+    """Collects the arrays of a bundle, sharing identical tables"""
+
+    def __init__(self):
+        self.tables = {'time': [], 'season': []}
+        self._table_positions = {'time': dict(), 'season': dict()}
+        self.schedules = []
+        self._schedule_positions = dict()
+
+    def table(self, kind, table):
+        if table is None:
+            return None
+        key = table.tobytes()
+        positions = self._table_positions[kind]
+        if key not in positions:
+            positions[key] = len(self.tables[kind])
+            self.tables[kind].append(table)
+        return positions[key]
+
+    def schedule(self, schedule):
+        if id(schedule) not in self._schedule_positions:
+            self._schedule_positions[id(schedule)] = len(self.schedules)
+            self.schedules.append(schedule)
+        return self._schedule_positions[id(schedule)]
+
+    def build(self):
+        lengths = numpy.array([len(schedule) for schedule in self.schedules], dtype=numpy.int64)
+        return {
+            'time_tables': numpy.array(self.tables['time'], dtype=bool).reshape(-1, MINUTES_PER_WEEK),
+            'season_tables': numpy.array(self.tables['season'], dtype=bool).reshape(-1, DAYS_PER_YEAR),
+            'schedule_offsets': numpy.concatenate(([0], numpy.cumsum(lengths))),
+            'schedule_datetimes': numpy.concatenate(
+                [schedule.datetimes for schedule in self.schedules] or [numpy.array([], dtype='datetime64[ns]')]
+            ).astype(numpy.int64),
+            # Rates include the trailing NaN of each schedule
+            'schedule_rates': numpy.concatenate(
+                [schedule.rates for schedule in self.schedules] or [numpy.array([], dtype=float)]),
+        }
+
+
+def _encode(resource, arrays):
+    values = []
+    for attname, kind, _ in _FIELDS[type(resource)]:
+        value = getattr(resource, attname)
+        if value is None:
+            pass
+        elif attname == 'rate_schedule' and value:
+            value = {'schedule': arrays.schedule(resource.get_rate_schedule())}
+        elif kind == 'list':
+            value = [_encode(item, arrays) for item in value]
+        elif kind == 'object':
+            value = _encode(value, arrays)
+        elif kind is not None:
+            value = value.isoformat()
+        values.append(value)
+    return values
+
+
+def _encode_plan(plan, arrays):
+    charges = []
+    for charge in plan.charges:
+        charges.append([
+            charge.component, charge.name, charge.type, charge.meter, charge.rate,
+            charge.band_limits.tolist() if charge.band_limits is not None else None,
+            charge.band_rates.tolist() if charge.band_rates is not None else None,
+            arrays.schedule(charge.schedule) if charge.schedule is not None else None,
+            arrays.table('time', charge.time_table),
+            arrays.table('season', charge.season_table),
+            list(charge.ratchet) if charge.ratchet is not None else None,
+        ])
+    return [plan.service, plan.billing_period, plan.demand_window, plan.demand_window_type, sorted(plan.charge_types),
+            list(plan.components), charges]
+
+
+def _align(offset):
+    return -offset % ALIGNMENT
+
+
+def dump_tariffs(tariffs, path, plans=True):
+    """
+        Writes tariffs to a bundle file.
+
+        :param tariffs: a list of Tariff resources or a Spec
+        :param path: the path of the bundle
+        :param plans: whether to compile the tariffs and store their billing plans
+    """
+    if isinstance(tariffs, odin.Resource):
+        tariffs = tariffs.tariffs
+    arrays = _Arrays()
+    # Each tariff is a separate record so that it can be decoded on its own
+    records = [json.dumps([_encode(tariff, arrays), _encode_plan(tariff.compile(), arrays) if plans else None],
+                          separators=(',', ':')).encode('utf-8') for tariff in tariffs]
+    sections = arrays.build()
+    sections['records'] = numpy.concatenate(([0], numpy.cumsum([len(record) for record in records],
+                                                               dtype=numpy.int64)))
+
+    body = bytearray(b''.join(records))
+    layout = {'payload': {'offset': 0, 'length': len(body)}}
+    for name, array in sections.items():
+        body.extend(b'\x00' * _align(len(body)))
+        layout[name] = {'offset': len(body), 'dtype': array.dtype.str, 'shape': list(array.shape)}
+        body.extend(numpy.ascontiguousarray(array).tobytes())
+
+    header = json.dumps({
+        'version': BUNDLE_VERSION,
+        'schema': schema(),
+        'sections': layout,
+        'checksum': hashlib.sha256(body).hexdigest(),
+    }).encode('utf-8')
+    start = _HEADER.size + len(header)
+    start += _align(start)
+    with open(path, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, start))
+        f.write(header)
+        f.write(b'\x00' * (start - _HEADER.size - len(header)))
+        f.write(body)
+
+
+def _decode(resource_type, values, schedules):
+    resource = resource_type.__new__(resource_type)
+    state = resource.__dict__
+    for (attname, kind, of), value in zip(_FIELDS[resource_type], values):
+        if value is None:
+            pass
+        elif kind == 'list':
+            value = schedules[value['schedule']] if isinstance(value, dict) else [
+                _decode(of, item, schedules) for item in value]
+        elif kind == 'object':
+            value = _decode(of, value, schedules)
+        elif kind is not None:
+            value = _FROM_ISOFORMAT[kind](value)
+        state[attname] = value
+    return resource
+
+
+def _validate(resource_type, values, schedules):
+    # Decodes through odin, validating every field
+    data = dict()
+    for (attname, kind, of), value in zip(_FIELDS[resource_type], values):
+        if isinstance(value, dict) and 'schedule' in value:
+            value = [[str(item.datetime.isoformat()), item.rate] for item in schedules[value['schedule']]]
+        if value is not None and kind == 'list':
+            value = [_validate(of, item, schedules) for item in value]
+        elif value is not None and kind == 'object':
+            value = _validate(of, value, schedules)
+        data[attname] = value
+    if resource_type is not Tariff:
+        return data
+    return dict_codec.load(data, Tariff)
+
+
+def _decode_plan(values, tables, schedules):
+    service, billing_period, demand_window, demand_window_type, charge_types, components, charge_values = values
+    charges = []
+    for (component, name, charge_type, meter, rate, band_limits, band_rates, schedule, time_table,
+         season_table, ratchet) in charge_values:
+        charge = ChargePlan.__new__(ChargePlan)
+        charge.__setstate__({
+            'component': component,
+            'name': name,
+            'type': charge_type,
+            'meter': meter,
+            'rate': rate,
+            'band_limits': numpy.array(band_limits, dtype=float) if band_limits is not None else None,
+            'band_rates': numpy.array(band_rates, dtype=float) if band_rates is not None else None,
+            'schedule': schedules[schedule] if schedule is not None else None,
+            'time_table': tables['time'][time_table] if time_table is not None else None,
+            'season_table': tables['season'][season_table] if season_table is not None else None,
+            'ratchet': tuple(ratchet) if ratchet is not None else None,
+        })
+        charges.append(charge)
+    plan = BillingPlan.__new__(BillingPlan)
+    plan.__setstate__({
+        'service': service,
+        'billing_period': billing_period,
+        'demand_window': demand_window,
+        'demand_window_type': demand_window_type,
+        'charge_types': frozenset(charge_types),
+        'components': tuple(components),
+        'charges': tuple(charges),
+        # The signature of the tariff is taken when the plan is first used, see Tariff.compile
+        'signature': None,
+    })
+    return plan
+
+
+def read_bundle(path, mmap=True):
+    """
+        Reads the header and sections of a bundle file.
+
+        :param mmap: whether to memory-map the file rather than read it in one go
+        :return: the header, the body of the bundle as a byte array, its arrays by name and whether its checksum
+            matches
+    """
+    with open(path, 'rb') as f:
+        data = f.read(_HEADER.size)
+        if len(data) < _HEADER.size or not data.startswith(MAGIC):
+            raise UserWarning('%s is not a tariff bundle' % path)
+        _, start = _HEADER.unpack(data)
+        header = json.loads(f.read(start - _HEADER.size).rstrip(b'\x00'))
+        if header.get('version') != BUNDLE_VERSION:
+            raise UserWarning('Unsupported tariff bundle version: %s' % header.get('version'))
+        if mmap:
+            body = numpy.memmap(f, dtype=numpy.uint8, mode='r', offset=start)
+        else:
+            body = numpy.frombuffer(f.read(), dtype=numpy.uint8)
+
+    arrays = dict()
+    for name, section in header['sections'].items():
+        if name == 'payload':
+            continue
+        dtype = numpy.dtype(section['dtype'])
+        count = int(numpy.prod(section['shape']))
+        arrays[name] = body[section['offset']:section['offset'] + count * dtype.itemsize].view(dtype).reshape(
+            section['shape'])
+    matches = hashlib.sha256(body).hexdigest() == header['checksum']
+    return header, body, arrays, matches
+
+
+class TariffBundle(object):
+    """
+        The tariffs of a bundle file, each decoded along with its billing plan when first accessed.
+
+        :param path: the path of the bundle
+        :param mmap: whether to memory-map the bundle rather than read it in one go
+        :param validate: whether to decode and validate the tariffs through odin. Tariffs are otherwise only
+            validated, and their plans recompiled, if the checksum of the bundle doesn't match
+    """
+
+    def __init__(self, path, mmap=True, validate=False):
+        header, body, arrays, matches = read_bundle(path, mmap)
+        if header['schema'] != schema():
+            raise UserWarning('The tariff bundle %s was written with different tariff fields, re-create it' % path)
+        self.validate = validate or not matches
+        self._body = body
+        self._arrays = arrays
+        self._tables = {'time': arrays['time_tables'], 'season': arrays['season_tables']}
+        self._schedules = _Schedules(arrays)
+        self._tariffs = [None] * (len(arrays['records']) - 1)
+
+    def __len__(self):
+        return len(self._tariffs)
+
+    def __getitem__(self, position):
+        tariff = self._tariffs[position]
+        if tariff is None:
+            offsets = self._arrays['records']
+            values, plan = json.loads(self._body[offsets[position]:offsets[position + 1]].tobytes())
+            if self.validate:
+                tariff = _validate(Tariff, values, self._schedules)
+            else:
+                tariff = _decode(Tariff, values, self._schedules)
+                if plan is not None:
+                    tariff._plan = _decode_plan(plan, self._tables, self._schedules)
+            self._tariffs[position] = tariff
+        return tariff
+
+    def __iter__(self):
+        for position in range(len(self)):
+            yield self[position]
+
+
+class _Schedules(object):
+    """The rate schedules of a bundle, each built when first used"""
+
+    def __init__(self, arrays):
+        self._arrays = arrays
+        self._schedules = dict()
+
+    def __getitem__(self, position):
+        schedule = self._schedules.get(position)
+        if schedule is None:
+            start, stop = self._arrays['schedule_offsets'][position:position + 2]
+            schedule = RateSchedule.__new__(RateSchedule)
+            schedule.datetimes = self._arrays['schedule_datetimes'][start:stop].view('datetime64[ns]')
+            schedule.rates = self._arrays['schedule_rates'][start + position:stop + position + 1]
+            self._schedules[position] = schedule
+        return schedule
+
+
+def load_tariffs(path, mmap=True, validate=False):
+    """
+        Loads every tariff of a bundle file, with their compiled billing plans if the bundle holds them. See
+        TariffBundle to decode tariffs as they are used.
+
+        :return: a list of Tariff resources
+    """
+    return list(TariffBundle(path, mmap, validate))
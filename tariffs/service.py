@@ -0,0 +1,340 @@
+"""
+An asyncio bill calculation service.
+
+Requests are JSON objects of a tariff, either inline or the code of one of the service's tariffs, and meter data,
+billed on a pool of worker threads or processes so the event loop only accepts requests and returns responses. Inline
+tariffs are kept decoded and compiled in a bounded cache keyed by a hash of their content, by each worker process for
+a process pool. Requests wait for a worker in a bounded queue and are rejected once it is full, and identical
+requests arriving while one is pending share its response.
+
+The service is served over a minimal HTTP/1.1 layer, POST /bill billing a request and GET /metrics reporting the
+request counts, cache hits, queue depth and the 50th and 99th percentile latencies in seconds::
+
+    {
+        "tariff": {...} or "tariff_code": "...",
+        "meter_data": {"datetime": ["2018-01-01T00:00:00", ...], "electricity_imported": [...], ...},
+        "start": "2018-01-01T00:00:00", "end": ..., "output_format": "total" or "total-components"
+    }
+"""
+import asyncio
+import collections
+import concurrent.futures
+import functools
+import hashlib
+import json
+import multiprocessing
+import threading
+import time
+
+import numpy
+import pandas
+from odin.codecs import dict_codec
+from odin.exceptions import CodecError, ValidationError
+
+from tariffs.tariff import Tariff
+
+
+SERVICE_EXECUTOR_CHOICES = (
+    ('thread', 'thread'),
+    ('process', 'process'),
+)
+
+SERVICE_OUTPUT_FORMAT_CHOICES = (
+    ('total', 'total'),
+    ('total-components', 'total-components'),
+)
+
+HTTP_REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    413: 'Payload Too Large',
+    500: 'Internal Server Error',
+    503: 'Service Unavailable',
+}
+
+
+class TariffCache(object):
+    """
+        Decoded and compiled tariffs, those of a catalogue by code and other tariffs by a hash of their content. The
+        most recently used tariffs outside the catalogue are kept, and the cache may be shared between threads.
+
+        :param tariffs: an iterable of Tariff resources to look up by code
+        :param cache_size: the number of other tariffs to keep
+    """
+
+    def __init__(self, tariffs=(), cache_size=128):
+        self.catalogue = dict()
+        for tariff in tariffs:
+            tariff.compile()
+            self.catalogue[tariff.code] = tariff
+        self.cache_size = cache_size
+        self._tariffs = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(data):
+        """The content hash of the raw JSON data of a tariff"""
+        return hashlib.sha256(json.dumps(data, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+
+    def get(self, data):
+        """
+            Looks up a tariff by its raw JSON data, decoding and compiling it if not already cached.
+
+            :return: the Tariff and whether it was cached
+        """
+        key = self.key(data)
+        with self._lock:
+            tariff = self._tariffs.get(key)
+            if tariff is not None:
+                self._tariffs.move_to_end(key)
+                return tariff, True
+        tariff = dict_codec.load(data, Tariff)
+        tariff.compile()
+        with self._lock:
+            self._tariffs[key] = tariff
+            if len(self._tariffs) > self.cache_size:
+                self._tariffs.popitem(last=False)
+        return tariff, False
+
+    def __len__(self):
+        return len(self._tariffs)
+
+
+def request_meter_data(data):
+    """Builds meter data from the columns of a request, a list of ISO 8601 datetimes and a list per register"""
+    data = dict(data)
+    index = pandas.DatetimeIndex(pandas.to_datetime(data.pop('datetime')), name='datetime')
+    return pandas.DataFrame(dict((register, numpy.asarray(values, dtype=float)) for register, values in data.items()),
+                            index=index)
+
+
+def bill_request(cache, body):
+    """
+        Bills the JSON body of a request.
+
+        :param cache: the TariffCache of the tariffs of requests
+        :return: the HTTP status and response of the request, and whether its tariff was cached
+    """
+    try:
+        request = json.loads(body)
+        if 'tariff_code' in request:
+            tariff = cache.catalogue.get(request['tariff_code'])
+            if tariff is None:
+                return 404, {'error': 'Unknown tariff: %s' % request['tariff_code']}, False
+            cached = True
+        else:
+            tariff, cached = cache.get(request['tariff'])
+        output_format = request.get('output_format', 'total')
+        if output_format not in dict(SERVICE_OUTPUT_FORMAT_CHOICES):
+            raise UserWarning('Unsupported output format: %s' % output_format)
+        start, end = (pandas.Timestamp(request[field]) if request.get(field) else None for field in ('start', 'end'))
+        components = tariff.apply(request_meter_data(request['meter_data']), start, end, 'total-components')
+    except (CodecError, KeyError, TypeError, UserWarning, ValidationError, ValueError) as e:
+        return 400, {'error': '%s: %s' % (type(e).__name__, e)}, False
+
+    response = {'total': sum(components.values())}
+    if output_format == 'total-components':
+        response['components'] = components
+    return 200, response, cached
+
+
+# The tariff cache of each worker process, set once by _initialize_worker
+_worker_state = {}
+
+
+def _initialize_worker(tariffs, cache_size):
+    _worker_state['cache'] = TariffCache(tariffs, cache_size)
+
+
+def _bill_request(body):
+    return bill_request(_worker_state['cache'], body)
+
+
+class BillService(object):
+    """
+        Bills requests on a pool of workers for an asyncio server.
+
+        :param tariffs: an iterable of Tariff resources requests may refer to by code
+        :param workers: the number of worker threads or processes
+        :param executor: 'thread' or 'process', threads sharing one tariff cache
+        :param max_pending: the number of requests waiting for a worker beyond which requests are rejected
+        :param cache_size: the number of inline tariffs kept decoded by each tariff cache
+        :param window: the number of the most recent latencies the percentiles are taken over
+        :param max_body_size: the largest request body accepted, in bytes
+    """
+
+    def __init__(self, tariffs=(), workers=4, executor='thread', max_pending=64, cache_size=128, window=10000,
+                 max_body_size=64 * 1024 * 1024):
+        if executor not in dict(SERVICE_EXECUTOR_CHOICES):
+            raise UserWarning('Unsupported executor: %s' % executor)
+        self.tariffs = list(tariffs)
+        self.workers = workers
+        self.executor_type = executor
+        self.max_pending = max_pending
+        self.cache_size = cache_size
+        self.max_body_size = max_body_size
+        self.cache = TariffCache(self.tariffs, cache_size)
+        self.executor = None
+        self.server = None
+        self._bill = None
+        self.counts = collections.Counter()
+        self._latencies = collections.deque(maxlen=window)
+        self._queue = None
+        self._tasks = []
+        self._pending = dict()
+        self._running = 0
+
+    async def start(self, host='127.0.0.1', port=0):
+        """
+            Starts the workers and the HTTP server.
+
+            :param port: the port to listen on, 0 for any free port
+            :return: the host and port the server listens on
+        """
+        if self.executor_type == 'process':
+            # Worker processes are spawned rather than forked from the threads of the event loop
+            self.executor = concurrent.futures.ProcessPoolExecutor(
+                self.workers, multiprocessing.get_context('spawn'), _initialize_worker, (self.tariffs, self.cache_size))
+            self._bill = _bill_request
+        else:
+            self.executor = concurrent.futures.ThreadPoolExecutor(self.workers, thread_name_prefix='tariffs')
+            self._bill = functools.partial(bill_request, self.cache)
+        self._queue = asyncio.Queue(self.max_pending)
+        self._tasks = [asyncio.ensure_future(self._work()) for _ in range(self.workers)]
+        self.server = await asyncio.start_server(self._handle, host, port)
+        return self.server.sockets[0].getsockname()[:2]
+
+    async def close(self):
+        """Stops the HTTP server and the workers"""
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+        return False
+
+    async def serve_forever(self, host='127.0.0.1', port=8080):
+        await self.start(host, port)
+        try:
+            await self.server.serve_forever()
+        finally:
+            await self.close()
+
+    async def bill(self, body):
+        """
+            Bills the JSON body of a request, sharing the response of an identical pending request.
+
+            :return: the HTTP status and response of the request
+        """
+        started = time.perf_counter()
+        self.counts['requests'] += 1
+        key = hashlib.sha256(body).digest()
+        future = self._pending.get(key)
+        if future is not None:
+            self.counts['coalesced'] += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            try:
+                self._queue.put_nowait((body, future))
+            except asyncio.QueueFull:
+                self.counts['rejected'] += 1
+                return 503, {'error': 'Too many pending requests'}
+            self._pending[key] = future
+            future.add_done_callback(lambda _: self._pending.pop(key, None))
+        # Shielded so that a cancelled request doesn't cancel the response shared with identical requests
+        status, response = await asyncio.shield(future)
+        self._latencies.append(time.perf_counter() - started)
+        return status, response
+
+    async def _work(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            body, future = await self._queue.get()
+            self._running += 1
+            try:
+                status, response, cached = await loop.run_in_executor(self.executor, self._bill, body)
+            except Exception as e:
+                status, response, cached = 500, {'error': '%s: %s' % (type(e).__name__, e)}, False
+            finally:
+                self._running -= 1
+            if status == 200:
+                self.counts['cache_hits' if cached else 'cache_misses'] += 1
+            self.counts['billed'] += 1
+            self.counts['errors'] += status != 200
+            if not future.done():
+                future.set_result((status, response))
+
+    def metrics(self):
+        """The request counts, cache hits and misses, queue depth and the percentile latencies of the service"""
+        latencies = numpy.array(self._latencies)
+        metrics = dict((name, self.counts[name]) for name in ('requests', 'billed', 'coalesced', 'rejected', 'errors',
+                                                              'cache_hits', 'cache_misses'))
+        metrics.update(
+            queue_depth=self._queue.qsize() if self._queue is not None else 0,
+            running=self._running,
+            latency_p50=float(numpy.percentile(latencies, 50)) if len(latencies) else None,
+            latency_p99=float(numpy.percentile(latencies, 99)) if len(latencies) else None,
+        )
+        return metrics
+
+    async def _route(self, method, path, body):
+        if path == '/bill':
+            if method != 'POST':
+                return 405, {'error': 'Method not allowed'}
+            return await self.bill(body)
+        if path == '/metrics':
+            if method != 'GET':
+                return 405, {'error': 'Method not allowed'}
+            return 200, self.metrics()
+        return 404, {'error': 'Not found: %s' % path}
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, version = request_line.decode('latin-1').split()
+                headers = dict()
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get('content-length', 0))
+                if length > self.max_body_size:
+                    status, response = 413, {'error': 'Request body exceeds %d bytes' % self.max_body_size}
+                    keep_alive = False
+                else:
+                    body = await reader.readexactly(length)
+                    status, response = await self._route(method, path.split('?')[0], body)
+                    keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+
+                content = json.dumps(response).encode()
+                head = ['HTTP/1.1 %d %s' % (status, HTTP_REASONS[status]), 'Content-Type: application/json',
+                        'Content-Length: %d' % len(content), 'Connection: %s' % ('keep-alive' if keep_alive else 'close')]
+                if status == 503:
+                    head.append('Retry-After: 1')
+                writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + content)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
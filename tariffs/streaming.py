@@ -0,0 +1,251 @@
+"""
+Streaming bill calculation.
+
+A BillAccumulator is fed chunks of interval data in order and keeps running bills, carrying block accumulations,
+billing period rollovers and peak demand between chunks so that each update only costs as much as the new chunk.
+Its state is small and JSON-serializable so that accumulation can resume after a restart.
+"""
+from collections import OrderedDict
+
+import numpy
+import pandas
+
+from tariffs.plan import CalendarFeatures, billing_cycles, by_interval, register_values
+from tariffs.tariff import PERIOD_TO_TIMESTEP
+
+
+STATE_VERSION = 1
+
+
+def bin_labels(index, rule=None):
+    """Labels each timestamp of a DatetimeIndex with that of the bin it falls within when resampled by a rule"""
+    if rule is None:
+        return index
+    positions = pandas.Series(numpy.arange(len(index)), index=index).resample(rule).first().dropna()
+    bins = numpy.searchsorted(positions.to_numpy(), numpy.arange(len(index)), side='right') - 1
+    return positions.index[bins]
+
+
+def _group_starts(labels):
+    labels = numpy.asarray(labels)
+    return numpy.concatenate(([0], numpy.flatnonzero(labels[1:] != labels[:-1]) + 1))
+
+
+def _value_state(value):
+    return value.tolist() if isinstance(value, numpy.ndarray) else float(value)
+
+
+def _frame_state(frame):
+    if frame is None:
+        return None
+    return {
+        'index': [timestamp.isoformat() for timestamp in frame.index],
+        'columns': [list(column) if isinstance(column, tuple) else column for column in frame.columns],
+        'values': frame.to_numpy(dtype=float).tolist(),
+    }
+
+
+def _frame_from_state(state):
+    if state is None:
+        return None
+    columns = state['columns']
+    if columns and isinstance(columns[0], list):
+        columns = pandas.MultiIndex.from_tuples([tuple(column) for column in columns])
+    return pandas.DataFrame(numpy.array(state['values'], dtype=float).reshape(len(state['index']), len(columns)),
+                            index=pandas.DatetimeIndex(state['index']), columns=columns)
+
+
+class BillAccumulator(object):
+    """
+        Running bill of a tariff fed with chunks of meter data in chronological order.
+
+        Meter data chunks have the same layout as for Tariff.apply, or fleet meter data with a column per meter and
+        register in which case every component is an array with a value per meter.
+    """
+
+    def __init__(self, tariff):
+        self.tariff = tariff
+        self.last_timestamp = None
+        # Committed costs of each component by billing period
+        self._periods = OrderedDict()
+        # Billing cycle and accumulation of each block charge, keyed by charge position
+        self._blocks = dict()
+        # Meter data of the open demand window and the peak demand of the open billing period
+        self._pending = None
+        self._peaks = None
+
+    def update(self, meter_data):
+        """Accumulates the next chunk of meter data, which must follow any meter data previously accumulated"""
+        if not len(meter_data):
+            return self
+        index = meter_data.index
+        if not index.is_monotonic_increasing or (self.last_timestamp is not None and index[0] <= self.last_timestamp):
+            raise UserWarning('Meter data must be accumulated in chronological order')
+
+        plan = self.tariff.compile()
+        if 'consumption' in plan.charge_types:
+            self._update_consumption(plan, meter_data)
+        if 'demand' in plan.charge_types:
+            self._update_demand(plan, meter_data)
+        self.last_timestamp = index[-1]
+        return self
+
+    def _commit(self, labels, charge_array):
+        starts = _group_starts(labels)
+        for name, costs in charge_array.items():
+            for label, cost in zip(labels[starts], numpy.add.reduceat(costs, starts, axis=0)):
+                period = self._periods.setdefault(label, dict())
+                period[name] = period.get(name, 0.0) + cost
+
+    def _update_consumption(self, plan, meter_data):
+        steps = self.tariff.resampling_steps('consumption')
+        # Intervals are costed as of the timestamp they would be resampled to
+        features = CalendarFeatures(bin_labels(meter_data.index, steps[-1][0] if steps else None))
+        cycles = billing_cycles(features, plan.billing_period)
+
+        charge_array = dict()
+        for position, charge in enumerate(plan.charges):
+            if charge.type != 'consumption':
+                continue
+            values = register_values(meter_data, charge.meter)
+            initial = None
+            if charge.band_limits is not None:
+                cycle, accumulation = self._blocks.get(position, (None, None))
+                if cycle == cycles[0]:
+                    initial = accumulation
+                usage = numpy.where(by_interval(charge.mask(features), values), values, 0.0)
+                accumulation = usage[cycles == cycles[-1]].sum(axis=0)
+                if initial is not None and cycles[-1] == cycles[0]:
+                    accumulation = accumulation + initial
+                self._blocks[position] = (int(cycles[-1]), accumulation)
+            costs = charge.costs(values, features, cycles, initial)
+            charge_array[charge.name] = charge_array[charge.name] + costs if charge.name in charge_array else costs
+
+        self._commit(bin_labels(meter_data.index, PERIOD_TO_TIMESTEP[plan.billing_period]), charge_array)
+
+    def _peak_demand(self, plan, peaks, windows):
+        # Combines the peak demand of the open billing period with that of further demand windows
+        period_peaks = windows.resample(PERIOD_TO_TIMESTEP[plan.billing_period]).max()
+        if peaks is None or not len(period_peaks):
+            return period_peaks if len(period_peaks) else peaks
+        if period_peaks.index[0] == peaks.index[0]:
+            period_peaks.iloc[0] = numpy.fmax(period_peaks.iloc[0], peaks.iloc[0])
+            return period_peaks
+        return pandas.concat([peaks, period_peaks])
+
+    def _update_demand(self, plan, meter_data):
+        if plan.demand_window_type == 'rolling' or any(
+                charge.ratchet is not None or charge.time_table is not None or charge.season_table is not None
+                for charge in plan.charges if charge.type == 'demand'):
+            raise UserWarning('Rolling demand windows, ratchets and seasonal or time-of-use demand charges are not '
+                              'supported by streaming bill calculation')
+        data = meter_data if self._pending is None else pandas.concat([self._pending, meter_data])
+        windows = data.resample(PERIOD_TO_TIMESTEP[plan.demand_window]).mean()
+        # The last demand window may be completed by the next chunk of meter data
+        self._pending = data[data.index >= windows.index[-1]]
+        peaks = self._peak_demand(plan, self._peaks, windows.iloc[:-1])
+        if peaks is None:
+            return
+        # Every billing period but the last is closed
+        closed, self._peaks = peaks.iloc[:-1], peaks.iloc[-1:]
+        if len(closed):
+            self._commit(closed.index, plan.apply_by_charge_type(closed, 'demand'))
+
+    def _open_charge_array(self):
+        # Demand costs of the open billing period including the open demand window
+        plan = self.tariff.compile()
+        if self._pending is None:
+            return None, dict()
+        windows = self._pending.resample(PERIOD_TO_TIMESTEP[plan.demand_window]).mean()
+        peaks = self._peak_demand(plan, self._peaks, windows)
+        return peaks.index, plan.apply_by_charge_type(peaks, 'demand')
+
+    def billing_periods(self):
+        """The labels of the billing periods accumulated so far"""
+        labels, _ = self._open_charge_array()
+        return sorted(set(self._periods) | set(labels if labels is not None else ()))
+
+    def components(self, period=None):
+        """
+            The costs of each charge component accumulated so far.
+
+            :param period: an optional billing period label, or 'current' for the latest billing period (e.g. a
+                month-to-date bill). By default components are totalled over all billing periods
+            :return: a dictionary containing the charge components (e.g. off_peak, shoulder, peak, total)
+        """
+        if period == 'current':
+            periods = self.billing_periods()
+            period = periods[-1] if periods else None
+            if period is None:
+                return dict()
+
+        components = dict()
+        for label, period_components in self._periods.items():
+            if period is None or label == period:
+                for name, cost in period_components.items():
+                    components[name] = components.get(name, 0.0) + cost
+        labels, charge_array = self._open_charge_array()
+        for name, costs in charge_array.items():
+            for label, cost in zip(labels, costs):
+                if period is None or label == period:
+                    components[name] = components.get(name, 0.0) + cost
+        return components
+
+    def pop_periods(self, final=False):
+        """
+            Removes the costs of the billing periods closed so far, those that no further meter data can change.
+
+            :param final: whether to remove every billing period, including the open billing period, as when no
+                further meter data will be accumulated
+            :return: an ordered dictionary of the charge components of each billing period label
+        """
+        periods = OrderedDict()
+        if self.last_timestamp is None:
+            return periods
+        # The billing period of the latest meter data and of the open demand window and peak demand are open
+        labels, _ = self._open_charge_array()
+        rule = PERIOD_TO_TIMESTEP[self.tariff.compile().billing_period]
+        opened = min(set(labels if labels is not None else ()) |
+                     {bin_labels(pandas.DatetimeIndex([self.last_timestamp]), rule)[0]})
+        for label in self.billing_periods():
+            if final or label < opened:
+                periods[label] = self.components(label)
+        for label in periods:
+            self._periods.pop(label, None)
+        if final:
+            self._pending = self._peaks = None
+        return periods
+
+    def total(self, period=None):
+        """The total cost accumulated so far, optionally for a billing period label or the 'current' period"""
+        return sum(self.components(period).values())
+
+    def state(self):
+        """A JSON-serializable snapshot of the accumulator, see from_state"""
+        return {
+            'version': STATE_VERSION,
+            'last_timestamp': self.last_timestamp.isoformat() if self.last_timestamp is not None else None,
+            'periods': [[label.isoformat(), dict((name, _value_state(cost)) for name, cost in components.items())]
+                        for label, components in self._periods.items()],
+            'blocks': [[position, cycle, _value_state(accumulation)]
+                       for position, (cycle, accumulation) in sorted(self._blocks.items())],
+            'pending': _frame_state(self._pending),
+            'peaks': _frame_state(self._peaks),
+        }
+
+    @classmethod
+    def from_state(cls, tariff, state):
+        """Restores an accumulator of a tariff from a snapshot taken by state"""
+        if state.get('version') != STATE_VERSION:
+            raise UserWarning('Unsupported accumulator state version: %s' % state.get('version'))
+        accumulator = cls(tariff)
+        if state['last_timestamp'] is not None:
+            accumulator.last_timestamp = pandas.Timestamp(state['last_timestamp'])
+        for label, components in state['periods']:
+            accumulator._periods[pandas.Timestamp(label)] = dict(
+                (name, numpy.asarray(cost) if isinstance(cost, list) else cost) for name, cost in components.items())
+        for position, cycle, accumulation in state['blocks']:
+            accumulator._blocks[position] = (cycle, numpy.asarray(accumulation, dtype=float))
+        accumulator._pending = _frame_from_state(state['pending'])
+        accumulator._peaks = _frame_from_state(state['peaks'])
+        return accumulator
@@ -1,7 +1,17 @@
 import odin
 from collections import defaultdict
 import datetime
-import pandas
+import hashlib
+import json
+
+from odin.codecs import dict_codec
+
+from tariffs.bill import BILL_OUTPUT_FORMAT_CHOICES, Bill, bill_components
+from tariffs.demand import DEMAND_COLUMNS, demand_charges, demand_frame
+from tariffs.instrumentation import phase
+from tariffs.meter import MeterData
+from tariffs.plan import BillingPlan, fleet_meters, resource_signature
+from tariffs.schedule import RateSchedule
 
 
 SERVICE_CHOICES = (
@@ -67,6 +77,16 @@ DEMAND_WINDOW_CHOICES = (
     ('hourly', 'hourly')
 )
 
+DEMAND_WINDOW_TYPE_CHOICES = (
+    ('fixed', 'fixed'),
+    ('rolling', 'rolling'),
+)
+
+ENGINE_CHOICES = (
+    ('vectorized', 'vectorized'),
+    ('loop', 'loop'),
+)
+
 PERIOD_TO_TIMESTEP = {
     '15min': '15min',
     '30min': '30min',
@@ -116,6 +136,12 @@ class Season(odin.Resource):
     to_day = odin.IntegerField(min_value=1, max_value=31, null=True, use_default_if_not_provided=True, default=31)
 
 
+class Ratchet(odin.Resource):
+    """A demand ratchet, billing at least a percentage of the highest peak demand of preceding billing periods"""
+    percentage = odin.FloatField(min_value=0)
+    periods = odin.IntegerField(min_value=1, null=True, default=11, use_default_if_not_provided=True)
+
+
 class Charge(odin.Resource):
     """A charge component of a tariff structure"""
     name = odin.StringField(null=True)
@@ -128,6 +154,35 @@ class Charge(odin.Resource):
     type = odin.StringField(choices=CHARGE_TYPE_CHOICES, null=True, default='consumption',
                             use_default_if_not_provided=True)
     meter = odin.StringField(null=True, default='electricity_imported', use_default_if_not_provided=True)
+    ratchet = odin.ObjectAs(Ratchet, null=True)
+
+    def set_rate_schedule(self, source):
+        """
+            Assigns the rate schedule from a list of ScheduleItem resources, a pandas Series of rates indexed by
+            datetime, a pyarrow Table or the path of a Parquet file, held as sorted arrays rather than resources.
+            ScheduleItem resources are only built from the arrays when the charge is validated or encoded.
+        """
+        self.rate_schedule = RateSchedule.coerce(source)
+
+    def clean_rate_schedule(self, value):
+        # A RateSchedule is validated item by item but kept as arrays rather than replaced by its items
+        if isinstance(self.rate_schedule, RateSchedule):
+            return self.rate_schedule
+        return value
+
+    def get_rate_schedule(self):
+        """
+            The rate schedule as a RateSchedule of sorted arrays, or None. The arrays of a list of ScheduleItem
+            resources are cached for the list, and rebuilt once another list is assigned or its length changes.
+        """
+        if not self.rate_schedule:
+            return None
+        if isinstance(self.rate_schedule, RateSchedule):
+            return self.rate_schedule
+        cached = getattr(self, '_rate_schedule', None)
+        if cached is None or cached[0] is not self.rate_schedule or len(cached[1]) != len(self.rate_schedule):
+            cached = self._rate_schedule = (self.rate_schedule, RateSchedule.from_items(self.rate_schedule))
+        return cached[1]
 
 
 class Times(odin.Resource):
@@ -171,6 +226,8 @@ class Tariff(odin.Resource):
     net_metering = odin.BooleanField(null=True)
     billing_period = odin.StringField(choices=PERIOD_CHOICES, null=True, default='monthly', use_default_if_not_provided=True)
     demand_window = odin.StringField(choices=DEMAND_WINDOW_CHOICES, null=True, default='30min', use_default_if_not_provided=True)
+    demand_window_type = odin.StringField(choices=DEMAND_WINDOW_TYPE_CHOICES, null=True, default='fixed',
+                                          use_default_if_not_provided=True)
     consumption_unit = odin.StringField(choices=CONSUMPTION_UNIT_CHOICES, null=True)
     demand_unit = odin.StringField(choices=DEMAND_UNIT_CHOICES, null=True)
 
@@ -198,17 +255,29 @@ class Tariff(odin.Resource):
             charge_array[name].append(charge.rate * float(row[charge.meter]))
         if charge.rate_bands:
             charge_time_step = float()
+            usage = float(row[charge.meter])
             for rate_band_index, rate_band in enumerate(charge.rate_bands):
-                if block_accum_dict[name] > rate_band.limit:
+                if block_accum_dict[name] >= rate_band.limit:
                     continue
-                block_usage = max((min(
-                    (rate_band.limit - block_accum_dict[name], row[charge.meter] - block_accum_dict[name])), 0.0))
+                block_usage = max(min(rate_band.limit - block_accum_dict[name], usage), 0.0)
                 charge_time_step += rate_band.rate * block_usage
                 block_accum_dict[name] += block_usage
+                usage -= block_usage
             charge_array[name].append(charge_time_step)
 
         return charge_array, block_accum_dict
 
+    def billing_cycle(self, dt):
+        """Identifies the billing cycle that a timestamp falls within"""
+        if self.billing_period == 'daily':
+            return dt.year, dt.month, dt.day
+        elif self.billing_period == 'monthly':
+            return dt.year, dt.month
+        elif self.billing_period == 'quarterly':
+            return dt.year, (dt.month - 1) // 3
+        elif self.billing_period == 'annually':
+            return dt.year
+
     def apply_by_charge_type(self, meter_data, charge_type='consumption'):
         """
             Calculates the cost of energy given a tariff and load.
@@ -219,18 +288,19 @@ class Tariff(odin.Resource):
 
         charge_array = defaultdict(list)
         block_accum_dict = defaultdict(float)
+        billing_cycle = None
+        # The items of rate schedules held as arrays are built once rather than for every row
+        schedule_items = dict((id(charge), list(charge.rate_schedule)) for charge in self.charges or ()
+                              if charge.rate_schedule)
 
-        for dt, row in meter_data.iterrows():
+        for position, (dt, row) in enumerate(meter_data.iterrows()):
             time = datetime.time(hour=dt.hour, minute=dt.minute)
 
-            # If the billing cycle changes over, reset block charge accumulations
-            if (charge_type == 'consumption' and
-                self.billing_period == 'monthly' and dt.day == 1 and dt.hour == 0 and dt.minute == 0 or
-                self.billing_period == 'quarterly' and dt.month % 3 and dt.day == 1 and dt.hour == 0 and dt.minute == 0 or
-                self.billing_period == 'annually' and dt.month == 1 and dt.day == 1 and dt.hour == 0 and dt.minute == 0):
-                block_accum_dict = defaultdict(float)
-            if charge_type == 'demand':
+            # If the billing cycle changes over, reset block charge accumulations. Demand charges are assessed
+            # against the peak of each billing period so every row starts afresh
+            if charge_type == 'demand' or self.billing_cycle(dt) != billing_cycle:
                 block_accum_dict = defaultdict(float)
+                billing_cycle = self.billing_cycle(dt)
 
             if self.charges:
                 for charge in self.charges:
@@ -271,73 +341,214 @@ class Tariff(odin.Resource):
                             if not found:
                                 charge_array[str(charge.code) + self.service + charge_type + charge.time.name].append(0.0)
                         elif charge.rate_schedule:
-                            for schedule_item in charge.rate_schedule:
+                            for schedule_item in schedule_items[id(charge)]:
                                 if dt.to_pydatetime() < schedule_item.datetime:
                                     charge_array[str(charge.code) + self.service + charge_type + 'scheduled'].append(schedule_item.rate * float(row[charge.meter]))
                                     break
+                            else:
+                                charge_array[str(charge.code) + self.service + charge_type + 'scheduled'].append(0.0)
                         else:
                             charge_array, block_accum_dict = self.calc_charge(
                                 str(charge.code) + self.service + charge_type, row, charge, charge_array, block_accum_dict)
 
+            # Charges sharing a component name are summed into one cost per row, as by the vectorized engine
+            for costs in charge_array.values():
+                if len(costs) > position + 1:
+                    costs[position:] = [sum(costs[position:])]
+
         return charge_array
 
-    def apply(self, meter_data, start=None, end=None, output_format='total'):
+    def compile(self):
         """
-            Calculates the cost of energy given a tariff and load.
+            Compiles the tariff into an immutable billing plan. The plan is cached on the tariff and recompiled once
+            the tariff has been modified (rate schedules are compared by list identity and length, so call
+            invalidate() after editing schedule items in place).
+        """
+        signature = resource_signature(self)
+        plan = getattr(self, '_plan', None)
+        if plan is not None and plan.signature is None:
+            # Plans loaded from a tariff bundle take the signature of the tariff when first used
+            plan = self._plan = plan.with_signature(signature)
+        if plan is None or plan.signature != signature:
+            plan = BillingPlan(self, signature)
+            self._plan = plan
+        return plan
+
+    def invalidate(self):
+        """Discards the cached billing plan, content digest and the arrays of rate schedules given as lists"""
+        self._plan = None
+        self._digest = None
+        for charge in self.charges or ():
+            charge._rate_schedule = None
+
+    def digest(self):
+        """
+            A stable hash of the serialized tariff, identifying its content across processes. The digest is cached on
+            the tariff like its billing plan and recomputed once the tariff has been modified.
+        """
+        signature = resource_signature(self)
+        cached = getattr(self, '_digest', None)
+        if cached is None or cached[0] != signature:
+            data = json.dumps(dict_codec.dump(self), sort_keys=True, separators=(',', ':'), default=str)
+            cached = self._digest = (signature, hashlib.sha256(data.encode()).hexdigest())
+        return cached[1]
+
+    def apply_by_charge_type_vectorized(self, meter_data, charge_type='consumption', features=None):
+        """
+            Calculates the cost of energy given a tariff and load, evaluating each charge of the compiled billing
+            plan over the whole meter data index at once rather than row by row.
 
             :param meter_data: a three-column pandas array with datetime, imported energy (kwh), exported energy (kwh)
-            :param start: an optional datetime to select the commencement of the bill calculation
-            :param end: an optional datetime to select the termination of the bill calculation
+            :param features: optional pre-computed calendar features of the meter data index
             :return: a dictionary containing the charge components (e.g. off_peak, shoulder, peak, total)
         """
-        meter_data.truncate(before=start, after=end)
-        charge_array = defaultdict(list)
-        if 'consumption' in self.charge_types:
-            consumption_data = meter_data
-            # Resample meter data if finer resolution data not required by the specified tariff types
-            if 'tou' not in self.charge_types and output_format != 'input-timestep' and output_format != 'input-timestep-components':
-                if 'seasonal' in self.charge_types:
-                    consumption_data = meter_data.resample('D').sum()
-                else:
-                    consumption_data = meter_data.resample(PERIOD_TO_TIMESTEP[self.billing_period]).sum()
+        return self.compile().apply_by_charge_type(meter_data, charge_type, features)
+
+    def resampling_steps(self, charge_type='consumption', output_format='total'):
+        """
+            The (rule, aggregation) steps used to resample meter data before applying charges of a given type.
 
-            consumption_charges = self.apply_by_charge_type(consumption_data, 'consumption')
-            charge_array.update(consumption_charges)
+            Consumption is billed at the input timestep if required by time-of-use charges or the output format,
+            otherwise daily for seasonal charges or per billing period. Demand is averaged over the demand window and
+            the maximum taken for each billing period.
+        """
+        if charge_type == 'demand':
+            return ((PERIOD_TO_TIMESTEP[self.demand_window], 'mean'),
+                    (PERIOD_TO_TIMESTEP[self.billing_period], 'max'))
+        if 'tou' in self.charge_types or output_format in ('input-timestep', 'input-timestep-components'):
+            return ()
+        if 'seasonal' in self.charge_types:
+            return (('D', 'sum'),)
+        return ((PERIOD_TO_TIMESTEP[self.billing_period], 'sum'),)
+
+    def charge_costs(self, meter_data, output_format='total', engine='vectorized'):
+        """
+            Calculates the cost of each charge component of the tariff.
+
+            :param meter_data: a MeterData instance, which memoizes resampled meter data across calculations
+            :return: an iterator of the name and costs of each charge component, along with the start of each billing
+                period for costs of demand charges, which are costed per billing period, otherwise None
+        """
+        if engine not in dict(ENGINE_CHOICES):
+            raise UserWarning('Unsupported engine: %s' % engine)
+
+        def apply_by_charge_type(steps, charge_type):
+            with phase('charges', charge_type=charge_type, engine=engine) as record:
+                resampled = meter_data.resample(*steps)
+                if record is not None:
+                    record['rows'] = len(resampled)
+                if engine == 'vectorized':
+                    return self.apply_by_charge_type_vectorized(resampled, charge_type, meter_data.features(*steps))
+                return self.apply_by_charge_type(resampled, charge_type)
+
+        if 'consumption' in self.charge_types:
+            consumption_charges = apply_by_charge_type(self.resampling_steps('consumption', output_format),
+                                                       'consumption')
+            for name, costs in consumption_charges.items():
+                yield name, costs, None
 
         if 'demand' in self.charge_types:
             if output_format == 'input-timestep' or output_format == 'input-timestep-components':
                 raise UserWarning("The output_format cannot be specified as 'input-timestep' if demand charges have "
                                   "been assigned.")
-            # Resample meter data to the demand window and then take the maximum for each billing period
-            demand_data = meter_data.resample(PERIOD_TO_TIMESTEP[self.demand_window]).mean()
-            peak_monthly = demand_data.resample(PERIOD_TO_TIMESTEP[self.billing_period]).max()
-            demand_charges = self.apply_by_charge_type(peak_monthly, 'demand')
-            charge_array.update(demand_charges)
+            if engine == 'vectorized':
+                with phase('charges', charge_type='demand', engine=engine):
+                    for demand_charge in demand_charges(self.compile(), meter_data,
+                                                        PERIOD_TO_TIMESTEP[self.demand_window]):
+                        yield demand_charge.charge.name, demand_charge.costs, demand_charge.periods
+            else:
+                # Demand windows are restricted by their starts rather than the billing period labels of the loop
+                if self.demand_window_type == 'rolling' or any(
+                        charge.ratchet or (charge.type == 'demand' and (charge.season or charge.time))
+                        for charge in self.charges):
+                    raise UserWarning('Rolling demand windows, ratchets and seasonal or time-of-use demand charges '
+                                      'require the vectorized engine')
+                steps = self.resampling_steps('demand', output_format)
+                demand_costs = apply_by_charge_type(steps, 'demand')
+                periods = meter_data.resample(*steps).index
+                for name, costs in demand_costs.items():
+                    yield name, costs, periods
+
+    def apply_charges(self, meter_data, output_format='total', engine='vectorized'):
+        """
+            Calculates the cost of each charge component of the tariff.
 
-        # Transform the output data into the specified output format
-        if output_format == 'total':
-            output = 0.0
-            for v in charge_array.values():
-                output += sum(v)
-        elif output_format == 'total-components':
-            output = dict()
-            for k, v in charge_array.items():
-                output[k] = sum(v)
+            :param meter_data: a MeterData instance, which memoizes resampled meter data across calculations
+            :return: a dictionary containing the charge components (e.g. off_peak, shoulder, peak, total)
+        """
+        charge_array = dict()
+        for name, costs, _ in self.charge_costs(meter_data, output_format, engine):
+            charge_array[name] = charge_array[name] + costs if name in charge_array else costs
+        return charge_array
+
+    def bill(self, meter_data, start=None, end=None, output_format='total', engine='vectorized'):
+        """
+            Calculates the cost of each charge component of the tariff given a load.
+
+            :param meter_data: a three-column pandas array with datetime, imported energy (kwh), exported energy (kwh),
+                fleet meter data with a column per meter and register, or a MeterData instance
+            :param start: an optional datetime to select the commencement of the bill calculation
+            :param end: an optional datetime to select the termination of the bill calculation
+            :param output_format: the output format the bill is for, 'input-timestep' formats costing every interval
+            :param engine: 'vectorized' to evaluate charges over whole arrays or 'loop' for the row-by-row reference
+            :return: a Bill with a row per charge component and a column per row of the meter data as billed
+        """
+        with phase('truncate', rows=len(meter_data)) as record:
+            meter_data = MeterData.coerce(meter_data).truncate(before=start, after=end)
+            if record is not None:
+                record['rows_out'] = len(meter_data)
+
+        # Rows are those of the meter data as billed by consumption charges, demand charges being billed per period
+        if 'consumption' in self.charge_types:
+            steps = self.resampling_steps('consumption', output_format)
         else:
-            df = pandas.DataFrame.from_dict(data=charge_array)
-            df.index = meter_data.index
-            if output_format == 'billing-period':
-                output = df.resample(PERIOD_TO_TIMESTEP[self.billing_period].sum()).sum(1)
-            elif output_format == 'billing-period-components':
-                output = df.resample(PERIOD_TO_TIMESTEP[self.billing_period].sum())
-            elif output_format == 'input-timestep':
-                output = df.sum(1)
-            elif output_format == 'input-timestep-components':
-                output = df
-            else:
-                raise UserWarning('Unsupported output format: %s' % output_format)
+            steps = ((PERIOD_TO_TIMESTEP[self.billing_period], 'sum'),)
+        bill = Bill(bill_components(self), meter_data.features(*steps), self.billing_period,
+                    fleet_meters(meter_data.frame))
+        for name, costs, periods in self.charge_costs(meter_data, output_format, engine):
+            bill.add(name, costs, periods)
+        return bill
+
+    def apply(self, meter_data, start=None, end=None, output_format='total', engine='vectorized', cache=None):
+        """
+            Calculates the cost of energy given a tariff and load.
+
+            :param meter_data: a three-column pandas array with datetime, imported energy (kwh), exported energy (kwh),
+                or a MeterData instance to share resampled meter data between calculations
+            :param start: an optional datetime to select the commencement of the bill calculation
+            :param end: an optional datetime to select the termination of the bill calculation
+            :param output_format: one of BILL_OUTPUT_FORMAT_CHOICES, see Bill.output
+            :param engine: 'vectorized' to evaluate charges over whole arrays or 'loop' for the row-by-row reference
+            :param cache: an optional ResultCache to return the result of a previous calculation from
+            :return: the total, a dictionary containing the charge components (e.g. off_peak, shoulder, peak), or a
+                Series or DataFrame of the costs of each billing period or interval
+        """
+        if cache is not None:
+            return cache.apply(self, meter_data, start, end, output_format, engine)
+        if output_format not in dict(BILL_OUTPUT_FORMAT_CHOICES):
+            raise UserWarning('Unsupported output format: %s' % output_format)
+        bill = self.bill(meter_data, start, end, output_format, engine)
+
+        # Transform the output data into the specified output format
+        with phase('format', output_format=output_format):
+            return bill.output(output_format)
+
+    def demand_peaks(self, meter_data, start=None, end=None):
+        """
+            Reports the peak and billed demand of each demand charge and billing period.
+
+            :param meter_data: a three-column pandas array with datetime, imported energy (kwh), exported energy (kwh),
+                fleet meter data with a column per meter and register, or a MeterData instance
+            :param start: an optional datetime to select the commencement of the bill calculation
+            :param end: an optional datetime to select the termination of the bill calculation
+            :return: a DataFrame indexed by charge component and billing period (and meter for fleet meter data) with
+                the peak demand and the start of its demand window, the billed demand after any ratchet and the start
+                of the demand window it was set in, whether the ratchet applied and the cost
+        """
+        meter_data = MeterData.coerce(meter_data).truncate(before=start, after=end)
+        return demand_frame(demand_charges(self.compile(), meter_data, PERIOD_TO_TIMESTEP[self.demand_window]),
+                            fleet_meters(meter_data.frame), DEMAND_COLUMNS[:-1])
 
-        return output
 
 class Spec(odin.Resource):
 
@@ -0,0 +1,26 @@
+from benchmarks.cases import synthetic_meter_data
+from benchmarks.run import regressions
+import pandas
+
+
+class TestBenchmarks(object):
+
+    def test_synthetic_meter_data(self):
+        meter_data = synthetic_meter_data(2, '5min')
+        assert len(meter_data) == 576
+        assert list(meter_data.columns) == ['electricity_imported', 'electricity_exported']
+        assert (meter_data >= 0).all().all()
+        # A meter either imports or exports in an interval
+        assert ((meter_data['electricity_imported'] > 0) & (meter_data['electricity_exported'] > 0)).sum() == 0
+
+        fleet_data = synthetic_meter_data(1, '30min', meters=3)
+        assert fleet_data.shape == (48, 6)
+        assert list(fleet_data.columns.get_level_values(0).unique()) == ['00000', '00001', '00002']
+
+    def test_regressions(self):
+        results = pandas.DataFrame({'wall': [1.0, 2.0, 1.0], 'peak_memory': [100, 100, 200]},
+                                   index=['a', 'b', 'c'])
+        baseline = {'a': {'wall': 1.0, 'peak_memory': 100}, 'b': {'wall': 1.0, 'peak_memory': 100},
+                    'c': {'wall': 1.0, 'peak_memory': 100}}
+        found = regressions(results, baseline, threshold=0.25)
+        assert list(zip(found['case'], found['measurement'])) == [('b', 'wall'), ('c', 'peak_memory')]
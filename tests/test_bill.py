@@ -0,0 +1,132 @@
+from tariffs.bill import Bill, Component
+from tariffs.tariff import Tariff
+import pytest
+from odin.codecs import dict_codec
+import numpy
+import pandas
+import datetime
+
+
+parser = lambda t: datetime.datetime.strptime(t, '%d/%m/%Y %H:%M')
+
+
+class TestBill(object):
+
+    @pytest.fixture
+    def meter_data(self):
+        with open('./fixtures/test_load_data.csv') as f:
+            meter_data = pandas.read_csv(f, index_col='datetime', parse_dates=True, infer_datetime_format=True,
+                                         date_parser=parser)
+        hours = meter_data.index.hour.to_numpy()
+        meter_data['electricity_imported'] = 0.2 + 0.3 * (hours >= 17)
+        return meter_data
+
+    @pytest.fixture
+    def tou_tariff(self):
+        return dict_codec.load(
+            {
+                "charges": [
+                    {"code": "P", "rate": 0.5, "time": {"name": "peak", "periods": [{"from_hour": 17}]}},
+                    {"code": "O", "rate": 0.1, "time": {"name": "off-peak", "periods": [{"to_hour": 16}]}},
+                    {"code": "E", "rate": -0.1, "meter": "electricity_exported"}
+                ],
+                "service": "electricity"
+            }, Tariff
+        )
+
+    @pytest.fixture
+    def demand_tariff(self):
+        return dict_codec.load(
+            {
+                "charges": [
+                    {"code": "B", "rate_bands": [{"limit": 300, "rate": 0.3}, {"rate": 0.2}]},
+                    {"code": "W", "rate": 0.05, "season": {"name": "winter", "from_month": 6, "from_day": 1,
+                                                           "to_month": 8, "to_day": 31}},
+                    {"code": "D", "rate": 10.0, "type": "demand"}
+                ],
+                "service": "electricity",
+                "demand_window": "30min"
+            }, Tariff
+        )
+
+    def test_components(self, demand_tariff, meter_data):
+        bill = demand_tariff.bill(meter_data)
+        assert isinstance(bill, Bill)
+        assert bill.components == (
+            Component('Belectricityconsumption', 'B', 'consumption', None, None, 'electricity_imported'),
+            Component('Welectricityconsumptionwinter', 'W', 'consumption', 'winter', None, 'electricity_imported'),
+            Component('Delectricitydemand', 'D', 'demand', None, None, 'electricity_imported'),
+        )
+        # Seasonal charges are billed daily
+        assert bill.costs.shape == (3, 365)
+        assert bill.costs.flags['C_CONTIGUOUS']
+        assert bill.total() == pytest.approx(demand_tariff.apply(meter_data))
+
+    def test_output_formats_share_costs(self, demand_tariff, meter_data):
+        bill = demand_tariff.bill(meter_data)
+        components = bill.output('total-components')
+        assert components == pytest.approx(demand_tariff.apply(meter_data, output_format='total-components'))
+        assert components == pytest.approx(dict(zip(bill.names, bill.component_totals())))
+        assert numpy.shares_memory(bill.component('Delectricitydemand'), bill.costs)
+        # Demand costs are billed against the first row of each billing period
+        demand = bill.component('Delectricitydemand')
+        assert numpy.flatnonzero(demand).tolist() == bill.starts.tolist()
+        assert demand[bill.starts].tolist() == pytest.approx([5.0] * 12)
+
+    def test_billing_period(self, demand_tariff, meter_data):
+        output = demand_tariff.apply(meter_data, output_format='billing-period-components')
+        assert output.index.equals(pandas.date_range('2018-01-01', periods=12, freq='MS'))
+        assert output.columns.tolist() == ['Belectricityconsumption', 'Welectricityconsumptionwinter',
+                                           'Delectricitydemand']
+        january_usage = meter_data.loc['2018-01', 'electricity_imported'].sum()
+        assert output.loc['2018-01-01', 'Belectricityconsumption'] == pytest.approx(
+            300 * 0.3 + (january_usage - 300) * 0.2)
+        assert output.loc['2018-07-01', 'Welectricityconsumptionwinter'] == pytest.approx(
+            meter_data.loc['2018-07', 'electricity_imported'].sum() * 0.05)
+        totals = demand_tariff.apply(meter_data, output_format='billing-period')
+        pandas.testing.assert_series_equal(totals, output.sum(1))
+        assert totals.sum() == pytest.approx(demand_tariff.apply(meter_data))
+
+    def test_timezone(self, demand_tariff, meter_data):
+        local = meter_data.tz_localize('Etc/GMT-10')
+        assert demand_tariff.apply(local) == pytest.approx(demand_tariff.apply(meter_data))
+        output = demand_tariff.apply(local, output_format='billing-period')
+        assert output.index.equals(pandas.date_range('2018-01-01', periods=12, freq='MS', tz='Etc/GMT-10'))
+        assert demand_tariff.demand_peaks(local).index.get_level_values('period').equals(output.index)
+
+        # Billing periods start at local midnight across daylight saving transitions
+        converted = meter_data.tz_localize('UTC').tz_convert('Australia/Sydney')
+        output = demand_tariff.apply(converted, output_format='billing-period')
+        assert str(output.index.tz) == 'Australia/Sydney'
+        assert (output.index[1:].hour == 0).all() and (output.index[1:].day == 1).all()
+        assert output.sum() == pytest.approx(demand_tariff.apply(converted))
+
+    def test_input_timestep(self, tou_tariff, meter_data):
+        bill = tou_tariff.bill(meter_data, output_format='input-timestep-components')
+        output = bill.output('input-timestep-components')
+        assert output.index.equals(meter_data.index)
+        assert output.columns.tolist() == ['Pelectricityconsumptionpeak', 'Oelectricityconsumptionoff-peak',
+                                           'Eelectricityconsumption']
+        # Each component is a view of the costs of the bill
+        assert numpy.shares_memory(output.to_numpy(), bill.costs)
+        assert output.loc['2018-01-01 18:00', 'Pelectricityconsumptionpeak'] == pytest.approx(0.5 * 0.5)
+        pandas.testing.assert_series_equal(tou_tariff.apply(meter_data, output_format='input-timestep'),
+                                           output.sum(1))
+
+    def test_loop_engine(self, demand_tariff, meter_data):
+        expected = demand_tariff.apply(meter_data, output_format='billing-period-components')
+        actual = demand_tariff.apply(meter_data, output_format='billing-period-components', engine='loop')
+        pandas.testing.assert_frame_equal(actual, expected)
+
+    def test_fleet(self, demand_tariff, meter_data):
+        fleet_data = pandas.concat({'A': meter_data, 'B': meter_data * 2.0}, axis=1, names=['meter', 'register'])
+        bill = demand_tariff.bill(fleet_data)
+        assert bill.costs.shape == (3, 365, 2)
+        assert bill.component_totals()[:, 0] == pytest.approx(list(
+            demand_tariff.apply(meter_data, output_format='total-components').values()))
+        with pytest.raises(UserWarning):
+            bill.output('billing-period')
+
+    def test_unsupported_output_format(self, tou_tariff, meter_data):
+        with pytest.raises(UserWarning):
+            tou_tariff.apply(meter_data, output_format='unknown')
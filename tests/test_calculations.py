@@ -213,6 +213,152 @@ class TestTariff(object):
         )
         return demand_tariff
 
+    @pytest.fixture
+    def tou_demand_tariff(self):
+        tou_demand_tariff = dict_codec.load(
+            {
+                "charges": [
+                    {
+                        "rate": 1.0,
+                        "type": "demand",
+                        "time": {
+                            "name": "peak",
+                            "periods": [
+                                {
+                                    "from_hour": 14,
+                                    "to_hour": 19
+                                }
+                            ]
+                        }
+                    }
+                ],
+                "service": "electricity",
+                "demand_window": "hourly",
+                "billing_period": "monthly"
+            }, Tariff
+        )
+        return tou_demand_tariff
+
+    @pytest.fixture
+    def seasonal_tou_tariff(self):
+        seasonal_tou_tariff = dict_codec.load(
+            {
+                "charges": [
+                    {
+                        "rate": 2.0,
+                        "season": {
+                            "name": "summer",
+                            "from_month": 1,
+                            "from_day": 1,
+                            "to_month": 3,
+                            "to_day": 31
+                        },
+                        "time": {
+                            "name": "peak",
+                            "periods": [
+                                {
+                                    "from_weekday": 0,
+                                    "to_weekday": 4,
+                                    "from_hour": 14,
+                                    "to_hour": 19
+                                }
+                            ]
+                        }
+                    },
+                    {
+                        "rate_bands": [
+                            {
+                                "limit": 100,
+                                "rate": 1.5
+                            },
+                            {
+                                "rate": 0.5
+                            }
+                        ],
+                        "season": {
+                            "name": "winter",
+                            "from_month": 4,
+                            "from_day": 1,
+                            "to_month": 12,
+                            "to_day": 31
+                        },
+                        "time": {
+                            "name": "peak",
+                            "periods": [
+                                {
+                                    "from_weekday": 0,
+                                    "to_weekday": 4,
+                                    "from_hour": 14,
+                                    "to_hour": 19
+                                }
+                            ]
+                        }
+                    }
+                ],
+                "service": "electricity",
+                "consumption_unit": "kWh",
+                "demand_unit": "kVA",
+                "billing_period": "monthly"
+            }, Tariff
+        )
+        return seasonal_tou_tariff
+
+    @pytest.fixture
+    def tou_block_tariff(self):
+        tou_block_tariff = dict_codec.load(
+            {
+                "charges": [
+                    {
+                        "rate_bands": [
+                            {
+                                "limit": 1000,
+                                "rate": 1.0
+                            },
+                            {
+                                "rate": 0.5
+                            }
+                        ],
+                        "time": {
+                            "name": "anytime",
+                            "periods": [
+                                {
+                                    "from_weekday": 0,
+                                    "to_weekday": 6
+                                }
+                            ]
+                        }
+                    }
+                ],
+                "service": "electricity",
+                "consumption_unit": "kWh",
+                "billing_period": "quarterly"
+            }, Tariff
+        )
+        return tou_block_tariff
+
+    @pytest.fixture
+    def shared_component_tariff(self):
+        # An import rate and a feed-in rate without codes are billed in the same charge component
+        anytime = {"name": "anytime", "periods": [{"from_weekday": 0, "to_weekday": 6}]}
+        shared_component_tariff = dict_codec.load(
+            {
+                "charges": [
+                    {
+                        "rate": 0.3,
+                        "time": anytime
+                    },
+                    {
+                        "rate": -0.1,
+                        "meter": "electricity_exported",
+                        "time": anytime
+                    }
+                ],
+                "service": "electricity",
+                "billing_period": "monthly"
+            }, Tariff
+        )
+        return shared_component_tariff
+
     def test_block_tariff(self, block_tariff, meter_data):
         expected_bill = 35040.0
         actual_bill = block_tariff.apply(meter_data)
@@ -228,6 +374,12 @@ class TestTariff(object):
         actual_bill = tou_tariff.apply(meter_data)
         assert actual_bill == expected_bill
 
+    def test_tou_block_tariff(self, tou_block_tariff, meter_data):
+        # The first 1000 kWh of each quarter at 1.0 and the remainder at 0.5
+        expected_bill = 4 * 1000 * 1.0 + (35040 - 4 * 1000) * 0.5
+        actual_bill = tou_block_tariff.apply(meter_data)
+        assert actual_bill == pytest.approx(expected_bill)
+
     def test_scheduled_tariff(self, scheduled_tariff, meter_data):
         expected_bill = 35040.0
         actual_bill = scheduled_tariff.apply(meter_data)
@@ -242,3 +394,27 @@ class TestTariff(object):
         expected_bill = 12.0
         actual_bill = demand_tariff.apply(meter_data)
         assert actual_bill == expected_bill
+
+    @pytest.mark.parametrize('tariff_fixture', ['block_tariff', 'seasonal_tariff', 'tou_tariff', 'scheduled_tariff',
+                                                'supply_payment_tariff', 'demand_tariff', 'seasonal_tou_tariff',
+                                                'tou_block_tariff', 'shared_component_tariff'])
+    def test_vectorized_engine_matches_loop(self, tariff_fixture, meter_data, request):
+        tariff = request.getfixturevalue(tariff_fixture)
+        expected_components = tariff.apply(meter_data, output_format='total-components', engine='loop')
+        actual_components = tariff.apply(meter_data, output_format='total-components', engine='vectorized')
+        assert actual_components == pytest.approx(expected_components)
+
+    def test_loop_engine_rejects_tou_demand(self, tou_demand_tariff, meter_data):
+        # The loop engine would restrict demand windows by the label of their billing period rather than their start
+        assert tou_demand_tariff.apply(meter_data, engine='vectorized') == pytest.approx(12.0)
+        with pytest.raises(UserWarning):
+            tou_demand_tariff.apply(meter_data, engine='loop')
+
+    def test_vectorized_engine_matches_loop_by_timestep(self, tou_tariff, meter_data):
+        expected_costs = tou_tariff.apply(meter_data, output_format='input-timestep-components', engine='loop')
+        actual_costs = tou_tariff.apply(meter_data, output_format='input-timestep-components', engine='vectorized')
+        pandas.testing.assert_frame_equal(actual_costs, expected_costs)
+
+    def test_unsupported_engine(self, block_tariff, meter_data):
+        with pytest.raises(UserWarning):
+            block_tariff.apply(meter_data, engine='unknown')
@@ -0,0 +1,103 @@
+from tariffs import Profiler
+from tariffs.compact import CompactMeterData, apply_compact
+from tariffs.tariff import Tariff
+import pytest
+from odin.codecs import dict_codec
+import numpy
+import pandas
+import datetime
+
+
+parser = lambda t: datetime.datetime.strptime(t, '%d/%m/%Y %H:%M')
+
+
+class TestCompactMeterData(object):
+
+    @pytest.fixture
+    def meter_data(self):
+        with open('./fixtures/test_load_data.csv') as f:
+            meter_data = pandas.read_csv(f, index_col='datetime', parse_dates=True, infer_datetime_format=True,
+                                         date_parser=parser)
+        return meter_data.astype(numpy.float32)
+
+    @pytest.fixture
+    def tariff(self):
+        return dict_codec.load(
+            {
+                "charges": [
+                    {"code": "P", "rate": 0.5, "time": {"name": "peak", "periods": [{"from_hour": 17}]}},
+                    {"code": "B", "rate_bands": [{"limit": 500, "rate": 0.2}, {"rate": 0.1}]},
+                    {"code": "F", "rate": 0.05, "meter": "electricity_exported"},
+                    {"code": "D", "rate": 10.0, "type": "demand"}
+                ],
+                "service": "electricity"
+            }, Tariff
+        )
+
+    def test_container(self, meter_data):
+        compact = CompactMeterData.from_frame(meter_data)
+        assert compact.values.dtype == numpy.float32
+        assert compact.nbytes == compact.values.nbytes + compact.index.nbytes
+        frame = compact.frame(10, 20)
+        pandas.testing.assert_frame_equal(frame, meter_data.iloc[10:20], check_freq=False)
+        assert numpy.shares_memory(frame.to_numpy(), compact.values)
+
+        truncated = compact.truncate(before=datetime.datetime(2018, 2, 1), after=datetime.datetime(2018, 2, 28, 23, 45))
+        pandas.testing.assert_frame_equal(truncated.frame(), meter_data.truncate(
+            before=datetime.datetime(2018, 2, 1), after=datetime.datetime(2018, 2, 28, 23, 45)), check_freq=False)
+        assert numpy.shares_memory(truncated.values, compact.values)
+
+        with pytest.raises(UserWarning):
+            CompactMeterData(meter_data.index, compact.values[:1], meter_data.columns)
+
+    def test_chunks(self, meter_data):
+        compact = CompactMeterData.from_frame(meter_data)
+        months = meter_data.index.to_period('M')
+        starts = [start for start, _ in compact.chunks('monthly')]
+        assert starts == numpy.flatnonzero(numpy.append(True, months[1:] != months[:-1])).tolist()
+        assert [len(range(*chunk)) for chunk in compact.chunks('quarterly', periods=2)] == [
+            (months.quarter.isin(quarters) & (months.year == 2018)).sum() for quarters in ((1, 2), (3, 4))]
+        assert compact.chunks('weekly') == [(0, len(meter_data))]
+
+        # Billing periods of tz-aware meter data are of local times
+        local = CompactMeterData.from_frame(meter_data.tz_localize('Etc/GMT-10'))
+        assert local.chunks('monthly') == compact.chunks('monthly')
+
+    @pytest.mark.parametrize('output_format', ['total', 'total-components', 'billing-period',
+                                               'billing-period-components'])
+    def test_matches_apply(self, tariff, meter_data, output_format):
+        expected = tariff.apply(meter_data, output_format=output_format)
+        for chunk_periods in (1, 5, None):
+            actual = apply_compact(tariff, meter_data, output_format=output_format, chunk_periods=chunk_periods)
+            if output_format == 'total':
+                assert actual == pytest.approx(expected)
+            elif output_format == 'total-components':
+                assert actual == pytest.approx(expected)
+                assert list(actual) == list(expected)
+            else:
+                assert actual.index.equals(expected.index)
+                numpy.testing.assert_allclose(numpy.asarray(actual), numpy.asarray(expected), rtol=1e-6)
+
+        start, end = datetime.datetime(2018, 3, 15), datetime.datetime(2018, 7, 20)
+        assert apply_compact(tariff, CompactMeterData.from_frame(meter_data), start, end) == pytest.approx(
+            tariff.apply(meter_data, start, end))
+
+    def test_peak_memory(self, tariff, meter_data):
+        compact = CompactMeterData.from_frame(meter_data)
+        with Profiler() as profiler:
+            apply_compact(tariff, compact)
+            apply_compact(tariff, compact, chunk_periods=None)
+        chunked, whole = [record for record in profiler.phases if record['phase'] == 'compact']
+        assert chunked['rows'] == whole['rows'] == len(meter_data)
+        assert 0 < chunked['peak_memory'] < whole['peak_memory']
+        assert [record['rows'] for record in profiler.counts if record['count'] == 'chunk'][-1] == len(meter_data)
+
+    def test_cross_period_demand(self, tariff, meter_data):
+        data = dict_codec.dump(tariff)
+        ratchet = dict(data, charges=data['charges'][:-1] + [
+            {"code": "D", "rate": 10.0, "type": "demand", "ratchet": {"percentage": 80}}])
+        for tariff in (dict_codec.load(ratchet, Tariff), dict_codec.load(dict(data, demand_window_type='rolling'),
+                                                                          Tariff)):
+            with pytest.raises(UserWarning):
+                apply_compact(tariff, meter_data)
+            assert apply_compact(tariff, meter_data, chunk_periods=None) == pytest.approx(tariff.apply(meter_data))
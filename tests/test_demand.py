@@ -0,0 +1,150 @@
+from tariffs.serialization import TariffBundle, dump_tariffs
+from tariffs.tariff import Tariff
+import pytest
+from odin.codecs import dict_codec
+import pandas
+import datetime
+
+
+parser = lambda t: datetime.datetime.strptime(t, '%d/%m/%Y %H:%M')
+
+PEAK = {"name": "peak", "periods": [{"from_weekday": 0, "to_weekday": 4, "from_hour": 14, "to_hour": 19}]}
+
+
+def demand_tariff(charge=None, **fields):
+    data = {
+        "charges": [dict({"code": "D", "rate": 10.0, "type": "demand"}, **(charge or {}))],
+        "service": "electricity",
+        "billing_period": "monthly",
+        "demand_window": "30min",
+    }
+    data.update(fields)
+    return dict_codec.load(data, Tariff)
+
+
+class TestDemand(object):
+
+    @pytest.fixture
+    def meter_data(self):
+        # A flat load of 1.0 per quarter hour with a 10.0 spike on a Sunday night in January 2019, a 5.0 spike
+        # spanning two half hour windows on a Tuesday afternoon in January 2019 and a 2.0 spike in March 2019
+        index = pandas.date_range('2019-01-01', '2020-02-29 23:45', freq='15min', name='datetime')
+        imported = pandas.Series(1.0, index=index)
+        imported.loc['2019-01-06 03:00':'2019-01-06 03:15'] = 10.0
+        imported.loc['2019-01-15 15:15':'2019-01-15 15:30'] = 5.0
+        imported.loc['2019-03-12 15:00':'2019-03-12 15:15'] = 2.0
+        return pandas.DataFrame({'electricity_imported': imported, 'electricity_exported': 0.0})
+
+    @pytest.fixture
+    def fixture_meter_data(self):
+        with open('./fixtures/test_load_data.csv') as f:
+            meter_data = pandas.read_csv(f, index_col='datetime', parse_dates=True, infer_datetime_format=True,
+                                         date_parser=parser)
+        return meter_data
+
+    def test_fixed_windows_match_loop_engine(self, fixture_meter_data):
+        tariff = demand_tariff(demand_window='15min')
+        assert tariff.apply(fixture_meter_data) == pytest.approx(tariff.apply(fixture_meter_data, engine='loop'))
+
+    def test_unrestricted_peaks(self, meter_data):
+        peaks = demand_tariff().demand_peaks(meter_data).loc['Delectricitydemand']
+        assert len(peaks) == 14
+        january = peaks.loc[pandas.Timestamp('2019-01-01')]
+        assert january['peak'] == 10.0
+        assert january['peak_timestamp'] == pandas.Timestamp('2019-01-06 03:00')
+        assert january['cost'] == 100.0
+        assert peaks['billed'].tolist() == peaks['peak'].tolist()
+        assert not peaks['ratcheted'].any()
+
+    def test_time_of_use_peaks(self, meter_data):
+        tariff = demand_tariff({"time": PEAK})
+        peaks = tariff.demand_peaks(meter_data).loc['Delectricitydemandpeak']
+        # The Sunday night spike falls outside the peak period, the afternoon spike straddles two fixed windows
+        january = peaks.loc[pandas.Timestamp('2019-01-01')]
+        assert january['peak'] == 3.0
+        assert january['peak_timestamp'] == pandas.Timestamp('2019-01-15 15:00')
+        # The first window of a billing period reaching its peak is reported
+        assert peaks.loc[pandas.Timestamp('2019-02-01'), 'peak_timestamp'] == pandas.Timestamp('2019-02-01 14:00')
+        assert tariff.apply(meter_data, output_format='total-components') == {
+            'Delectricitydemandpeak': pytest.approx(10.0 * (3.0 + 2.0 + 12 * 1.0))}
+
+    def test_seasonal_peaks(self, meter_data):
+        tariff = demand_tariff({"season": {"name": "autumn", "from_month": 3, "from_day": 1, "to_month": 5,
+                                           "to_day": 31}})
+        peaks = tariff.demand_peaks(meter_data).loc['Delectricitydemandautumn']
+        # Billing periods without eligible windows have no peak
+        assert peaks['peak'].tolist() == [0.0, 0.0, 2.0, 1.0, 1.0] + [0.0] * 9
+        assert peaks['peak_timestamp'].isna().sum() == 11
+
+    @pytest.mark.parametrize('demand_window, january_peak, january_timestamp, march_peak', [
+        ('15min', 5.0, '2019-01-15 15:15', 2.0),
+        ('30min', 5.0, '2019-01-15 15:15', 2.0),
+        # The earliest hour spanning both intervals of the spike and two flat intervals
+        ('hourly', 3.0, '2019-01-15 14:45', 1.5),
+    ])
+    def test_rolling_windows(self, meter_data, demand_window, january_peak, january_timestamp, march_peak):
+        tariff = demand_tariff({"time": PEAK}, demand_window_type='rolling', demand_window=demand_window)
+        peaks = tariff.demand_peaks(meter_data).loc['Delectricitydemandpeak']
+        january = peaks.loc[pandas.Timestamp('2019-01-01')]
+        assert january['peak'] == january_peak
+        assert january['peak_timestamp'] == pandas.Timestamp(january_timestamp)
+        assert tariff.apply(meter_data) == pytest.approx(10.0 * (january_peak + march_peak + 12 * 1.0))
+
+    def test_rolling_windows_must_fit_intervals(self, meter_data):
+        tariff = demand_tariff(demand_window_type='rolling', demand_window='15min')
+        with pytest.raises(UserWarning):
+            tariff.apply(meter_data.resample('H').sum())
+
+    def test_ratchet(self, meter_data):
+        tariff = demand_tariff({"ratchet": {"percentage": 80}})
+        peaks = tariff.demand_peaks(meter_data).loc['Delectricitydemand']
+        # January 2019 is within the preceding 11 billing periods up to December 2019
+        assert peaks['ratcheted'].tolist() == [False] + [True] * 13
+        assert peaks['billed'].tolist() == pytest.approx([10.0] + [8.0] * 11 + [1.6, 1.6])
+        assert (peaks['billed_timestamp'].iloc[1:12] == pandas.Timestamp('2019-01-06 03:00')).all()
+        # Once January 2019 lapses, March 2019 sets the ratchet
+        assert peaks['billed_timestamp'].iloc[-1] == pandas.Timestamp('2019-03-12 15:00')
+        assert tariff.apply(meter_data) == pytest.approx(10.0 * (10.0 + 8.0 * 11 + 1.6 * 2))
+
+    def test_ratchet_periods(self, meter_data):
+        tariff = demand_tariff({"ratchet": {"percentage": 50, "periods": 1}})
+        peaks = tariff.demand_peaks(meter_data).loc['Delectricitydemand']
+        assert peaks['billed'].tolist() == pytest.approx([10.0, 5.0, 2.0, 1.0] + [1.0] * 10)
+        assert peaks['ratcheted'].tolist() == [False, True] + [False] * 12
+
+    def test_ratchet_skips_missing_periods(self, meter_data):
+        tariff = demand_tariff({"ratchet": {"percentage": 80, "periods": 2}})
+        # Without meter data for February 2019, January 2019 is two periods before March 2019
+        gap = meter_data[(meter_data.index < '2019-02-01') | (meter_data.index >= '2019-03-01')]
+        peaks = tariff.demand_peaks(gap).loc['Delectricitydemand']
+        assert peaks.index[:3].tolist() == [pandas.Timestamp('2019-01-01'), pandas.Timestamp('2019-03-01'),
+                                            pandas.Timestamp('2019-04-01')]
+        assert peaks['billed'].tolist()[:3] == pytest.approx([10.0, 8.0, 1.6])
+
+    def test_fleet(self, meter_data):
+        tariff = demand_tariff({"time": PEAK, "ratchet": {"percentage": 80}}, demand_window_type='rolling')
+        customers = {'A': meter_data, 'B': meter_data * 2.0}
+        fleet_data = pandas.concat(customers, axis=1, names=['meter', 'register'])
+        peaks = tariff.demand_peaks(fleet_data)
+        assert peaks.index.names == ['component', 'period', 'meter']
+        for meter, customer_data in customers.items():
+            expected = tariff.demand_peaks(customer_data)
+            actual = peaks.xs(meter, level='meter')
+            pandas.testing.assert_frame_equal(actual, expected, check_dtype=False)
+
+    def test_loop_engine_unsupported(self, meter_data):
+        for tariff in (demand_tariff({"ratchet": {"percentage": 80}}), demand_tariff(demand_window_type='rolling'),
+                       demand_tariff({"time": PEAK}), demand_tariff({"season": {"name": "autumn", "from_month": 3,
+                                                                               "from_day": 1, "to_month": 5,
+                                                                               "to_day": 31}})):
+            with pytest.raises(UserWarning):
+                tariff.apply(meter_data, engine='loop')
+
+    def test_bundle(self, meter_data, tmp_path):
+        tariff = demand_tariff({"time": PEAK, "ratchet": {"percentage": 80, "periods": 6}},
+                               demand_window_type='rolling')
+        dump_tariffs([tariff], str(tmp_path / 'tariffs.bundle'))
+        loaded = TariffBundle(str(tmp_path / 'tariffs.bundle'))[0]
+        assert loaded.charges[0].ratchet.percentage == 80
+        assert loaded.compile().charges[0].ratchet == (0.8, 6)
+        assert loaded.apply(meter_data) == pytest.approx(tariff.apply(meter_data))
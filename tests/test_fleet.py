@@ -0,0 +1,93 @@
+from tariffs import apply_fleet, fleet_frame
+from tariffs.tariff import Tariff
+import pytest
+from odin.codecs import dict_codec
+import numpy
+import pandas
+import datetime
+
+
+parser = lambda t: datetime.datetime.strptime(t, '%d/%m/%Y %H:%M')
+
+
+class TestFleet(object):
+
+    @pytest.fixture
+    def meter_data(self):
+        with open('./fixtures/test_load_data.csv') as f:
+            meter_data = pandas.read_csv(f, index_col='datetime', parse_dates=True, infer_datetime_format=True,
+                                         date_parser=parser)
+        return meter_data
+
+    @pytest.fixture
+    def customers(self, meter_data):
+        # A flat load, a doubled load and a load peaking in the afternoon
+        afternoon = ((meter_data.index.hour >= 12) & (meter_data.index.hour < 18)) * 2.0
+        return {
+            'A': meter_data,
+            'B': meter_data * 2.0,
+            'C': meter_data.assign(electricity_imported=meter_data['electricity_imported'] + afternoon),
+        }
+
+    @pytest.fixture
+    def fleet_data(self, customers):
+        return pandas.concat(customers, axis=1, names=['meter', 'register'])
+
+    @pytest.fixture
+    def tariff(self):
+        tariff = dict_codec.load(
+            {
+                "charges": [
+                    {
+                        "code": "P",
+                        "rate_bands": [{"limit": 500, "rate": 0.4}, {"rate": 0.3}],
+                        "time": {"name": "peak", "periods": [{"from_weekday": 0, "to_weekday": 4,
+                                                              "from_hour": 14, "to_hour": 19}]}
+                    },
+                    {
+                        "code": "W",
+                        "rate": 0.1,
+                        "season": {"name": "winter", "from_month": 6, "from_day": 1, "to_month": 8, "to_day": 31}
+                    },
+                    {
+                        "code": "E",
+                        "rate": -0.05,
+                        "meter": "electricity_exported"
+                    },
+                    {
+                        "code": "D",
+                        "rate": 8.0,
+                        "type": "demand"
+                    }
+                ],
+                "service": "electricity",
+                "billing_period": "monthly",
+                "demand_window": "hourly"
+            }, Tariff
+        )
+        return tariff
+
+    def test_totals_match_apply(self, tariff, customers, fleet_data):
+        totals = apply_fleet(tariff, fleet_data)
+        assert totals.index.tolist() == ['A', 'B', 'C']
+        for meter, meter_data in customers.items():
+            assert totals[meter] == pytest.approx(tariff.apply(meter_data))
+
+    def test_components_match_apply(self, tariff, customers, fleet_data):
+        components = apply_fleet(tariff, fleet_data, output_format='total-components')
+        for meter, meter_data in customers.items():
+            expected_components = tariff.apply(meter_data, output_format='total-components')
+            actual_components = components.loc[meter].drop('total').to_dict()
+            assert actual_components == pytest.approx(expected_components)
+
+    def test_fleet_frame(self, tariff, meter_data):
+        values = numpy.stack([meter_data.to_numpy(), meter_data.to_numpy() * 3.0], axis=1)
+        fleet_data = fleet_frame(values, meter_data.index, ['X', 'Y'], list(meter_data.columns))
+        end = datetime.datetime(2018, 1, 31, 23, 59)
+        totals = apply_fleet(tariff, fleet_data, end=end)
+        assert totals['X'] == pytest.approx(tariff.apply(meter_data, end=end))
+        assert totals['Y'] == pytest.approx(tariff.apply(meter_data * 3.0, end=end))
+
+    def test_fleet_frame_shape(self, meter_data):
+        with pytest.raises(ValueError):
+            fleet_frame(numpy.ones((len(meter_data), 3)), meter_data.index, ['X', 'Y'])
@@ -0,0 +1,154 @@
+from tariffs.greenbutton import accumulate, iter_interval_readings, iter_meter_data, read_metadata
+from tariffs.tariff import Tariff
+import pytest
+from odin.codecs import dict_codec
+import pandas
+import datetime
+import tracemalloc
+
+
+parser = lambda t: datetime.datetime.strptime(t, '%d/%m/%Y %H:%M')
+
+TZ_OFFSET = 36000
+
+ENTRY = '<entry><link rel="self" href="%s"/>%s<content>%s</content></entry>'
+
+
+def green_button(meter_data, blocks='D'):
+    # Exported readings are held in tenths of a Wh and all the imported readings precede the exported readings
+    entries = [
+        ENTRY % ('/LocalTimeParameters/01', '', '<LocalTimeParameters xmlns="http://naesb.org/espi">'
+                                                '<tzOffset>%d</tzOffset></LocalTimeParameters>' % TZ_OFFSET),
+    ]
+    for reading, (register, flow_direction, multiplier) in enumerate(
+            [('electricity_imported', 1, 0), ('electricity_exported', 19, -1)]):
+        meter_reading = '/UsagePoint/01/MeterReading/%02d' % reading
+        entries.append(ENTRY % (meter_reading, '<link rel="related" href="/ReadingType/%02d"/>' % reading,
+                                '<MeterReading xmlns="http://naesb.org/espi"/>'))
+        for day, readings in meter_data[register].groupby(meter_data.index.floor(blocks)):
+            starts = (readings.index - pandas.Timestamp('1970-01-01')) // pandas.Timedelta('1s') - TZ_OFFSET
+            interval_readings = ''.join(
+                '<IntervalReading><timePeriod><duration>900</duration><start>%d</start></timePeriod>'
+                '<value>%d</value></IntervalReading>' % (start, round(value * 1000 * 10 ** -multiplier))
+                for start, value in zip(starts, readings))
+            entries.append(ENTRY % ('%s/IntervalBlock/%s' % (meter_reading, day.date()),
+                                    '<link rel="up" href="%s/IntervalBlock"/>' % meter_reading,
+                                    '<IntervalBlock xmlns="http://naesb.org/espi"><interval><duration>86400'
+                                    '</duration><start>%d</start></interval>%s</IntervalBlock>'
+                                    % (starts[0], interval_readings)))
+        entries.append(ENTRY % ('/ReadingType/%02d' % reading, '',
+                                '<ReadingType xmlns="http://naesb.org/espi"><flowDirection>%d</flowDirection>'
+                                '<powerOfTenMultiplier>%d</powerOfTenMultiplier><uom>72</uom></ReadingType>'
+                                % (flow_direction, multiplier)))
+    return '<?xml version="1.0" encoding="UTF-8"?><feed xmlns="http://www.w3.org/2005/Atom">%s</feed>' % (
+        ''.join(entries))
+
+
+class TestGreenButton(object):
+
+    @pytest.fixture
+    def meter_data(self):
+        with open('./fixtures/test_load_data.csv') as f:
+            meter_data = pandas.read_csv(f, index_col='datetime', parse_dates=True, infer_datetime_format=True,
+                                         date_parser=parser)
+        meter_data = meter_data.truncate(after=datetime.datetime(2018, 2, 14, 23, 45)).astype(float)
+        meter_data['electricity_exported'] = (meter_data.index.hour % 3 == 0) * 0.25
+        return meter_data
+
+    @pytest.fixture
+    def path(self, tmpdir, meter_data):
+        path = str(tmpdir.join('green_button.xml'))
+        with open(path, 'w') as f:
+            f.write(green_button(meter_data))
+        return path
+
+    @pytest.fixture
+    def tariff(self):
+        tariff = dict_codec.load(
+            {
+                "charges": [
+                    {
+                        "rate_bands": [{"limit": 300, "rate": 0.3}, {"rate": 0.2}],
+                    },
+                    {
+                        "rate": -0.1,
+                        "meter": "electricity_exported"
+                    },
+                    {
+                        "rate": 8.0,
+                        "type": "demand"
+                    }
+                ],
+                "service": "electricity",
+                "billing_period": "monthly",
+                "demand_window": "hourly"
+            }, Tariff
+        )
+        return tariff
+
+    def test_metadata(self, path):
+        metadata = read_metadata(path)
+        assert metadata['tz_offset'] == TZ_OFFSET
+        assert metadata['reading_types']['/UsagePoint/01/MeterReading/01']['flowDirection'] == 19
+
+    @pytest.mark.parametrize('timezone, tz_offset, dst_start_rule, dst_end_rule', [
+        # The second Sunday of March to the first Sunday of November at 2:00
+        ('America/New_York', -18000, '360E2000', 'B40E2000'),
+        # The first Sunday of October at 2:00 to the first Sunday of April at 3:00
+        ('Australia/Sydney', 36000, 'A40E2000', '440E3000'),
+    ])
+    def test_daylight_saving_time(self, tmpdir, timezone, tz_offset, dst_start_rule, dst_end_rule):
+        starts = pandas.date_range('2017-12-31', '2019-01-02', freq='H')
+        interval_readings = ''.join(
+            '<IntervalReading><timePeriod><duration>3600</duration><start>%d</start></timePeriod>'
+            '<value>1000</value></IntervalReading>' % start for start in starts.astype('int64') // 10 ** 9)
+        path = str(tmpdir.join('dst.xml'))
+        with open(path, 'w') as f:
+            f.write('<?xml version="1.0" encoding="UTF-8"?><feed xmlns="http://www.w3.org/2005/Atom">%s%s</feed>' % (
+                ENTRY % ('/LocalTimeParameters/01', '',
+                         '<LocalTimeParameters xmlns="http://naesb.org/espi"><dstEndRule>%s</dstEndRule>'
+                         '<dstOffset>3600</dstOffset><dstStartRule>%s</dstStartRule><tzOffset>%d</tzOffset>'
+                         '</LocalTimeParameters>' % (dst_end_rule, dst_start_rule, tz_offset)),
+                ENTRY % ('/UsagePoint/01/MeterReading/01/IntervalBlock/01', '',
+                         '<IntervalBlock xmlns="http://naesb.org/espi">%s</IntervalBlock>' % interval_readings)))
+        expected = starts.tz_localize('UTC').tz_convert(timezone).tz_localize(None).sort_values()
+        for metadata in (read_metadata(path), None):
+            readings = pandas.concat(series for _, series in iter_interval_readings(path, metadata))
+            assert readings.index.equals(expected)
+
+    def test_iter_meter_data(self, path, meter_data):
+        chunks = list(iter_meter_data(path, chunk_size=500))
+        assert max(len(chunk) for chunk in chunks) <= 1000
+        pandas.testing.assert_frame_equal(pandas.concat(chunks), meter_data, check_freq=False)
+
+    def test_single_pass(self, path, meter_data):
+        # Without a metadata pass reading types declared after their interval blocks fall back to the defaults
+        registers = set(register for register, _ in iter_interval_readings(path))
+        assert registers == {'electricity_imported'}
+        readings = pandas.concat(
+            series for _, series in iter_interval_readings(path, read_metadata(path), 'electricity_exported'))
+        pandas.testing.assert_series_equal(readings, meter_data['electricity_exported'], check_names=False,
+                                           check_freq=False)
+
+    def test_accumulate(self, path, meter_data, tariff):
+        accumulator = accumulate(tariff, path, chunk_size=700)
+        assert accumulator.total() == pytest.approx(tariff.apply(meter_data))
+
+    def test_bounded_memory(self, tmpdir):
+        # The readings of a single interval block are released as they are parsed
+        peaks = []
+        for days in (20, 160):
+            index = pandas.date_range('2018-01-01', periods=96 * days, freq='15min')
+            meter_data = pandas.DataFrame({'electricity_imported': 0.1, 'electricity_exported': 0.0}, index=index)
+            path = str(tmpdir.join('%d.xml' % days))
+            with open(path, 'w') as f:
+                f.write(green_button(meter_data, blocks='365D'))
+            metadata = read_metadata(path)
+            tracemalloc.start()
+            try:
+                assert sum(len(series) for _, series in iter_interval_readings(path, metadata, chunk_size=500)) == \
+                    len(meter_data) * 2
+                peaks.append(tracemalloc.get_traced_memory()[1])
+            finally:
+                tracemalloc.stop()
+        assert peaks[1] < peaks[0] * 2
@@ -0,0 +1,90 @@
+from tariffs.instrumentation import Profiler, active
+from tariffs.meter import MeterData
+from tariffs.tariff import Tariff
+import pytest
+from odin.codecs import dict_codec
+import json
+import pandas
+import datetime
+
+
+parser = lambda t: datetime.datetime.strptime(t, '%d/%m/%Y %H:%M')
+
+
+class TestInstrumentation(object):
+
+    @pytest.fixture
+    def meter_data(self):
+        with open('./fixtures/test_load_data.csv') as f:
+            meter_data = pandas.read_csv(f, index_col='datetime', parse_dates=True, infer_datetime_format=True,
+                                         date_parser=parser)
+        return meter_data
+
+    @pytest.fixture
+    def tariff(self):
+        tariff = dict_codec.load(
+            {
+                "charges": [
+                    {
+                        "code": "P",
+                        "rate": 0.4,
+                        "time": {"name": "peak", "periods": [{"from_weekday": 0, "to_weekday": 4,
+                                                              "from_hour": 14, "to_hour": 19}]}
+                    },
+                    {
+                        "code": "S",
+                        "rate": 0.1,
+                        "season": {"name": "summer", "from_month": 1, "from_day": 1, "to_month": 3, "to_day": 31}
+                    },
+                    {
+                        "code": "D",
+                        "rate": 8.0,
+                        "type": "demand"
+                    }
+                ],
+                "service": "electricity",
+                "billing_period": "monthly",
+                "demand_window": "hourly"
+            }, Tariff
+        )
+        return tariff
+
+    def test_phases(self, tariff, meter_data):
+        with Profiler() as profiler:
+            tariff.apply(meter_data, end=datetime.datetime(2018, 6, 30, 23, 45))
+        assert active() is None
+
+        phases = profiler.to_frame()
+        assert phases['phase'].tolist() == ['truncate', 'charges', 'charges', 'resample', 'format']
+        truncate = profiler.phases[0]
+        assert (truncate['rows'], truncate['rows_out']) == (35040, 181 * 96)
+        resamples = phases[phases['phase'] == 'resample']
+        assert resamples[['rule', 'how', 'rows', 'rows_out']].values.tolist() == [
+            ['H', 'mean', 181 * 96, 181 * 24]]
+        # Resampling is nested within the demand charge pass
+        assert resamples['depth'].tolist() == [1]
+        assert (phases['elapsed'] >= 0).all()
+
+        matched = dict((record['charge'], (record['intervals'], record['matched'])) for record in profiler.counts
+                       if record['count'] == 'matched')
+        assert matched['Pelectricityconsumptionpeak'] == (181 * 96, 26 * 5 * 24)
+        assert matched['Selectricityconsumptionsummer'] == (181 * 96, 90 * 96)
+        assert matched['Delectricitydemand'] == (181 * 24, 181 * 24)
+
+        report = json.loads(json.dumps(profiler.report()))
+        assert set(report['totals']) == {'truncate', 'charges', 'resample', 'format'}
+
+    def test_cached_resampling(self, tariff, meter_data):
+        meter_data = MeterData(meter_data)
+        tariff.apply(meter_data)
+        records = []
+        with Profiler(callback=records.append):
+            tariff.apply(meter_data)
+        assert [record['phase'] for record in records if 'phase' in record] == ['truncate', 'charges', 'charges',
+                                                                                  'format']
+        assert [record['rule'] for record in records if record.get('count') == 'resample_cached'] == ['H']
+
+    def test_disabled(self, tariff, meter_data):
+        profiler = Profiler()
+        tariff.apply(meter_data)
+        assert profiler.phases == [] and profiler.counts == []
@@ -0,0 +1,75 @@
+from tariffs.library import TariffLibrary
+from tariffs.tariff import Spec, Tariff
+import pytest
+from odin.codecs import dict_codec, json_codec
+import io
+
+
+def tariff_data(code, utility_code, sector='residential', service='electricity', charges=None, **fields):
+    data = {
+        "code": code,
+        "utility_code": utility_code,
+        "service": service,
+        "sector": sector,
+        "currency": "AUD",
+        "charges": charges or [{"rate": 0.25}],
+    }
+    data.update(fields)
+    return data
+
+
+TOU_CHARGES = [
+    {"rate": 0.4, "time": {"name": "peak", "periods": [{"from_weekday": 0, "to_weekday": 4, "from_hour": 14,
+                                                         "to_hour": 19}]}},
+    {"rate": 0.1, "time": {"name": "off_peak", "periods": [{"to_hour": 13}, {"from_hour": 20}]}}
+]
+
+
+class TestTariffLibrary(object):
+
+    @pytest.fixture
+    def library(self):
+        return TariffLibrary.from_data({"tariffs": [
+            tariff_data('A1', 'X'),
+            tariff_data('A2', 'X', charges=TOU_CHARGES, max_consumption=10000),
+            tariff_data('A3', 'X', charges=TOU_CHARGES, min_consumption=10000, max_consumption=40000),
+            tariff_data('A4', 'X', sector='commercial', charges=TOU_CHARGES + [{"rate": 8.0, "type": "demand"}],
+                        min_demand=50),
+            tariff_data('B1', 'Y', charges=TOU_CHARGES),
+            tariff_data('B2', 'Y', service='gas'),
+        ]}, cache_size=2)
+
+    def test_select(self, library):
+        assert library.select(utility_code='X', sector='residential', service='electricity', charge_types=['tou'],
+                              consumption=12000).tolist() == [2]
+        assert library.select(charge_types='tou').tolist() == [1, 2, 3, 4]
+        assert library.select(utility_code=['X', 'Y'], service='gas').tolist() == [5]
+        assert library.select(charge_types=['demand'], demand=20).tolist() == []
+        assert library.select(charge_types=['demand'], demand=60).tolist() == [3]
+        assert library.select(utility_code='Z').tolist() == []
+        assert sorted(library.values('utility_code')) == ['X', 'Y']
+        with pytest.raises(UserWarning):
+            library.select(name='A1')
+
+    def test_lazy_decoding(self, library, monkeypatch):
+        decoded = []
+        load = dict_codec.load
+        monkeypatch.setattr(dict_codec, 'load', lambda *args: decoded.append(args) or load(*args))
+        assert [tariff.code for tariff in library.find(utility_code='Y')] == ['B1', 'B2']
+        assert len(decoded) == 2
+        # Decoded tariffs are cached up to the cache size
+        library[5]
+        assert len(decoded) == 2
+        library[0]
+        library[4]
+        assert len(decoded) == 4
+
+    def test_matches_spec(self, library):
+        tariffs = [library.raw(position) for position in range(len(library))]
+        spec = dict_codec.load({"tariffs": tariffs}, Spec)
+        loaded = TariffLibrary.load(io.StringIO(json_codec.dumps(spec)))
+        assert len(loaded) == len(spec.tariffs)
+        for tariff, expected in zip(loaded, spec.tariffs):
+            assert isinstance(tariff, Tariff)
+            assert dict_codec.dump(tariff) == dict_codec.dump(expected)
+        assert sorted(loaded.select(charge_types='tou')) == [1, 2, 3, 4]
@@ -0,0 +1,76 @@
+from tariffs.loaders import find_gaps, read_cache, read_meter_data
+import pytest
+import numpy
+import pandas
+import datetime
+import warnings
+
+
+parser = lambda t: datetime.datetime.strptime(t, '%d/%m/%Y %H:%M')
+
+
+class TestLoaders(object):
+
+    @pytest.fixture
+    def meter_data(self):
+        with open('./fixtures/test_load_data.csv') as f:
+            meter_data = pandas.read_csv(f, index_col='datetime', parse_dates=True, infer_datetime_format=True,
+                                         date_parser=parser)
+        return meter_data
+
+    @pytest.fixture
+    def gappy_csv(self, tmpdir):
+        path = str(tmpdir.join('gappy.csv'))
+        with open('./fixtures/test_load_data.csv') as f:
+            lines = f.readlines()
+        # Drop 4 intervals on the 2nd of January and 1 on the 3rd of January
+        with open(path, 'w') as f:
+            f.writelines(lines[:97] + lines[101:193] + lines[194:300])
+        return path
+
+    def test_matches_per_row_parser(self, meter_data):
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            loaded_meter_data = read_meter_data('./fixtures/test_load_data.csv')
+        pandas.testing.assert_frame_equal(loaded_meter_data, meter_data.astype(float), check_freq=False)
+        assert len(loaded_meter_data.attrs['gaps']) == 0
+
+    def test_float32(self):
+        meter_data = read_meter_data('./fixtures/test_load_data.csv', dtype=numpy.float32)
+        assert meter_data.dtypes.eq(numpy.float32).all()
+
+    def test_gaps(self, gappy_csv):
+        with pytest.warns(UserWarning):
+            meter_data = read_meter_data(gappy_csv)
+        gaps = meter_data.attrs['gaps']
+        assert gaps['missing'].tolist() == [4, 1]
+        assert gaps['start'].iloc[0] == pandas.Timestamp('2018-01-01 23:45')
+        pandas.testing.assert_frame_equal(find_gaps(meter_data.index, '15min'), gaps)
+        with pytest.raises(UserWarning):
+            read_meter_data(gappy_csv, on_gap='raise')
+
+    def test_npy_cache(self, tmpdir, meter_data):
+        cache = str(tmpdir.join('cache'))
+        parsed_meter_data = read_meter_data('./fixtures/test_load_data.csv', cache=cache)
+        cached_meter_data = read_cache(cache, source='./fixtures/test_load_data.csv')
+        # The register values are a view of the memory-mapped cache file
+        base = cached_meter_data.values
+        while base is not None and not isinstance(base, numpy.memmap):
+            base = base.base
+        assert base is not None
+        pandas.testing.assert_frame_equal(cached_meter_data, parsed_meter_data, check_freq=False)
+        pandas.testing.assert_frame_equal(read_meter_data('./fixtures/test_load_data.csv', cache=cache),
+                                          parsed_meter_data, check_freq=False)
+
+    def test_stale_cache(self, tmpdir, gappy_csv):
+        cache = str(tmpdir.join('cache'))
+        read_meter_data(gappy_csv, cache=cache, on_gap='ignore')
+        with open(gappy_csv, 'a') as f:
+            f.write('4/01/2018 3:00,1,1\n')
+        assert read_cache(cache, source=gappy_csv) is None
+
+    def test_feather_cache(self, tmpdir):
+        pytest.importorskip('pyarrow')
+        cache = str(tmpdir.join('cache'))
+        parsed_meter_data = read_meter_data('./fixtures/test_load_data.csv', cache=cache, cache_format='feather')
+        pandas.testing.assert_frame_equal(read_cache(cache), parsed_meter_data, check_freq=False)
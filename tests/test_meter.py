@@ -0,0 +1,104 @@
+from tariffs import Profiler
+from tariffs.meter import MeterData
+from tariffs.tariff import Tariff
+import pytest
+from odin.codecs import dict_codec
+import pandas
+import datetime
+
+
+parser = lambda t: datetime.datetime.strptime(t, '%d/%m/%Y %H:%M')
+
+
+def resamplings(profiler):
+    return [(record['rule'], record['how']) for record in profiler.phases if record['phase'] == 'resample']
+
+
+class TestMeterData(object):
+
+    @pytest.fixture
+    def meter_data(self):
+        with open('./fixtures/test_load_data.csv') as f:
+            meter_data = pandas.read_csv(f, index_col='datetime', parse_dates=True, infer_datetime_format=True,
+                                         date_parser=parser)
+        return meter_data
+
+    @pytest.fixture
+    def tariff(self):
+        tariff = dict_codec.load(
+            {
+                "charges": [
+                    {
+                        "code": "W",
+                        "rate": 0.2,
+                        "season": {"name": "winter", "from_month": 6, "from_day": 1, "to_month": 8, "to_day": 31}
+                    },
+                    {
+                        "code": "D",
+                        "rate": 10.0,
+                        "type": "demand"
+                    }
+                ],
+                "service": "electricity",
+                "billing_period": "monthly",
+                "demand_window": "30min"
+            }, Tariff
+        )
+        return tariff
+
+    def test_repeated_calculations(self, tariff, meter_data):
+        expected = tariff.apply(meter_data.copy())
+        with Profiler() as profiler:
+            assert tariff.apply(meter_data) == pytest.approx(expected)
+            assert tariff.apply(meter_data) == pytest.approx(expected)
+        # The DataFrame is only resampled by the first calculation
+        assert resamplings(profiler) == [('D', 'sum'), ('30min', 'mean')]
+        assert set((record['rule'], record['how']) for record in profiler.counts
+                   if record['count'] == 'resample_cached') == {('D', 'sum'), ('30min', 'mean')}
+
+    def test_repeated_truncations(self, tariff, meter_data):
+        end = datetime.datetime(2018, 6, 30, 23, 45)
+        with Profiler() as profiler:
+            first = tariff.apply(meter_data, end=end)
+            assert tariff.apply(meter_data, end=end) == pytest.approx(first)
+        assert len(resamplings(profiler)) == 2
+
+    def test_modified_meter_data(self, tariff, meter_data):
+        tariff.apply(meter_data)
+        meter_data.iloc[1000, 0] += 100.0
+        with Profiler() as profiler:
+            assert tariff.apply(meter_data) == pytest.approx(tariff.apply(meter_data.copy()))
+        assert [record['count'] for record in profiler.counts].count('meter_data_changed') == 1
+        assert len(resamplings(profiler)) == 4
+
+    def test_modified_meter_data_wrapper(self, tariff, meter_data):
+        wrapped = MeterData(meter_data)
+        tariff.apply(wrapped)
+        meter_data.iloc[1000, 0] += 100.0
+        assert tariff.apply(wrapped) == pytest.approx(tariff.apply(meter_data.copy()))
+
+    def test_invalidate(self, meter_data):
+        wrapped = MeterData(meter_data)
+        daily = wrapped.resample(('D', 'sum'))
+        assert wrapped.resample(('D', 'sum')) is daily
+        wrapped.invalidate()
+        assert wrapped.resample(('D', 'sum')) is not daily
+        assert wrapped.resample() is meter_data
+
+    def test_bounded_cache(self, meter_data):
+        wrapped = MeterData(meter_data, cache_size=2)
+        for rule in ('D', 'W', 'MS'):
+            wrapped.resample((rule, 'sum'))
+            wrapped.features((rule, 'sum'))
+        assert [key for key in wrapped._frames if key] == [(('W', 'sum'),), (('MS', 'sum'),)]
+        assert list(wrapped._features) == [('W',), ('MS',)]
+        # Recently used frames are kept
+        wrapped.resample(('W', 'sum'))
+        wrapped.resample(('D', 'sum'))
+        assert [key for key in wrapped._frames if key] == [(('W', 'sum'),), (('D', 'sum'),)]
+
+    def test_copies_are_not_shared(self, meter_data):
+        attached = MeterData.coerce(meter_data)
+        assert MeterData.coerce(meter_data) is attached
+        assert MeterData.coerce(meter_data.copy(deep=False)) is not attached
+        assert MeterData.coerce(meter_data * 2.0) is not attached
@@ -0,0 +1,56 @@
+from tariffs import apply_fleet
+from tariffs.parallel import ParallelRunner
+from tariffs.tariff import Tariff
+import pytest
+from odin.codecs import dict_codec
+import pandas
+import datetime
+
+
+parser = lambda t: datetime.datetime.strptime(t, '%d/%m/%Y %H:%M')
+
+
+class TestParallelRunner(object):
+
+    @pytest.fixture
+    def customers(self):
+        with open('./fixtures/test_load_data.csv') as f:
+            meter_data = pandas.read_csv(f, index_col='datetime', parse_dates=True, infer_datetime_format=True,
+                                         date_parser=parser)
+        meter_data = meter_data.truncate(after=datetime.datetime(2018, 2, 28, 23, 59))
+        return dict(('customer-%d' % i, meter_data * (i + 1)) for i in range(5))
+
+    @pytest.fixture
+    def tariffs(self):
+        flat = {
+            "code": "flat",
+            "charges": [{"rate": 0.25}, {"rate": -0.1, "meter": "electricity_exported"}],
+            "service": "electricity"
+        }
+        demand = {
+            "code": "demand",
+            "charges": [{"rate_bands": [{"limit": 2000, "rate": 0.2}, {"rate": 0.1}]},
+                        {"rate": 10.0, "type": "demand"}],
+            "service": "electricity"
+        }
+        return [dict_codec.load(tariff, Tariff) for tariff in (flat, demand)]
+
+    def test_run_matches_apply(self, tariffs, customers):
+        totals = ParallelRunner(tariffs, workers=1, chunk_size=2).run(customers)
+        assert totals.index.tolist() == sorted(customers)
+        assert totals.columns.tolist() == ['flat', 'demand']
+        for customer, meter_data in customers.items():
+            for tariff in tariffs:
+                assert totals.loc[customer, tariff.code] == pytest.approx(tariff.apply(meter_data))
+
+    def test_deterministic_across_worker_counts(self, tariffs, customers):
+        expected_totals = ParallelRunner(tariffs, workers=1, chunk_size=2).run(customers)
+        actual_totals = ParallelRunner(tariffs, workers=3, chunk_size=2).run(customers)
+        pandas.testing.assert_frame_equal(actual_totals, expected_totals)
+
+    def test_imap_streams_chunks(self, tariffs, customers):
+        chunks = list(ParallelRunner(tariffs, workers=2, chunk_size=2).imap(customers))
+        assert sorted(len(chunk) for chunk in chunks) == [1, 2, 2]
+        fleet_data = pandas.concat(customers, axis=1)
+        pandas.testing.assert_series_equal(pandas.concat(chunks)['demand'].sort_index(),
+                                           apply_fleet(tariffs[1], fleet_data), check_names=False)
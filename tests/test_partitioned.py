@@ -0,0 +1,105 @@
+from tariffs.instrumentation import Profiler
+from tariffs.partitioned import PartitionedRunner, long_fleet_frame, parquet_partitions
+from tariffs.tariff import Tariff
+import pytest
+from odin.codecs import dict_codec
+import numpy
+import pandas
+import datetime
+
+
+parser = lambda t: datetime.datetime.strptime(t, '%d/%m/%Y %H:%M')
+
+pytest.importorskip('pyarrow')
+
+
+class TestPartitionedRunner(object):
+
+    @pytest.fixture
+    def customers(self):
+        with open('./fixtures/test_load_data.csv') as f:
+            meter_data = pandas.read_csv(f, index_col='datetime', parse_dates=True, infer_datetime_format=True,
+                                         date_parser=parser)
+        hours = meter_data.index.hour.to_numpy()
+        meter_data['electricity_imported'] = 0.2 + 0.3 * (hours >= 17)
+        return {'A': meter_data, 'B': meter_data * 2.0, 'C': meter_data * 0.5}
+
+    @pytest.fixture
+    def tariff(self):
+        return dict_codec.load(
+            {
+                "charges": [
+                    {"code": "P", "rate": 0.5, "time": {"name": "peak", "periods": [{"from_hour": 17}]}},
+                    {"code": "B", "rate_bands": [{"limit": 500, "rate": 0.2}, {"rate": 0.1}]},
+                    {"code": "D", "rate": 10.0, "type": "demand"}
+                ],
+                "service": "electricity",
+                "demand_window": "30min"
+            }, Tariff
+        )
+
+    @pytest.fixture
+    def paths(self, customers, tmpdir):
+        import pyarrow
+        import pyarrow.parquet
+        paths = []
+        for group in (['A', 'B'], ['C']):
+            frame = pandas.concat(dict((meter, customers[meter]) for meter in group), names=['meter', 'datetime'])
+            # Time-major rows, so that each row group is a time range ending within a billing period
+            frame = frame.reset_index().sort_values(['datetime', 'meter'], kind='mergesort')
+            path = str(tmpdir.join('%s.parquet' % ''.join(group)))
+            pyarrow.parquet.write_table(pyarrow.Table.from_pandas(frame, preserve_index=False), path,
+                                        row_group_size=5000 * len(group))
+            paths.append(path)
+        return paths
+
+    def test_matches_apply(self, tariff, customers, paths, tmpdir):
+        runner = PartitionedRunner(tariff, str(tmpdir.join('bills')))
+        with Profiler() as profiler:
+            assert runner.run(parquet_partitions(paths)) == 16
+        assert [record['meters'] for record in profiler.counts if record['count'] == 'partition'] == [2] * 8 + [1] * 8
+
+        results = runner.results().set_index(['meter', 'period']).sort_index()
+        assert results.columns.tolist() == ['Pelectricityconsumptionpeak', 'Belectricityconsumption',
+                                            'Delectricitydemand', 'total']
+        for meter, meter_data in customers.items():
+            expected = tariff.apply(meter_data, output_format='billing-period-components')
+            actual = results.loc[meter]
+            assert actual.index.equals(expected.index)
+            numpy.testing.assert_allclose(actual[expected.columns].to_numpy(), expected.to_numpy())
+            assert actual['total'].sum() == pytest.approx(tariff.apply(meter_data))
+
+    def test_resume(self, tariff, paths, tmpdir):
+        expected = PartitionedRunner(tariff, str(tmpdir.join('expected')))
+        expected.run(parquet_partitions(paths))
+        loaded = []
+
+        def partitions(interrupt=None):
+            for position, (key, load) in enumerate(parquet_partitions(paths)):
+                if position == interrupt:
+                    raise KeyboardInterrupt()
+                yield key, lambda load=load, key=key: loaded.append(key) or load()
+
+        runner = PartitionedRunner(tariff, str(tmpdir.join('bills')))
+        with pytest.raises(KeyboardInterrupt):
+            runner.run(partitions(interrupt=11))
+        assert runner.run(partitions()) == 5
+        # Completed partitions aren't loaded again
+        assert len(loaded) == 16
+        pandas.testing.assert_frame_equal(runner.results(), expected.results())
+        # A finished run has nothing left to bill
+        assert runner.run(partitions()) == 0
+        assert runner.run(partitions(), resume=False) == 16
+        pandas.testing.assert_frame_equal(runner.results(), expected.results())
+
+    def test_changed_partitions(self, tariff, paths, tmpdir):
+        runner = PartitionedRunner(tariff, str(tmpdir.join('bills')))
+        runner.run(list(parquet_partitions(paths))[:3])
+        with pytest.raises(UserWarning):
+            runner.run(parquet_partitions(paths[::-1]))
+
+    def test_long_fleet_frame(self, customers):
+        frame = pandas.concat(customers, names=['meter', 'datetime']).reset_index()
+        fleet_data = long_fleet_frame(frame.sample(frac=1.0, random_state=0))
+        assert fleet_data.columns.names == ['meter', 'register']
+        pandas.testing.assert_frame_equal(fleet_data['B'], customers['B'], check_names=False)
@@ -0,0 +1,92 @@
+from tariffs.tariff import Tariff
+from tariffs.plan import BillingPlan, CalendarFeatures, DAYS_PER_YEAR, MINUTES_PER_WEEK, block_costs, grouped_cumsum
+import pytest
+from odin.codecs import dict_codec
+import numpy
+import pandas
+
+
+class TestBillingPlan(object):
+
+    @pytest.fixture
+    def tou_tariff(self):
+        tou_tariff = dict_codec.load(
+            {
+                "charges": [
+                    {
+                        "code": "P",
+                        "rate": 2.0,
+                        "season": {
+                            "name": "summer",
+                            "from_month": 12,
+                            "from_day": 1,
+                            "to_month": 12,
+                            "to_day": 31
+                        },
+                        "time": {
+                            "name": "peak",
+                            "periods": [
+                                {
+                                    "from_weekday": 0,
+                                    "to_weekday": 4,
+                                    "from_hour": 14,
+                                    "to_hour": 19
+                                }
+                            ]
+                        }
+                    }
+                ],
+                "service": "electricity",
+                "billing_period": "monthly"
+            }, Tariff
+        )
+        return tou_tariff
+
+    def test_lookup_tables(self, tou_tariff):
+        plan = tou_tariff.compile()
+        charge = plan.charges[0]
+        assert plan.components == ('Pelectricityconsumptionsummerpeak',)
+        assert charge.time_table.shape == (MINUTES_PER_WEEK,)
+        assert charge.season_table.shape == (DAYS_PER_YEAR,)
+        # Monday 14:00 to 19:59, December only
+        assert charge.time_table[14 * 60] and charge.time_table[19 * 60 + 59]
+        assert not charge.time_table[20 * 60] and not charge.time_table[5 * 1440 + 14 * 60]
+        assert charge.season_table[-31:].all() and not charge.season_table[:-31].any()
+
+    def test_calendar_features(self):
+        features = CalendarFeatures(pandas.DatetimeIndex(['2018-01-01 00:00', '2018-12-31 23:59', '2020-03-01']))
+        assert features.minute_of_week.tolist() == [0, 1439, 6 * 1440]
+        assert features.day_of_year.tolist() == [0, 365, 60]
+
+    def test_plan_is_immutable(self, tou_tariff):
+        plan = tou_tariff.compile()
+        with pytest.raises(AttributeError):
+            plan.billing_period = 'quarterly'
+        with pytest.raises(ValueError):
+            plan.charges[0].time_table[0] = True
+
+    def test_plan_is_cached(self, tou_tariff):
+        assert tou_tariff.compile() is tou_tariff.compile()
+        assert isinstance(tou_tariff.compile(), BillingPlan)
+
+    def test_plan_is_invalidated_on_mutation(self, tou_tariff):
+        plan = tou_tariff.compile()
+        tou_tariff.charges[0].time.periods[0].to_hour = 20
+        recompiled_plan = tou_tariff.compile()
+        assert recompiled_plan is not plan
+        assert recompiled_plan.charges[0].time_table[20 * 60]
+
+        tou_tariff.billing_period = 'quarterly'
+        assert tou_tariff.compile().billing_period == 'quarterly'
+
+    def test_grouped_cumsum(self):
+        cumulative = grouped_cumsum(numpy.array([1.0, 2.0, 3.0, 4.0, 5.0]), numpy.array([0, 0, 1, 1, 2]))
+        assert cumulative.tolist() == [1.0, 3.0, 3.0, 7.0, 5.0]
+
+    def test_block_costs_span_rate_bands(self):
+        values = numpy.array([4.0, 4.0, 4.0, 4.0])
+        mask = numpy.array([True, True, True, True])
+        cycles = numpy.array([0, 0, 0, 1])
+        costs = block_costs(values, mask, cycles, numpy.array([10.0, 1e9]), numpy.array([1.0, 0.5]))
+        # The third interval straddles the 10 kWh limit, the fourth starts a new billing cycle
+        assert costs.tolist() == [4.0, 4.0, 2.0 + 1.0, 4.0]
@@ -0,0 +1,79 @@
+from tariffs import apply_many
+from tariffs.meter import MeterData
+from tariffs.tariff import Tariff
+import pytest
+from odin.codecs import dict_codec
+import pandas
+import datetime
+
+
+parser = lambda t: datetime.datetime.strptime(t, '%d/%m/%Y %H:%M')
+
+
+class TestApplyMany(object):
+
+    @pytest.fixture
+    def meter_data(self):
+        with open('./fixtures/test_load_data.csv') as f:
+            meter_data = pandas.read_csv(f, index_col='datetime', parse_dates=True, infer_datetime_format=True,
+                                         date_parser=parser)
+        return meter_data
+
+    @pytest.fixture
+    def tariffs(self):
+        flat = {
+            "code": "flat",
+            "charges": [{"code": "A", "rate": 0.25}],
+            "service": "electricity"
+        }
+        tou = {
+            "code": "tou",
+            "charges": [
+                {"code": "P", "rate": 0.5, "time": {"name": "peak", "periods": [{"from_hour": 14, "to_hour": 19}]}},
+                {"code": "O", "rate": 0.1, "time": {"name": "off-peak", "periods": [{"to_hour": 13},
+                                                                                    {"from_hour": 20}]}}
+            ],
+            "service": "electricity"
+        }
+        demand = {
+            "code": "demand",
+            "charges": [{"code": "A", "rate": 0.2}, {"code": "D", "rate": 10.0, "type": "demand"}],
+            "service": "electricity",
+            "demand_window": "30min"
+        }
+        quarterly_block = {
+            "code": "block",
+            "charges": [{"code": "B", "rate_bands": [{"limit": 1000, "rate": 0.3}, {"rate": 0.2}]}],
+            "service": "electricity",
+            "billing_period": "quarterly"
+        }
+        return [dict_codec.load(tariff, Tariff) for tariff in (flat, tou, demand, quarterly_block)]
+
+    def test_totals_match_apply(self, tariffs, meter_data):
+        output = apply_many(tariffs, meter_data)
+        assert output.index.tolist() == ['flat', 'tou', 'demand', 'block']
+        assert output.columns.tolist() == ['total']
+        for tariff in tariffs:
+            assert output.loc[tariff.code, 'total'] == pytest.approx(tariff.apply(meter_data))
+
+    def test_components(self, tariffs, meter_data):
+        output = apply_many(tariffs, meter_data, output_format='total-components')
+        assert output.columns[-1] == 'total'
+        assert output.loc['demand', 'Delectricitydemand'] == pytest.approx(12 * 10.0)
+        assert output.loc['flat', 'Delectricitydemand'] == 0.0
+        pandas.testing.assert_series_equal(output.drop(columns='total').sum(1), output['total'], check_names=False)
+
+    def test_resampling_is_shared(self, tariffs, meter_data):
+        meter_data = MeterData(meter_data)
+        apply_many(tariffs + tariffs, meter_data)
+        # The input timestep, monthly and quarterly consumption and half-hourly demand
+        assert len(meter_data._frames) == 4
+
+    def test_truncation(self, tariffs, meter_data):
+        output = apply_many(tariffs[:1], meter_data, start=datetime.datetime(2018, 2, 1),
+                            end=datetime.datetime(2018, 2, 28, 23, 59))
+        assert output.loc['flat', 'total'] == pytest.approx(28 * 96 * 0.25)
+
+    def test_unsupported_output_format(self, tariffs, meter_data):
+        with pytest.raises(UserWarning):
+            apply_many(tariffs, meter_data, output_format='input-timestep')
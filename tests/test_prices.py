@@ -0,0 +1,127 @@
+from tariffs import marginal_prices
+from tariffs.tariff import Tariff
+import pytest
+from odin.codecs import dict_codec
+import pandas
+import datetime
+
+
+parser = lambda t: datetime.datetime.strptime(t, '%d/%m/%Y %H:%M')
+
+
+class TestMarginalPrices(object):
+
+    @pytest.fixture
+    def meter_data(self):
+        with open('./fixtures/test_load_data.csv') as f:
+            meter_data = pandas.read_csv(f, index_col='datetime', parse_dates=True, infer_datetime_format=True,
+                                         date_parser=parser)
+        # A load varying by time of day and season
+        hours = meter_data.index.hour.to_numpy()
+        months = meter_data.index.month.to_numpy()
+        meter_data['electricity_imported'] = 0.2 + 0.3 * (hours >= 17) + 0.1 * (months <= 3)
+        return meter_data
+
+    @pytest.fixture
+    def tariff(self):
+        tariff = dict_codec.load(
+            {
+                "charges": [
+                    {
+                        "code": "P",
+                        "rate_bands": [{"limit": 230, "rate": 0.4}, {"rate": 0.3}],
+                        "time": {"name": "peak", "periods": [{"from_weekday": 0, "to_weekday": 4,
+                                                              "from_hour": 14, "to_hour": 19}]}
+                    },
+                    {
+                        "code": "W",
+                        "rate": 0.1,
+                        "season": {"name": "winter", "from_month": 6, "from_day": 1, "to_month": 8, "to_day": 31}
+                    },
+                    {
+                        "code": "F",
+                        "rate": 0.05
+                    },
+                    {
+                        "code": "E",
+                        "rate": -0.08,
+                        "meter": "electricity_exported"
+                    },
+                    {
+                        "code": "D",
+                        "rate_bands": [{"limit": 0.55, "rate": 10.0}, {"rate": 20.0}],
+                        "type": "demand"
+                    }
+                ],
+                "service": "electricity",
+                "billing_period": "monthly",
+                "demand_window": "30min"
+            }, Tariff
+        )
+        return tariff
+
+    def consumption_tariff(self, tariff):
+        return dict_codec.load(dict(dict_codec.dump(tariff), charges=[
+            dict_codec.dump(charge) for charge in tariff.charges if charge.type != 'demand']), Tariff)
+
+    @pytest.mark.parametrize('timestamp', ['2018-01-02 15:00', '2018-03-05 09:00', '2018-07-10 16:00',
+                                           '2018-07-14 03:00', '2018-12-31 23:45'])
+    def test_prices_match_bill_changes(self, tariff, meter_data, timestamp):
+        tariff = self.consumption_tariff(tariff)
+        intervals, _ = marginal_prices(tariff, meter_data)
+        bill = tariff.apply(meter_data)
+        for register in ('electricity_imported', 'electricity_exported'):
+            perturbed = meter_data.copy()
+            perturbed.loc[timestamp, register] += 0.01
+            assert (tariff.apply(perturbed) - bill) / 0.01 == pytest.approx(intervals.loc[timestamp, register])
+
+    def test_prices(self, tariff, meter_data):
+        intervals, _ = marginal_prices(tariff, meter_data)
+        assert intervals.index.equals(meter_data.index)
+        assert intervals.columns.tolist() == ['electricity_imported', 'electricity_exported']
+        assert (intervals['electricity_exported'] == -0.08).all()
+        imported = intervals['electricity_imported']
+        # January's peak usage reaches the second band, February's doesn't
+        assert imported['2018-01-02 15:00'] == pytest.approx(0.3 + 0.05)
+        assert imported['2018-02-06 15:00'] == pytest.approx(0.4 + 0.05)
+        assert imported['2018-07-10 16:00'] == pytest.approx(0.4 + 0.1 + 0.05)
+        assert imported['2018-07-14 16:00'] == pytest.approx(0.1 + 0.05)
+
+    def test_scheduled_prices(self, meter_data):
+        tariff = dict_codec.load({"charges": [{"code": "S", "rate_schedule": [
+            {"datetime": "2018-01-01T00:00:00", "rate": 0.2}, {"datetime": "2018-01-01T12:00:00", "rate": 0.5},
+            {"datetime": "2018-01-02T00:00:00", "rate": 0.1}]}], "service": "electricity"}, Tariff)
+        intervals, demand = marginal_prices(tariff, meter_data, end=datetime.datetime(2018, 1, 31, 23, 45))
+        assert len(demand) == 0
+        bill = tariff.apply(meter_data, end=datetime.datetime(2018, 1, 31, 23, 45))
+        perturbed = meter_data.copy()
+        perturbed.loc['2018-01-01 13:00', 'electricity_imported'] += 1.0
+        assert tariff.apply(perturbed, end=datetime.datetime(2018, 1, 31, 23, 45)) - bill == pytest.approx(
+            intervals.loc['2018-01-01 13:00', 'electricity_imported'])
+
+    def test_demand_shadow_prices(self, tariff, meter_data):
+        _, demand = marginal_prices(tariff, meter_data)
+        demand = demand.loc['Delectricitydemand']
+        assert demand.columns.tolist() == ['peak', 'peak_timestamp', 'ratcheted', 'shadow_price']
+        # Peaks of 0.6 in January to March reach the second band, peaks of 0.5 otherwise don't
+        assert demand['shadow_price'].tolist() == [20.0] * 3 + [10.0] * 9
+        peaks = tariff.demand_peaks(meter_data).loc['Delectricitydemand']
+        pandas.testing.assert_series_equal(demand['peak'], peaks['peak'])
+
+    def test_ratcheted_shadow_prices(self, meter_data):
+        tariff = dict_codec.load({"charges": [{"code": "D", "rate": 10.0, "type": "demand",
+                                               "ratchet": {"percentage": 100}}], "service": "electricity"}, Tariff)
+        _, demand = marginal_prices(tariff, meter_data)
+        # The January to March peaks set the billed demand of the following months
+        assert demand['ratcheted'].tolist() == [False] * 3 + [True] * 9
+        assert demand['shadow_price'].tolist() == [10.0] * 3 + [0.0] * 9
+
+    def test_fleet(self, tariff, meter_data):
+        customers = {'A': meter_data, 'B': meter_data * 3.0}
+        fleet_data = pandas.concat(customers, axis=1, names=['meter', 'register'])
+        intervals, demand = marginal_prices(tariff, fleet_data)
+        assert demand.index.names == ['component', 'period', 'meter']
+        for meter, customer_data in customers.items():
+            expected_intervals, expected_demand = marginal_prices(tariff, customer_data)
+            pandas.testing.assert_frame_equal(intervals[meter], expected_intervals, check_names=False)
+            pandas.testing.assert_frame_equal(demand.xs(meter, level='meter'), expected_demand, check_dtype=False)
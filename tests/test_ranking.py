@@ -0,0 +1,112 @@
+from tariffs import apply_many, rank_tariffs
+from tariffs.instrumentation import Profiler
+from tariffs.meter import MeterData
+from tariffs.ranking import LoadSummary, bill_bounds
+from tariffs.tariff import Tariff
+import pytest
+from odin.codecs import dict_codec
+import numpy
+import pandas
+import datetime
+
+
+parser = lambda t: datetime.datetime.strptime(t, '%d/%m/%Y %H:%M')
+
+PEAK = {"name": "peak", "periods": [{"from_weekday": 0, "to_weekday": 4, "from_hour": 14, "to_hour": 19}]}
+OFF_PEAK = {"name": "off-peak", "periods": [{"to_hour": 13}, {"from_hour": 20}]}
+SUMMER = {"name": "summer", "from_month": 1, "from_day": 1, "to_month": 3, "to_day": 31}
+
+
+def catalogue(size, seed=0):
+    """A catalogue of flat, time-of-use, seasonal, block and demand tariffs with varied rates"""
+    random = numpy.random.RandomState(seed)
+    tariffs = []
+    for position in range(size):
+        rate = lambda low, high: round(float(random.uniform(low, high)), 4)
+        kind = position % 5
+        if kind == 0:
+            charges = [{"code": "A", "rate": rate(0.15, 0.35)}]
+        elif kind == 1:
+            charges = [{"code": "P", "rate": rate(0.3, 0.6), "time": PEAK},
+                       {"code": "O", "rate": rate(0.05, 0.2), "time": OFF_PEAK}]
+        elif kind == 2:
+            charges = [{"code": "A", "rate": rate(0.1, 0.25)},
+                       {"code": "S", "rate": rate(0.05, 0.2), "time": PEAK, "season": SUMMER}]
+        elif kind == 3:
+            charges = [{"code": "B", "rate_bands": [{"limit": rate(100, 2000), "rate": rate(0.2, 0.4)},
+                                                    {"rate": rate(0.1, 0.3)}]}]
+        else:
+            charges = [{"code": "A", "rate": rate(0.1, 0.25)},
+                       {"code": "D", "rate": rate(5.0, 15.0), "type": "demand"},
+                       {"code": "E", "rate": -rate(0.05, 0.1), "meter": "electricity_exported"}]
+        tariffs.append({"code": "T%03d" % position, "charges": charges, "service": "electricity",
+                        "billing_period": ("monthly", "quarterly")[position % 2], "demand_window": "30min"})
+    return [dict_codec.load(tariff, Tariff) for tariff in tariffs]
+
+
+class TestRankTariffs(object):
+
+    @pytest.fixture
+    def meter_data(self):
+        with open('./fixtures/test_load_data.csv') as f:
+            meter_data = pandas.read_csv(f, index_col='datetime', parse_dates=True, infer_datetime_format=True,
+                                         date_parser=parser)
+        # A load varying by time of day and season
+        hours = meter_data.index.hour.to_numpy()
+        months = meter_data.index.month.to_numpy()
+        meter_data['electricity_imported'] = 0.2 + 0.3 * (hours >= 17) + 0.1 * (months <= 3)
+        meter_data['electricity_exported'] = 0.1 * ((hours >= 10) & (hours < 14))
+        return meter_data
+
+    @pytest.fixture
+    def tariffs(self):
+        return catalogue(200)
+
+    @pytest.mark.parametrize('k', [1, 5])
+    def test_ranking_matches_apply_many(self, tariffs, meter_data, k):
+        expected = apply_many(tariffs, meter_data)['total'].sort_values(kind='mergesort')
+        with Profiler() as profiler:
+            ranked = rank_tariffs(tariffs, meter_data, k=k)
+        assert ranked.index.tolist() == expected.index[:k].tolist()
+        assert ranked['rank'].tolist() == list(range(1, k + 1))
+        numpy.testing.assert_allclose(ranked['total'], expected.iloc[:k])
+        assert (ranked['lower'] <= ranked['total']).all()
+        assert (ranked['total'] <= ranked['upper']).all()
+
+        counts = [record for record in profiler.counts if record['count'] == 'ranked']
+        assert len(counts) == 1
+        assert counts[0]['tariffs'] == counts[0]['eligible'] == 200
+        assert counts[0]['billed'] <= 20
+
+    def test_bounds_contain_bills(self, meter_data):
+        tariffs = catalogue(20, seed=1) + [
+            dict_codec.load({"charges": [
+                {"code": "D", "rate_bands": [{"limit": 0.55, "rate": 10.0}, {"rate": 20.0}], "type": "demand",
+                 "time": PEAK, "ratchet": {"percentage": 80}},
+                {"code": "S", "rate_schedule": [{"datetime": "2018-01-01T00:00:00", "rate": 0.2},
+                                                {"datetime": "2018-06-01T00:00:00", "rate": 0.3}]}
+            ], "service": "electricity", "demand_window": "30min", "demand_window_type": "rolling"}, Tariff)
+        ]
+        summary = LoadSummary(MeterData(meter_data))
+        for tariff in tariffs:
+            lower, upper = bill_bounds(tariff, summary)
+            assert lower <= tariff.apply(meter_data) <= upper
+
+    def test_eligibility(self, meter_data):
+        tariffs = [
+            dict_codec.load({"code": "small", "charges": [{"code": "A", "rate": 0.1}], "service": "electricity",
+                             "max_consumption": 1000}, Tariff),
+            dict_codec.load({"code": "low-demand", "charges": [{"code": "A", "rate": 0.15}],
+                             "service": "electricity", "max_demand": 0.5, "demand_window": "30min"}, Tariff),
+            dict_codec.load({"code": "any", "charges": [{"code": "A", "rate": 0.2}], "service": "electricity"},
+                            Tariff),
+        ]
+        ranked = rank_tariffs(tariffs, meter_data, k=3)
+        assert ranked.index.tolist() == ['any']
+        ranked = rank_tariffs(tariffs, meter_data, k=3, check_eligibility=False)
+        assert ranked.index.tolist() == ['small', 'low-demand', 'any']
+
+    def test_fleet(self, tariffs, meter_data):
+        fleet_data = pandas.concat({'A': meter_data, 'B': meter_data}, axis=1, names=['meter', 'register'])
+        with pytest.raises(UserWarning):
+            rank_tariffs(tariffs, fleet_data)
@@ -0,0 +1,100 @@
+from tariffs import Profiler
+from tariffs.meter import MeterData
+from tariffs.results import ResultCache
+from tariffs.tariff import Tariff
+import pytest
+from odin.codecs import dict_codec
+import pandas
+import datetime
+
+
+parser = lambda t: datetime.datetime.strptime(t, '%d/%m/%Y %H:%M')
+
+
+class TestResultCache(object):
+
+    @pytest.fixture
+    def meter_data(self):
+        with open('./fixtures/test_load_data.csv') as f:
+            meter_data = pandas.read_csv(f, index_col='datetime', parse_dates=True, infer_datetime_format=True,
+                                         date_parser=parser)
+        return meter_data
+
+    @pytest.fixture
+    def tariff(self):
+        return dict_codec.load(
+            {
+                "charges": [
+                    {"code": "P", "rate": 0.5, "time": {"name": "peak", "periods": [{"from_hour": 17}]}},
+                    {"code": "B", "rate_bands": [{"limit": 500, "rate": 0.2}, {"rate": 0.1}]},
+                    {"code": "D", "rate": 10.0, "type": "demand"}
+                ],
+                "service": "electricity"
+            }, Tariff
+        )
+
+    def test_memory(self, tariff, meter_data):
+        cache = ResultCache()
+        expected = tariff.apply(meter_data, output_format='billing-period-components')
+        with Profiler() as profiler:
+            first = tariff.apply(meter_data, output_format='billing-period-components', cache=cache)
+            second = tariff.apply(meter_data, output_format='billing-period-components', cache=cache)
+        pandas.testing.assert_frame_equal(first, expected)
+        pandas.testing.assert_frame_equal(second, expected)
+        assert (cache.hits, cache.misses) == (1, 1)
+        assert [record['source'] for record in profiler.counts if record['count'] == 'result_cached'] == ['memory']
+        # Cached results are copies
+        second.iloc[0, 0] = -1.0
+        pandas.testing.assert_frame_equal(cache.apply(tariff, meter_data, output_format='billing-period-components'),
+                                          expected)
+
+        # Other arguments, tariffs and meter data are other results
+        assert cache.apply(tariff, meter_data, end=datetime.datetime(2018, 6, 30)) == pytest.approx(
+            tariff.apply(meter_data, end=datetime.datetime(2018, 6, 30)))
+        assert cache.misses == 2
+
+    def test_invalidation(self, tariff, meter_data):
+        cache = ResultCache(cache_size=2)
+        total = cache.apply(tariff, meter_data)
+        tariff.charges[0].rate = 1.0
+        assert cache.apply(tariff, meter_data) == pytest.approx(tariff.apply(meter_data)) != pytest.approx(total)
+        meter_data.iloc[0, 0] += 100.0
+        assert cache.apply(tariff, meter_data) == pytest.approx(tariff.apply(meter_data))
+        assert (cache.hits, cache.misses) == (0, 3)
+        assert len(cache) == 2
+
+        # Equal content hashes the same
+        other = dict_codec.load(dict_codec.dump(tariff), Tariff)
+        assert cache.apply(other, meter_data.copy()) == pytest.approx(tariff.apply(meter_data))
+        assert cache.hits == 1
+
+    def test_disk(self, tariff, meter_data, tmpdir):
+        directory = str(tmpdir.join('results'))
+        expected = ResultCache(directory=directory).apply(tariff, meter_data, output_format='total-components')
+        # Another cache, e.g. of another process, reads the results on disk
+        cache = ResultCache(directory=directory)
+        with Profiler() as profiler:
+            assert cache.apply(tariff, meter_data, output_format='total-components') == expected
+        assert [record['source'] for record in profiler.counts if record['count'] == 'result_cached'] == ['disk']
+        assert cache.hits == 1
+
+        size = cache.disk_size()
+        cache.max_disk_size = int(size * 2.5)
+        for day in (10, 20, 30):
+            cache.apply(tariff, meter_data, end=datetime.datetime(2018, 1, day), output_format='total-components')
+        assert cache.disk_size() <= cache.max_disk_size
+        assert len(tmpdir.join('results').listdir()) == 2
+
+        cache.clear()
+        assert cache.disk_size() == len(cache) == 0
+
+    def test_digests(self, tariff, meter_data):
+        digest = tariff.digest()
+        assert tariff.digest() == digest
+        tariff.charges[1].rate_bands[0].limit = 600
+        assert tariff.digest() != digest
+
+        meter = MeterData(meter_data)
+        digest = meter.digest()
+        assert MeterData(meter_data.copy()).digest() == digest
+        assert MeterData(meter_data.astype('float32')).digest() != digest
@@ -0,0 +1,134 @@
+from tariffs import Profiler, apply_scenarios, offset_scenarios
+from tariffs.scenarios import scenario_values
+from tariffs.tariff import Tariff
+import pytest
+from odin.codecs import dict_codec
+import numpy
+import pandas
+import datetime
+
+
+parser = lambda t: datetime.datetime.strptime(t, '%d/%m/%Y %H:%M')
+
+
+class TestScenarios(object):
+
+    @pytest.fixture
+    def meter_data(self):
+        with open('./fixtures/test_load_data.csv') as f:
+            meter_data = pandas.read_csv(f, index_col='datetime', parse_dates=True, infer_datetime_format=True,
+                                         date_parser=parser)
+        return meter_data
+
+    @pytest.fixture
+    def solar(self, meter_data):
+        # The output of 1 kW of solar PV per quarter hour, peaking at noon
+        hours = meter_data.index.hour + meter_data.index.minute / 60.0
+        return pandas.Series(numpy.clip(numpy.sin((hours - 6) / 12 * numpy.pi), 0, None) * 0.25,
+                             index=meter_data.index)
+
+    @pytest.fixture
+    def tariff(self):
+        tariff = dict_codec.load(
+            {
+                "charges": [
+                    {
+                        "code": "P",
+                        "rate_bands": [{"limit": 500, "rate": 0.4}, {"rate": 0.3}],
+                        "time": {"name": "peak", "periods": [{"from_weekday": 0, "to_weekday": 4,
+                                                              "from_hour": 7, "to_hour": 19}]}
+                    },
+                    {
+                        "code": "O",
+                        "rate": 0.15,
+                        "time": {"name": "offpeak", "periods": [{"from_weekday": 5, "to_weekday": 6,
+                                                                 "from_hour": 0, "to_hour": 23, "to_minute": 59}]}
+                    },
+                    {
+                        "code": "E",
+                        "rate": -0.08,
+                        "meter": "electricity_exported"
+                    },
+                    {
+                        "code": "D",
+                        "rate": 8.0,
+                        "type": "demand"
+                    }
+                ],
+                "service": "electricity",
+                "billing_period": "monthly",
+                "demand_window": "30min"
+            }, Tariff
+        )
+        return tariff
+
+    def test_offset_scenarios(self, meter_data, solar):
+        scenarios = offset_scenarios(meter_data, solar, [0.0, 5.0])
+        assert list(scenarios) == [0.0, 5.0]
+        assert (scenarios[0.0] == 0.0).all().all()
+        values, changed = scenario_values(meter_data, scenarios.values())
+        assert changed.sum() == (solar > 0).sum()
+        net = values[:, :, 0] - values[:, :, 1]
+        numpy.testing.assert_allclose(net[:, 2], net[:, 0] - 5.0 * solar.to_numpy(), atol=1e-12)
+        assert (values >= 0.0).all()
+        # Exports only grow by the surplus over the imported energy
+        assert (values[:, 2, 1] >= values[:, 0, 1]).all()
+        charging = offset_scenarios(meter_data, -solar, [5.0])[5.0]
+        assert (charging['electricity_exported'] <= 0.0).all()
+
+    def test_matches_apply(self, tariff, meter_data, solar):
+        scenarios = offset_scenarios(meter_data, solar, numpy.arange(1.0, 20.5, 0.5))
+        scenarios['efficient'] = 0.9
+        output = apply_scenarios(tariff, meter_data, scenarios, output_format='total-components')
+        assert output.index.tolist() == list(scenarios)
+        base = tariff.apply(meter_data)
+        for label in (1.0, 7.5, 20.0, 'efficient'):
+            modification = scenarios[label]
+            if isinstance(modification, float):
+                modified = meter_data * modification
+            else:
+                modified = meter_data + modification
+            expected = tariff.apply(modified, output_format='total-components')
+            for name, cost in expected.items():
+                assert output.loc[label, name] == pytest.approx(cost, abs=1e-6)
+            assert output.loc[label, 'total'] == pytest.approx(sum(expected.values()))
+            assert output.loc[label, 'savings'] == pytest.approx(base - sum(expected.values()))
+        # Savings grow with the size of the system
+        assert output.loc[numpy.arange(1.0, 20.5, 0.5), 'savings'].is_monotonic_increasing
+
+    def test_unchanged_billing_periods_are_skipped(self, tariff, meter_data):
+        # A battery discharging at 5pm on winter weekdays only changes June to August
+        winter = (meter_data.index.month >= 6) & (meter_data.index.month <= 8) & (meter_data.index.hour == 17) & \
+                 (meter_data.index.dayofweek < 5)
+        battery = pandas.Series(numpy.where(winter, 0.5, 0.0), index=meter_data.index)
+        scenarios = offset_scenarios(meter_data, battery, [1.0, 2.0])
+        with Profiler() as profiler:
+            output = apply_scenarios(tariff, meter_data, scenarios)
+        record = [record for record in profiler.counts if record['count'] == 'scenario_intervals'][0]
+        assert record['billed'] == (30 + 31 + 31) * 96
+        for size in (1.0, 2.0):
+            expected = tariff.apply(meter_data + scenarios[size])
+            assert output.loc[size, 'total'] == pytest.approx(expected)
+        assert output.columns.tolist() == ['total', 'savings']
+
+    def test_ratchets_bill_every_period(self, meter_data):
+        tariff = dict_codec.load({"charges": [{"code": "D", "rate": 8.0, "type": "demand",
+                                               "ratchet": {"percentage": 80}}],
+                                  "service": "electricity"}, Tariff)
+        spike = pandas.DataFrame({'electricity_imported': 0.0, 'electricity_exported': 0.0}, index=meter_data.index)
+        spike.loc['2018-01-10 12:00':'2018-01-10 12:15', 'electricity_imported'] = 50.0
+        with Profiler() as profiler:
+            output = apply_scenarios(tariff, meter_data, {'spike': spike})
+        record = [record for record in profiler.counts if record['count'] == 'scenario_intervals'][0]
+        assert record['billed'] == len(meter_data)
+        assert output.loc['spike', 'total'] == pytest.approx(tariff.apply(meter_data + spike))
+
+    def test_no_changes(self, tariff, meter_data):
+        output = apply_scenarios(tariff, meter_data, {'same': 1.0})
+        assert output.loc['same', 'savings'] == 0.0
+        assert output.loc['same', 'total'] == pytest.approx(tariff.apply(meter_data))
+
+    def test_fleet_meter_data(self, tariff, meter_data):
+        fleet_data = pandas.concat({'A': meter_data}, axis=1)
+        with pytest.raises(UserWarning):
+            apply_scenarios(tariff, fleet_data, {'efficient': 0.9})
@@ -0,0 +1,104 @@
+from tariffs.tariff import Tariff
+from tariffs.schedule import RateSchedule
+import pytest
+from odin.codecs import dict_codec, json_codec
+import numpy
+import pandas
+import datetime
+
+
+parser = lambda t: datetime.datetime.strptime(t, '%d/%m/%Y %H:%M')
+
+
+class TestRateSchedule(object):
+
+    @pytest.fixture
+    def meter_data(self):
+        with open('./fixtures/test_load_data.csv') as f:
+            meter_data = pandas.read_csv(f, index_col='datetime', parse_dates=True, infer_datetime_format=True,
+                                         date_parser=parser)
+        return meter_data
+
+    @pytest.fixture
+    def rates(self):
+        index = pandas.date_range('2018-01-01 00:15', '2019-01-01 00:00', freq='15min')
+        return pandas.Series(numpy.arange(len(index)) % 7 * 0.1, index=index)
+
+    @pytest.fixture
+    def real_time_tariff(self, rates):
+        real_time_tariff = dict_codec.load(
+            {
+                "charges": [
+                    {
+                        "rate_schedule": [
+                            {
+                                "datetime": dt.isoformat(),
+                                "rate": rate
+                            } for dt, rate in rates.items()
+                        ]
+                    }
+                ],
+                "service": "electricity",
+                "billing_period": "monthly"
+            }, Tariff
+        )
+        return real_time_tariff
+
+    def test_rates_at(self):
+        schedule = RateSchedule(['2018-01-02', '2018-01-01', '2018-01-03'], [2.0, 1.0, 3.0])
+        index = pandas.DatetimeIndex(['2017-12-31', '2018-01-01', '2018-01-02 12:00', '2018-01-03'])
+        rates = schedule.rates_at(index)
+        assert rates[:3].tolist() == [1.0, 2.0, 3.0]
+        assert numpy.isnan(rates[3])
+
+    def test_series_source_matches_schedule_items(self, real_time_tariff, rates, meter_data):
+        expected_bill = real_time_tariff.apply(meter_data, output_format='input-timestep')
+        real_time_tariff.charges[0].set_rate_schedule(rates)
+        actual_bill = real_time_tariff.apply(meter_data, output_format='input-timestep')
+        pandas.testing.assert_series_equal(actual_bill, expected_bill)
+        # Each interval is priced at the rate scheduled for the end of the interval
+        assert actual_bill.iloc[:7].tolist() == pytest.approx([0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6])
+
+    def test_rate_schedule_resources(self, real_time_tariff, rates, meter_data):
+        expected_bill = real_time_tariff.apply(meter_data)
+        real_time_tariff.charges[0].set_rate_schedule(rates)
+        schedule = real_time_tariff.charges[0].rate_schedule
+        real_time_tariff.full_clean()
+        # Validation keeps the arrays
+        assert real_time_tariff.charges[0].rate_schedule is schedule
+        loaded = json_codec.loads(json_codec.dumps(real_time_tariff), Tariff)
+        assert [item.rate for item in loaded.charges[0].rate_schedule] == rates.tolist()
+        assert loaded.apply(meter_data) == pytest.approx(expected_bill)
+        # The arrays of a list of items are rebuilt once the field is assigned another list
+        loaded.charges[0].rate_schedule = loaded.charges[0].rate_schedule[:10]
+        assert len(loaded.charges[0].get_rate_schedule()) == 10
+
+    def test_large_series_builds_no_items(self, real_time_tariff, meter_data, monkeypatch):
+        index = pandas.date_range('2018-01-01 00:05', periods=105120, freq='5min')
+        rates = pandas.Series(numpy.arange(len(index)) % 5 * 0.1, index=index)
+
+        def iterate(schedule):
+            raise AssertionError('ScheduleItem resources were built')
+
+        monkeypatch.setattr(RateSchedule, '__iter__', iterate)
+        charge = real_time_tariff.charges[0]
+        charge.set_rate_schedule(rates)
+        total = real_time_tariff.apply(meter_data)
+        # Invalidating the plan recompiles it from the same arrays
+        real_time_tariff.invalidate()
+        assert real_time_tariff.apply(meter_data) == total
+        assert charge.get_rate_schedule() is charge.rate_schedule
+
+    def test_loop_engine_reads_rate_schedule(self, real_time_tariff, rates, meter_data):
+        real_time_tariff.charges[0].set_rate_schedule(rates)
+        assert real_time_tariff.apply(meter_data.iloc[:96 * 7], engine='loop') == \
+            pytest.approx(real_time_tariff.apply(meter_data.iloc[:96 * 7]))
+
+    def test_parquet_source(self, rates, tmpdir):
+        pyarrow = pytest.importorskip('pyarrow')
+        import pyarrow.parquet
+        path = str(tmpdir.join('rates.parquet'))
+        pyarrow.parquet.write_table(pyarrow.table({'datetime': rates.index.values, 'rate': rates.values}), path)
+        schedule = RateSchedule.coerce(path)
+        assert len(schedule) == len(rates)
+        numpy.testing.assert_array_equal(schedule.rates_at(rates.index - pandas.Timedelta('1min')), rates.values)
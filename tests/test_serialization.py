@@ -0,0 +1,113 @@
+from tariffs.schedule import RateSchedule
+from tariffs.serialization import dump_tariffs, load_tariffs
+from tariffs.tariff import Spec, Tariff
+import pytest
+from odin.codecs import dict_codec
+import pandas
+import datetime
+
+
+parser = lambda t: datetime.datetime.strptime(t, '%d/%m/%Y %H:%M')
+
+PEAK = {"name": "peak", "periods": [{"from_weekday": 0, "to_weekday": 4, "from_hour": 14, "to_hour": 19}]}
+
+
+class TestSerialization(object):
+
+    @pytest.fixture
+    def meter_data(self):
+        with open('./fixtures/test_load_data.csv') as f:
+            meter_data = pandas.read_csv(f, index_col='datetime', parse_dates=True, infer_datetime_format=True,
+                                         date_parser=parser)
+        return meter_data
+
+    @pytest.fixture
+    def tariffs(self):
+        spec = dict_codec.load({"tariffs": [
+            {
+                "code": "TOU",
+                "utility_code": "X",
+                "service": "electricity",
+                "min_consumption": 0.5,
+                "charges": [
+                    {"code": "P", "rate": 0.4, "time": PEAK},
+                    {"code": "S", "rate_bands": [{"limit": 100, "rate": 0.3}, {"rate": 0.2}],
+                     "season": {"name": "summer", "from_month": 1, "from_day": 1, "to_month": 3, "to_day": 31}},
+                    {"rate": 8.0, "type": "demand", "time": PEAK}
+                ],
+                "times": {"peak_end": "19:00:00"},
+                "seasons": {"summer_end": "2018-03-31"},
+                "billing_period": "quarterly",
+                "demand_window": "hourly"
+            },
+            {
+                "code": "SCHEDULED",
+                "service": "electricity",
+                "charges": [
+                    {"rate_schedule": [{"datetime": "2018-01-01T00:00:00", "rate": 0.1},
+                                       {"datetime": "2018-06-01T00:30:00", "rate": 0.2},
+                                       {"datetime": "2018-12-31T01:00:00", "rate": 0.3}]},
+                    {"code": "E", "rate": -0.05, "meter": "electricity_exported", "time": PEAK}
+                ]
+            },
+            {
+                "code": "REAL-TIME",
+                "service": "electricity",
+                "charges": [{"code": "R"}]
+            }
+        ]}, Spec)
+        rates = pandas.Series([0.1, 0.5, 0.2], index=pandas.to_datetime(['2018-03-01', '2018-09-01', '2019-01-01']))
+        spec.tariffs[2].charges[0].set_rate_schedule(rates)
+        return spec.tariffs
+
+    @pytest.mark.parametrize('mmap', [True, False])
+    def test_round_trip(self, tariffs, meter_data, tmpdir, mmap):
+        path = str(tmpdir.join('tariffs.bundle'))
+        dump_tariffs(tariffs, path)
+        loaded_tariffs = load_tariffs(path, mmap=mmap)
+        for tariff, loaded_tariff in zip(tariffs, loaded_tariffs):
+            assert isinstance(loaded_tariff, Tariff)
+            assert dict_codec.dump(loaded_tariff) == dict_codec.dump(tariff)
+            loaded_tariff.full_clean()
+            for charge, loaded_charge in zip(tariff.charges, loaded_tariff.charges):
+                # Rate schedules are loaded as arrays, without building their items
+                if charge.rate_schedule:
+                    assert isinstance(loaded_charge.rate_schedule, RateSchedule)
+            # The stored billing plan is used rather than recompiled
+            plan = loaded_tariff._plan
+            assert loaded_tariff.compile().charges is plan.charges
+            assert loaded_tariff.apply(meter_data, output_format='total-components') == pytest.approx(
+                tariff.apply(meter_data, output_format='total-components'))
+        # Identical time-of-use tables are shared between plans
+        time_tables = [charge.time_table for tariff in loaded_tariffs for charge in tariff._plan.charges
+                       if charge.time_table is not None]
+        assert len(time_tables) == 3 and time_tables[0].base is time_tables[2].base
+
+    def test_without_plans(self, tariffs, meter_data, tmpdir):
+        path = str(tmpdir.join('tariffs.bundle'))
+        dump_tariffs(tariffs, path, plans=False)
+        loaded_tariff = load_tariffs(path)[0]
+        assert getattr(loaded_tariff, '_plan', None) is None
+        assert loaded_tariff.apply(meter_data) == pytest.approx(tariffs[0].apply(meter_data))
+
+    def test_checksum_mismatch(self, tariffs, meter_data, tmpdir):
+        path = str(tmpdir.join('tariffs.bundle'))
+        dump_tariffs(tariffs, path)
+        with open(path, 'rb') as f:
+            data = bytearray(f.read())
+        with open(path, 'wb') as f:
+            f.write(data.replace(b'"TOU"', b'"TOV"'))
+        # The tariffs are validated and their plans recompiled
+        loaded_tariffs = load_tariffs(path)
+        assert getattr(loaded_tariffs[0], '_plan', None) is None
+        assert loaded_tariffs[0].code == 'TOV'
+        tariffs[0].code = 'TOV'
+        assert dict_codec.dump(loaded_tariffs[0]) == dict_codec.dump(tariffs[0])
+        assert loaded_tariffs[0].apply(meter_data) == pytest.approx(tariffs[0].apply(meter_data))
+
+    def test_not_a_bundle(self, tmpdir):
+        path = str(tmpdir.join('tariffs.json'))
+        with open(path, 'w') as f:
+            f.write('{"tariffs": []}')
+        with pytest.raises(UserWarning):
+            load_tariffs(path)
@@ -0,0 +1,158 @@
+from tariffs.service import BillService, TariffCache
+from tariffs.tariff import Tariff
+import pytest
+from odin.codecs import dict_codec
+import asyncio
+import json
+import threading
+import pandas
+import datetime
+
+
+parser = lambda t: datetime.datetime.strptime(t, '%d/%m/%Y %H:%M')
+
+
+async def fetch(address, method, path, body=None):
+    """Makes an HTTP request of the service, returning the status and JSON response"""
+    reader, writer = await asyncio.open_connection(*address)
+    content = json.dumps(body).encode() if body is not None else b''
+    writer.write(('%s %s HTTP/1.1\r\nHost: localhost\r\nContent-Length: %d\r\nConnection: close\r\n\r\n' % (
+        method, path, len(content))).encode() + content)
+    await writer.drain()
+    status_line = await reader.readline()
+    while (await reader.readline()) not in (b'\r\n', b''):
+        pass
+    response = json.loads(await reader.read())
+    writer.close()
+    return int(status_line.split()[1]), response
+
+
+class TestBillService(object):
+
+    @pytest.fixture
+    def meter_data(self):
+        with open('./fixtures/test_load_data.csv') as f:
+            meter_data = pandas.read_csv(f, index_col='datetime', parse_dates=True, infer_datetime_format=True,
+                                         date_parser=parser)
+        return meter_data.iloc[:96 * 31]
+
+    @pytest.fixture
+    def tariff_data(self):
+        return {
+            "code": "tou",
+            "charges": [
+                {"code": "P", "rate": 0.5, "time": {"name": "peak", "periods": [{"from_hour": 14, "to_hour": 19}]}},
+                {"code": "O", "rate": 0.1, "time": {"name": "off-peak", "periods": [{"to_hour": 13},
+                                                                                    {"from_hour": 20}]}},
+                {"code": "D", "rate": 10.0, "type": "demand"}
+            ],
+            "service": "electricity"
+        }
+
+    def request(self, meter_data, **fields):
+        fields['meter_data'] = {
+            'datetime': [timestamp.isoformat() for timestamp in meter_data.index],
+            'electricity_imported': meter_data['electricity_imported'].tolist(),
+            'electricity_exported': meter_data['electricity_exported'].tolist(),
+        }
+        return fields
+
+    def test_bill(self, tariff_data, meter_data):
+        tariff = dict_codec.load(tariff_data, Tariff)
+
+        async def run():
+            async with BillService([tariff], workers=2) as service:
+                address = service.server.sockets[0].getsockname()[:2]
+                inline = await fetch(address, 'POST', '/bill', self.request(meter_data, tariff=tariff_data))
+                components = await fetch(address, 'POST', '/bill', self.request(
+                    meter_data, tariff=tariff_data, output_format='total-components', end='2018-01-15T23:45:00'))
+                by_code = await fetch(address, 'POST', '/bill', self.request(meter_data, tariff_code='tou'))
+                metrics = await fetch(address, 'GET', '/metrics')
+            return inline, components, by_code, metrics
+
+        inline, components, by_code, metrics = asyncio.run(run())
+        assert inline == (200, {'total': pytest.approx(tariff.apply(meter_data))})
+        assert components[0] == 200
+        assert components[1]['components'] == pytest.approx(tariff.apply(
+            meter_data, end=datetime.datetime(2018, 1, 15, 23, 45), output_format='total-components'))
+        assert by_code == inline
+
+        status, metrics = metrics
+        assert status == 200
+        assert metrics['requests'] == metrics['billed'] == 3
+        # The inline tariff is decoded once
+        assert (metrics['cache_hits'], metrics['cache_misses']) == (2, 1)
+        assert metrics['queue_depth'] == 0
+        assert 0 < metrics['latency_p50'] <= metrics['latency_p99']
+
+    def test_errors(self, tariff_data, meter_data):
+        async def run():
+            async with BillService(workers=1) as service:
+                address = service.server.sockets[0].getsockname()[:2]
+                return [
+                    await fetch(address, 'POST', '/bill', {'tariff': tariff_data}),
+                    await fetch(address, 'POST', '/bill', self.request(meter_data, tariff_code='unknown')),
+                    await fetch(address, 'POST', '/bill', self.request(meter_data, tariff={"charges": "none"})),
+                    await fetch(address, 'GET', '/bill'),
+                    await fetch(address, 'GET', '/unknown'),
+                ]
+
+        statuses = [status for status, _ in asyncio.run(run())]
+        assert statuses == [400, 404, 400, 405, 404]
+
+    def test_coalescing(self, tariff_data, meter_data):
+        body = json.dumps(self.request(meter_data, tariff=tariff_data)).encode()
+
+        async def run():
+            async with BillService(workers=2) as service:
+                responses = await asyncio.gather(*[service.bill(body) for _ in range(4)])
+                return responses, service.metrics()
+
+        responses, metrics = asyncio.run(run())
+        assert all(response == responses[0] for response in responses)
+        assert (metrics['requests'], metrics['coalesced'], metrics['billed']) == (4, 3, 1)
+
+    def test_backpressure(self, tariff_data, meter_data):
+        bodies = [json.dumps(self.request(meter_data, tariff=tariff_data, end='2018-01-%02dT00:00:00' % day)).encode()
+                  for day in (10, 20, 30)]
+        release = threading.Event()
+
+        async def run():
+            async with BillService(workers=1, max_pending=1) as service:
+                # Occupy the only worker thread so that requests queue
+                service.executor.submit(release.wait)
+                first = asyncio.ensure_future(service.bill(bodies[0]))
+                await asyncio.sleep(0.1)
+                second = asyncio.ensure_future(service.bill(bodies[1]))
+                await asyncio.sleep(0.1)
+                metrics = service.metrics()
+                rejected = await service.bill(bodies[2])
+                release.set()
+                return await first, await second, rejected, metrics
+
+        first, second, rejected, metrics = asyncio.run(run())
+        assert first[0] == second[0] == 200
+        assert rejected[0] == 503
+        assert (metrics['queue_depth'], metrics['running']) == (1, 1)
+
+    def test_process_executor(self, tariff_data, meter_data):
+        tariff = dict_codec.load(tariff_data, Tariff)
+
+        async def run():
+            async with BillService([tariff], workers=2, executor='process') as service:
+                address = service.server.sockets[0].getsockname()[:2]
+                return await asyncio.gather(*[fetch(address, 'POST', '/bill', self.request(meter_data, **fields))
+                                              for fields in ({'tariff': tariff_data}, {'tariff_code': 'tou'})])
+
+        for status, response in asyncio.run(run()):
+            assert status == 200
+            assert response['total'] == pytest.approx(tariff.apply(meter_data))
+
+    def test_tariff_cache(self, tariff_data):
+        cache = TariffCache(cache_size=1)
+        tariff, cached = cache.get(tariff_data)
+        assert not cached
+        assert cache.get(json.loads(json.dumps(tariff_data, sort_keys=True))) == (tariff, True)
+        cache.get(dict(tariff_data, code='other'))
+        assert len(cache) == 1
+        assert not cache.get(tariff_data)[1]
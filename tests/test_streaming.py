@@ -0,0 +1,123 @@
+from tariffs.streaming import BillAccumulator
+from tariffs.tariff import Tariff
+import pytest
+from odin.codecs import dict_codec
+import json
+import pandas
+import datetime
+
+
+parser = lambda t: datetime.datetime.strptime(t, '%d/%m/%Y %H:%M')
+
+
+def chunks(meter_data, size):
+    for start in range(0, len(meter_data), size):
+        yield meter_data.iloc[start:start + size]
+
+
+class TestBillAccumulator(object):
+
+    @pytest.fixture
+    def meter_data(self):
+        with open('./fixtures/test_load_data.csv') as f:
+            meter_data = pandas.read_csv(f, index_col='datetime', parse_dates=True, infer_datetime_format=True,
+                                         date_parser=parser)
+        # Vary the load so that peaks and blocks depend on the time of day
+        scale = 1.0 + (meter_data.index.hour % 5 == 0) + (meter_data.index.dayofyear % 7 == 0)
+        return meter_data.mul(scale, axis=0)
+
+    @pytest.fixture
+    def tou_tariff(self):
+        tou_tariff = dict_codec.load(
+            {
+                "charges": [
+                    {
+                        "code": "P",
+                        "rate_bands": [{"limit": 300, "rate": 0.4}, {"rate": 0.3}],
+                        "time": {"name": "peak", "periods": [{"from_weekday": 0, "to_weekday": 4,
+                                                              "from_hour": 14, "to_hour": 19}]}
+                    },
+                    {
+                        "code": "O",
+                        "rate": 0.1,
+                        "time": {"name": "off-peak", "periods": [{"to_hour": 13}, {"from_hour": 20}]}
+                    },
+                    {
+                        "code": "E",
+                        "rate": -0.05,
+                        "meter": "electricity_exported"
+                    },
+                    {
+                        "code": "D",
+                        "rate": 8.0,
+                        "type": "demand"
+                    }
+                ],
+                "service": "electricity",
+                "billing_period": "monthly",
+                "demand_window": "hourly"
+            }, Tariff
+        )
+        return tou_tariff
+
+    @pytest.fixture
+    def seasonal_block_tariff(self):
+        seasonal_block_tariff = dict_codec.load(
+            {
+                "charges": [
+                    {
+                        "code": "S",
+                        "rate_bands": [{"limit": 1000, "rate": 0.3}, {"rate": 0.2}],
+                        "season": {"name": "summer", "from_month": 1, "from_day": 1, "to_month": 3, "to_day": 31}
+                    },
+                    {
+                        "code": "W",
+                        "rate": 0.25,
+                        "season": {"name": "winter", "from_month": 4, "from_day": 1, "to_month": 12, "to_day": 31}
+                    }
+                ],
+                "service": "electricity",
+                "billing_period": "quarterly"
+            }, Tariff
+        )
+        return seasonal_block_tariff
+
+    @pytest.mark.parametrize('tariff_fixture', ['tou_tariff', 'seasonal_block_tariff'])
+    def test_matches_apply(self, tariff_fixture, meter_data, request):
+        tariff = request.getfixturevalue(tariff_fixture)
+        accumulator = BillAccumulator(tariff)
+        for chunk in chunks(meter_data, 977):
+            accumulator.update(chunk)
+        expected_components = tariff.apply(meter_data, output_format='total-components')
+        assert accumulator.components() == pytest.approx(expected_components)
+        assert accumulator.total() == pytest.approx(tariff.apply(meter_data))
+
+    def test_month_to_date(self, tou_tariff, meter_data):
+        accumulator = BillAccumulator(tou_tariff)
+        for chunk in chunks(meter_data.truncate(after=datetime.datetime(2018, 3, 10, 7, 45)), 500):
+            accumulator.update(chunk)
+        expected_bill = tou_tariff.apply(meter_data, start=datetime.datetime(2018, 3, 1),
+                                         end=datetime.datetime(2018, 3, 10, 7, 45))
+        assert accumulator.billing_periods()[-1] == pandas.Timestamp('2018-03-01')
+        assert accumulator.total('current') == pytest.approx(expected_bill)
+
+    def test_resume_from_state(self, tou_tariff, meter_data):
+        accumulator = BillAccumulator(tou_tariff)
+        for chunk in chunks(meter_data, 2000):
+            accumulator = BillAccumulator.from_state(tou_tariff, json.loads(json.dumps(accumulator.state())))
+            accumulator.update(chunk)
+        assert accumulator.total() == pytest.approx(tou_tariff.apply(meter_data))
+
+    def test_fleet_meter_data(self, tou_tariff, meter_data):
+        fleet_data = pandas.concat({'A': meter_data, 'B': meter_data * 2.0}, axis=1)
+        accumulator = BillAccumulator(tou_tariff)
+        for chunk in chunks(fleet_data, 3000):
+            accumulator.update(chunk)
+        totals = accumulator.total()
+        assert totals[0] == pytest.approx(tou_tariff.apply(meter_data))
+        assert totals[1] == pytest.approx(tou_tariff.apply(meter_data * 2.0))
+
+    def test_out_of_order(self, tou_tariff, meter_data):
+        accumulator = BillAccumulator(tou_tariff).update(meter_data.iloc[100:200])
+        with pytest.raises(UserWarning):
+            accumulator.update(meter_data.iloc[:100])